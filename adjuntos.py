@@ -0,0 +1,146 @@
+import base64
+import hashlib
+import mimetypes
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+from email.mime.base import MIMEBase
+
+# =====================================================
+# ADJUNTOS CODIFICADOS EN DISCO
+# =====================================================
+
+# 57 bytes son una línea de 76 caracteres en base64: los bloques múltiplos de
+# 57 se codifican por separado sin cortar líneas
+BLOQUE = 57 * 1150
+
+
+def tipo_mime(nombre):
+    """Tipo MIME según la extensión del archivo"""
+    mime_type, _ = mimetypes.guess_type(nombre)
+    return mime_type or 'application/octet-stream'
+
+
+def parte_base64(nombre, codificado):
+    """Parte MIME de adjunto con el contenido ya codificado en base64"""
+    maintype, subtype = tipo_mime(nombre).split('/', 1)
+    part = MIMEBase(maintype, subtype)
+    part['Content-Transfer-Encoding'] = 'base64'
+    part.add_header('Content-Disposition', 'attachment', filename=nombre)
+    part.set_payload(codificado)
+    return part
+
+
+def leer_por_bloques(archivo, tamano=BLOQUE):
+    """Contenido de un archivo abierto (o de un archivo subido) por bloques"""
+    archivo.seek(0)
+    while True:
+        bloque = archivo.read(tamano)
+        if not bloque:
+            return
+        yield bloque
+
+
+def hash_archivo(archivo):
+    """sha256 de un archivo abierto sin leerlo completo en memoria"""
+    digest = hashlib.sha256()
+    for bloque in leer_por_bloques(archivo):
+        digest.update(bloque)
+    return digest.hexdigest()
+
+
+def codificar_base64(bloques, destino):
+    """Escribir en `destino` el base64 de los bloques en líneas de 76
+    caracteres con CRLF, como lo deja el generador de email para SMTP.
+    Devuelve los bytes escritos"""
+    escritos = 0
+    resto = b''
+    for bloque in bloques:
+        datos = resto + bloque
+        completo = len(datos) - len(datos) % 57
+        resto = datos[completo:]
+        if completo:
+            escritos += destino.write(base64.encodebytes(datos[:completo]).replace(b'\n', b'\r\n'))
+    if resto:
+        escritos += destino.write(base64.encodebytes(resto).replace(b'\n', b'\r\n'))
+    return escritos
+
+
+class CacheAdjuntos:
+    """Adjuntos codificados en base64 una sola vez por contenido y guardados
+    en disco, de donde se transmiten por bloques a cada mensaje de la campaña.
+
+    La memoria que ocupa un adjunto no depende de su tamaño; se borran los
+    menos usados al superar `max_bytes` en disco. Sin `directorio` se usa una
+    carpeta temporal que se elimina al cerrar el proceso."""
+
+    def __init__(self, max_bytes=1024 * 1024 * 1024, directorio=None):
+        self.max_bytes = max_bytes
+        if directorio is None:
+            directorio = tempfile.mkdtemp(prefix="adjuntos_correo_")
+            weakref.finalize(self, shutil.rmtree, directorio, True)
+        os.makedirs(directorio, exist_ok=True)
+        self.directorio = directorio
+        self._codificados = OrderedDict()
+        self._bytes = 0
+        self._candado = threading.Lock()
+
+    def _ruta(self, hash_contenido):
+        return os.path.join(self.directorio, f"{hash_contenido}.b64")
+
+    def guardar(self, hash_contenido, cargar):
+        """Codificar el adjunto si aún no está en disco; `cargar()` devuelve sus
+        bloques y sólo se llama si hace falta"""
+        with self._candado:
+            if hash_contenido in self._codificados:
+                self._codificados.move_to_end(hash_contenido)
+                return
+        ruta = self._ruta(hash_contenido)
+        temporal = f"{ruta}.{threading.get_ident()}.tmp"
+        with open(temporal, 'wb') as destino:
+            tamano = codificar_base64(cargar(), destino)
+        os.replace(temporal, ruta)
+        with self._candado:
+            if hash_contenido not in self._codificados:
+                self._codificados[hash_contenido] = tamano
+                self._bytes += tamano
+            self._descartar(conservar=hash_contenido)
+
+    def _descartar(self, conservar):
+        while self._bytes > self.max_bytes and len(self._codificados) > 1:
+            hash_contenido = next(iter(self._codificados))
+            if hash_contenido == conservar:
+                self._codificados.move_to_end(hash_contenido)
+                continue
+            self._bytes -= self._codificados.pop(hash_contenido)
+            try:
+                # Un envío que ya lo abrió sigue leyéndolo (POSIX)
+                os.remove(self._ruta(hash_contenido))
+            except OSError:
+                pass
+
+    def _abrir(self, hash_contenido, cargar):
+        while True:
+            with self._candado:
+                if hash_contenido in self._codificados:
+                    self._codificados.move_to_end(hash_contenido)
+                    return open(self._ruta(hash_contenido), 'rb')
+            self.guardar(hash_contenido, cargar)
+
+    def bloques(self, hash_contenido, cargar, tamano=BLOQUE):
+        """Base64 del adjunto (con CRLF) leído del disco por bloques"""
+        with self._abrir(hash_contenido, cargar) as archivo:
+            while True:
+                bloque = archivo.read(tamano)
+                if not bloque:
+                    return
+                yield bloque
+
+    def parte_guardada(self, hash_contenido, nombre, cargar):
+        """Parte MIME completa en memoria, para los mensajes que debe
+        serializar smtplib.send_message"""
+        codificado = b''.join(self.bloques(hash_contenido, cargar))
+        return parte_base64(nombre, codificado.decode('ascii'))
@@ -0,0 +1,214 @@
+import re
+from datetime import datetime
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from email_validator import EmailNotValidError, validate_email
+
+# =====================================================
+# ANÁLISIS DE CALIFICACIONES POR INSTITUCIÓN
+# =====================================================
+
+CONFIGURACIONES_INSTITUCIONES = {
+    "uveg": {
+        "nombre": "UVEG",
+        "columnas_actividades": [
+            "Paquete SCORM:R1. Conversiones entre sistemas numéricos (Real)",
+            "Paquete SCORM:R2. Operaciones aritméticas con sistema binario, octal y hexadecimal (Real)",
+            "Tarea:R3. Operaciones con conjuntos y su representación (Real)",
+            "Tarea:R4. Proposiciones lógicas (Real)",
+            "Paquete SCORM:R5. Operadores lógicos y tablas de verdad (Real)",
+            "Paquete SCORM:R6. Relaciones y operaciones con relaciones (Real)",
+            "Tarea:R7. Propiedades de las relaciones: representación gráfica (Real)"
+        ],
+        "nombres_actividades": [
+            "R1. Conversiones entre sistemas numéricos",
+            "R2. Operaciones aritméticas con sistema binario, octal y hexadecimal",
+            "R3. Operaciones con conjuntos y su representación",
+            "R4. Proposiciones lógicas",
+            "R5. Operadores lógicos y tablas de verdad",
+            "R6. Relaciones y operaciones con relaciones",
+            "R7. Propiedades de las relaciones: representación gráfica"
+        ],
+        "columnas_requeridas": ["Nombre", "Apellido(s)", "Correo Personal", "Dirección Email"],
+        "modulo_default": "Matemáticas Discretas"
+    },
+    "novauniversitas": {
+        "nombre": "NovaUniversitas",
+        "columnas_actividades": [
+            "Examen:Examen desafío 1 (Real)",
+            "Examen:Examen desafío 2 (Real)",
+            "Tarea:Evaluación desafío 3 (Real)",
+            "Tarea:Examen desafío 4 (Real)",
+            "Examen:Evaluación desafío 5 (Real)",
+            "Examen:Evaluación desafío 6 (Real)",
+            "Foro:todo el foro Foro desafío 7 (Real)"
+        ],
+        "nombres_actividades": [
+            "Desafío 1. Examen desafío 1",
+            "Desafío 2. Examen desafío 2",
+            "Desafío 3. Evaluación desafío 3",
+            "Desafío 4. Examen desafío 4",
+            "Desafío 5. Evaluación desafío 5",
+            "Desafío 6. Evaluación desafío 6",
+            "Desafío 7. Foro desafío 7"
+        ],
+        "columnas_requeridas": ["Nombre", "Correo Personal", "Dirección Email"],
+        "modulo_default": "Matemáticas Discretas"
+    }
+}
+
+def convertir_a_numerico(valor):
+    if pd.isna(valor):
+        return 0
+    if isinstance(valor, str):
+        valor_limpio = valor.strip()
+        if not valor_limpio:
+            return 0
+        try:
+            return float(valor_limpio)
+        except ValueError:
+            return 0
+    try:
+        return float(valor)
+    except (ValueError, TypeError):
+        return 0
+
+def valores_actividad(columna):
+    """convertir_a_numerico aplicado a toda una columna de calificaciones"""
+    numeros = pd.to_numeric(columna, errors='coerce')
+    if not pd.api.types.is_numeric_dtype(columna):
+        # Lo que to_numeric no entiende ("-", "1_000", fechas...) se resuelve con
+        # convertir_a_numerico, una sola vez por valor distinto
+        dudosos = numeros.isna() & columna.notna()
+        if dudosos.any():
+            numeros = numeros.astype(float)
+            valores = columna[dudosos]
+            convertidos = {valor: convertir_a_numerico(valor) for valor in valores.unique()}
+            numeros[dudosos] = valores.map(convertidos)
+    return numeros.fillna(0)
+
+def matriz_completadas(df, columnas_actividades):
+    """Matriz booleana estudiante x actividad (sólo columnas presentes en el Excel)"""
+    presentes = [col for col in columnas_actividades if col in df.columns]
+    return pd.DataFrame({col: valores_actividad(df[col]) > 0 for col in presentes}, index=df.index)
+
+def mascaras_completadas(completadas, columnas_actividades):
+    """Entero por estudiante con el bit i encendido si completó la actividad i"""
+    mascara = np.zeros(len(completadas), dtype=np.int64)
+    for i, col in enumerate(columnas_actividades):
+        if col in completadas.columns:
+            mascara |= completadas[col].to_numpy(dtype=np.int64) << i
+    return pd.Series(mascara, index=completadas.index)
+
+# Con 7 actividades hay a lo más 128 máscaras: cada bloque "1. R1 ..." se arma
+# una vez por (institución, máscara, requeridas) y se reutiliza en todo el envío
+@lru_cache(maxsize=None)
+def lista_actividades_completadas(institucion, mascara):
+    nombres = CONFIGURACIONES_INSTITUCIONES[institucion]['nombres_actividades']
+    completadas = [nombre for i, nombre in enumerate(nombres) if mascara >> i & 1]
+    return "\n".join([f"{i+1}. {act}" for i, act in enumerate(completadas)])
+
+@lru_cache(maxsize=None)
+def lista_actividades_faltantes(institucion, mascara, actividades_requeridas):
+    nombres = CONFIGURACIONES_INSTITUCIONES[institucion]['nombres_actividades']
+    faltantes = [nombres[i] for i in range(actividades_requeridas) if not mascara >> i & 1]
+    return "\n".join([f"{i+1}. {act}" for i, act in enumerate(faltantes)])
+
+COLUMNAS_EMAIL = ['Correo Personal', 'Dirección Email']
+
+# Parte local "dot-atom" ASCII (RFC 5322), la de casi todas las direcciones
+PARTE_LOCAL_SIMPLE = re.compile(r"[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+(\.[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+)*")
+
+def _sintaxis_valida(email_str):
+    try:
+        validate_email(email_str, check_deliverability=False)
+        return True
+    except EmailNotValidError:
+        return False
+
+@lru_cache(maxsize=10000)
+def _dominio_valido(dominio):
+    # La validación IDNA del dominio es lo costoso y un roster tiene pocos dominios
+    return _sintaxis_valida(f"a@{dominio}")
+
+@lru_cache(maxsize=100000)
+def direccion_valida(email_str):
+    """Sintaxis de una dirección según email-validator (sin consultar DNS);
+    cada dirección distinta se valida una sola vez por proceso"""
+    local, arroba, dominio = email_str.rpartition('@')
+    if not arroba or not local or not _dominio_valido(dominio):
+        return False
+    if len(local) <= 64 and len(email_str) <= 254 and PARTE_LOCAL_SIMPLE.fullmatch(local):
+        return True
+    # Partes locales entre comillas, no ASCII o demasiado largas
+    return _sintaxis_valida(email_str)
+
+def emails_validos_roster(df, columnas=COLUMNAS_EMAIL):
+    """Direcciones válidas de cada estudiante, para todo el roster a la vez.
+
+    Se guarda como columna 'emails_validos' y la usan las estadísticas, la
+    vista previa y los envíos sin volver a validar fila por fila."""
+    validas_por_columna = []
+    for col in columnas:
+        if col not in df.columns:
+            continue
+        direcciones = df[col].astype('string').str.strip().astype(object)
+        validas = {d for d in direcciones.dropna().unique() if d and direccion_valida(d)}
+        validas_por_columna.append([d if d in validas else None for d in direcciones.tolist()])
+    if not validas_por_columna:
+        return pd.Series([[] for _ in range(len(df))], index=df.index, dtype=object)
+    return pd.Series(
+        [[d for d in fila if d is not None] for fila in zip(*validas_por_columna)],
+        index=df.index, dtype=object
+    )
+
+COLUMNAS_NOMBRE = ['Nombre', 'Apellido(s)']
+
+def columnas_roster(config_institucion):
+    """Columnas que usa el análisis de una institución; el resto del reporte
+    de calificaciones no se lee. Devuelve (columnas, columnas de texto)"""
+    texto = COLUMNAS_NOMBRE + COLUMNAS_EMAIL
+    columnas = list(dict.fromkeys(
+        config_institucion['columnas_requeridas'] + texto + config_institucion['columnas_actividades']
+    ))
+    return columnas, texto
+
+def obtener_nombre_completo(estudiante, institucion):
+    nombre = str(estudiante.get('Nombre', 'Apreciable estudiante'))
+    if institucion == "uveg":
+        apellidos = str(estudiante.get('Apellido(s)', ''))
+        return nombre, apellidos
+    else:
+        return nombre, ""
+
+def nombres_roster(df):
+    """Nombre de cada estudiante del DataFrame, como obtener_nombre_completo"""
+    if 'Nombre' not in df.columns:
+        return ['Apreciable estudiante'] * len(df)
+    return [str(nombre) for nombre in df['Nombre'].tolist()]
+
+def formatear_fecha(fecha_str):
+    try:
+        fecha = datetime.strptime(fecha_str, "%Y-%m-%d")
+        dias = ["lunes", "martes", "miércoles", "jueves", "viernes", "sábado", "domingo"]
+        meses = ["enero", "febrero", "marzo", "abril", "mayo", "junio",
+                "julio", "agosto", "septiembre", "octubre", "noviembre", "diciembre"]
+        dia_semana = dias[fecha.weekday()]
+        dia = fecha.day
+        mes = meses[fecha.month - 1]
+        return f"{dia_semana} {dia} de {mes}"
+    except:
+        return fecha_str
+
+def clasificar_estudiantes(df, config_institucion, actividades_requeridas):
+    """Separar el roster en completos, incompletos y sin entregas"""
+    completadas = matriz_completadas(df, config_institucion['columnas_actividades'])
+    df['actividades_completadas'] = completadas.sum(axis=1).astype(int)
+    df['mascara_actividades'] = mascaras_completadas(completadas, config_institucion['columnas_actividades'])
+    
+    estudiantes_completos = df[df['actividades_completadas'] >= actividades_requeridas]
+    estudiantes_incompletos = df[(df['actividades_completadas'] > 0) & (df['actividades_completadas'] < actividades_requeridas)]
+    estudiantes_sin_entregas = df[df['actividades_completadas'] == 0]
+    return estudiantes_completos, estudiantes_incompletos, estudiantes_sin_entregas
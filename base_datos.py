@@ -0,0 +1,441 @@
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+# =====================================================
+# BASE DE DATOS SQLITE PERSISTENTE
+# =====================================================
+
+# Ruta configurable para el worker de envíos y las pruebas
+DB_FILE = os.environ.get("SISTEMA_CORREOS_DB", "sistema_correos.db")
+
+# WAL: las lecturas de la interfaz no bloquean al worker que escribe, y con
+# synchronous=NORMAL cada commit ya no espera un fsync
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=30000",
+)
+
+class GestorConexiones:
+    """Conexiones SQLite reutilizables por todo el proceso.
+
+    Vive a nivel de módulo, así que sobrevive a los reruns de Streamlit y lo
+    comparten la interfaz y el hilo del worker. Cada operación toma una
+    conexión libre (nunca la usan dos hilos a la vez) y la devuelve al
+    terminar, conservando su caché de sentencias preparadas."""
+
+    def __init__(self, max_libres=8, sentencias=256):
+        self.max_libres = max_libres
+        self.sentencias = sentencias
+        self._libres = {}
+        self._candado = threading.Lock()
+
+    def _abrir(self, ruta):
+        conn = sqlite3.connect(ruta, timeout=30, check_same_thread=False,
+                               cached_statements=self.sentencias)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def tomar(self, ruta):
+        with self._candado:
+            libres = self._libres.get(ruta)
+            if libres:
+                return libres.pop()
+        return self._abrir(ruta)
+
+    def devolver(self, ruta, conn):
+        with self._candado:
+            libres = self._libres.setdefault(ruta, [])
+            if len(libres) < self.max_libres:
+                libres.append(conn)
+                return
+        conn.close()
+
+    def cerrar_todo(self):
+        with self._candado:
+            for libres in self._libres.values():
+                for conn in libres:
+                    conn.close()
+            self._libres = {}
+
+gestor_conexiones = GestorConexiones()
+
+@contextmanager
+def conectar():
+    """Conexión compartida a la base de datos (app y worker): commit al salir
+    del bloque, rollback si hubo error"""
+    ruta = DB_FILE
+    conn = gestor_conexiones.tomar(ruta)
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        gestor_conexiones.devolver(ruta, conn)
+
+def init_database():
+    """Inicializar base de datos SQLite"""
+    with conectar() as conn:
+        cursor = conn.cursor()
+    
+        # Tabla de cuentas
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS cuentas (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                nombre TEXT UNIQUE NOT NULL,
+                email TEXT NOT NULL,
+                password TEXT NOT NULL,
+                ultima_uso TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+    
+        # Tabla de plantillas
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS plantillas (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                institucion TEXT NOT NULL,
+                tipo TEXT NOT NULL,
+                nombre TEXT NOT NULL,
+                asunto TEXT NOT NULL,
+                mensaje TEXT NOT NULL,
+                fecha_modificacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(institucion, tipo)
+            )
+        ''')
+    
+        # Tabla de historial
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS historial (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                asunto TEXT,
+                destinatario TEXT,
+                estado TEXT
+            )
+        ''')
+        # Paginación por (timestamp, id) y filtros del visor de historial
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_historial_timestamp ON historial (timestamp)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_historial_destinatario ON historial (destinatario)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_historial_estado ON historial (estado)')
+    
+        # Bandeja de salida: mensajes ya redactados que envía el worker
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                campana TEXT NOT NULL,
+                origen TEXT,
+                servidor TEXT NOT NULL,
+                puerto INTEGER NOT NULL,
+                seguridad TEXT,
+                usuario TEXT NOT NULL,
+                password TEXT,
+                cuentas TEXT,
+                cuota INTEGER,
+                destinatarios TEXT NOT NULL,
+                asunto TEXT,
+                cuerpo TEXT,
+                adjuntos TEXT,
+                claves TEXT,
+                estado TEXT NOT NULL DEFAULT 'pendiente',
+                intentos INTEGER NOT NULL DEFAULT 0,
+                proximo_intento REAL NOT NULL DEFAULT 0,
+                trabajador TEXT,
+                tomado REAL,
+                resultado TEXT,
+                creado TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                actualizado TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_outbox_estado ON outbox (estado, proximo_intento)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_outbox_campana ON outbox (campana)')
+        # La bandeja ya no guarda contraseñas: se borran las que quedaron de
+        # versiones anteriores
+        cursor.execute('UPDATE outbox SET password = NULL WHERE password IS NOT NULL')
+        # Ni los cuerpos de los mensajes ya enviados o cancelados (las plantillas
+        # de cuentas llevan contraseñas temporales)
+        cursor.execute('''
+            UPDATE outbox SET cuerpo = NULL
+            WHERE estado IN ('enviado', 'cancelado') AND cuerpo IS NOT NULL
+        ''')
+    
+        # Entregas por clave de idempotencia (campaña, estudiante, dirección, plantilla):
+        # se registran antes y después de cada transacción SMTP
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS entregas (
+                clave TEXT PRIMARY KEY,
+                campana TEXT NOT NULL,
+                destinatario TEXT NOT NULL,
+                estado TEXT NOT NULL,
+                actualizado TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+    
+        # Adjuntos de la bandeja, guardados una sola vez por contenido
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS outbox_adjuntos (
+                hash TEXT PRIMARY KEY,
+                contenido BLOB NOT NULL
+            )
+        ''')
+    
+        # Campañas pausadas o canceladas desde la interfaz; el worker lo consulta
+        # antes de cada mensaje
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS campanas (
+                campana TEXT PRIMARY KEY,
+                estado TEXT NOT NULL,
+                actualizado TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+def guardar_cuenta_db(nombre, email, password):
+    """Guardar cuenta en base de datos"""
+    with conectar() as conn:
+        conn.execute('''
+            INSERT OR REPLACE INTO cuentas (nombre, email, password, ultima_uso)
+            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+        ''', (nombre, email, password))
+    return True
+
+def cargar_cuentas_db():
+    """Cargar todas las cuentas de la base de datos"""
+    with conectar() as conn:
+        rows = conn.execute('SELECT nombre, email, password, ultima_uso FROM cuentas ORDER BY ultima_uso DESC').fetchall()
+    cuentas = {}
+    for row in rows:
+        cuentas[row[0]] = {
+            'email': row[1],
+            'password': row[2],
+            'ultima_uso': row[3]
+        }
+    return cuentas
+
+def eliminar_cuenta_db(nombre):
+    """Eliminar cuenta de la base de datos"""
+    with conectar() as conn:
+        conn.execute('DELETE FROM cuentas WHERE nombre = ?', (nombre,))
+
+# Funciones que se llaman con (institucion, tipo) al guardar una plantilla
+_oyentes_plantillas = []
+
+def al_guardar_plantilla(funcion):
+    """Registrar `funcion(institucion, tipo)` para invalidar cachés de plantillas"""
+    _oyentes_plantillas.append(funcion)
+    return funcion
+
+def guardar_plantilla_db(institucion, tipo, nombre, asunto, mensaje):
+    """Guardar plantilla en base de datos"""
+    with conectar() as conn:
+        conn.execute('''
+            INSERT OR REPLACE INTO plantillas (institucion, tipo, nombre, asunto, mensaje, fecha_modificacion)
+            VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ''', (institucion, tipo, nombre, asunto, mensaje))
+    for funcion in _oyentes_plantillas:
+        funcion(institucion, tipo)
+
+def cargar_plantilla_db(institucion, tipo):
+    """Cargar plantilla de la base de datos"""
+    with conectar() as conn:
+        row = conn.execute('''
+            SELECT nombre, asunto, mensaje FROM plantillas 
+            WHERE institucion = ? AND tipo = ?
+        ''', (institucion, tipo)).fetchone()
+    if row:
+        return {'nombre': row[0], 'asunto': row[1], 'mensaje': row[2]}
+    return None
+
+class EscritorHistorial:
+    """Escritura diferida del historial.
+
+    Quien envía sólo encola la fila (con su hora) y un hilo en segundo plano
+    la escribe junto con las demás en una transacción `executemany` cada
+    `lote` filas o cada `intervalo` segundos. `vaciar()` espera a que todo lo
+    encolado esté en la base de datos (fin de campaña, cierre del proceso)."""
+
+    def __init__(self, lote=500, intervalo=0.25, reintentos=3):
+        self.lote = lote
+        self.intervalo = intervalo
+        self.reintentos = reintentos
+        self.escritas = 0
+        # Filas que no se pudieron escribir; la interfaz las muestra con el error
+        self.perdidas = 0
+        self.ultimo_error = None
+        self._cola = queue.Queue()
+        self._hilo = None
+        self._candado = threading.Lock()
+
+    def agregar(self, asunto, destinatario, estado):
+        # Misma hora y formato que CURRENT_TIMESTAMP (UTC) al encolar
+        marca = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+        self._cola.put((marca, asunto, destinatario, estado))
+        self._arrancar()
+
+    def _arrancar(self):
+        with self._candado:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._ejecutar, name="escritor-historial", daemon=True)
+                self._hilo.start()
+
+    def _ejecutar(self):
+        while True:
+            elementos = [self._cola.get()]
+            limite = time.monotonic() + self.intervalo
+            # None lo encola vaciar(): se escribe ya lo acumulado
+            while elementos[-1] is not None and len(elementos) < self.lote:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                try:
+                    elementos.append(self._cola.get(timeout=restante))
+                except queue.Empty:
+                    break
+            filas = [fila for fila in elementos if fila is not None]
+            try:
+                if filas:
+                    self._escribir(filas)
+            except Exception as e:
+                # Un error inesperado no debe terminar el hilo: vaciar() lo espera
+                self.ultimo_error = str(e)
+                self.perdidas += len(filas)
+            finally:
+                for _ in elementos:
+                    self._cola.task_done()
+
+    def _escribir(self, filas):
+        for intento in range(1, self.reintentos + 1):
+            try:
+                with conectar() as conn:
+                    conn.executemany('''
+                        INSERT INTO historial (timestamp, asunto, destinatario, estado)
+                        VALUES (?, ?, ?, ?)
+                    ''', filas)
+                self.escritas += len(filas)
+                return
+            except sqlite3.Error as e:
+                self.ultimo_error = str(e)
+                if intento < self.reintentos:
+                    time.sleep(intento)
+        self.perdidas += len(filas)
+
+    def pendientes(self):
+        return self._cola.unfinished_tasks
+
+    def vaciar(self):
+        """Bloquear hasta que todas las filas encoladas estén escritas. Si el
+        hilo escritor ya no existe, lo pendiente se escribe en este hilo (al
+        cerrar el proceso ya no se pueden crear hilos)"""
+        if self._hilo is None:
+            return
+        self._cola.put(None)
+        with self._cola.all_tasks_done:
+            while self._cola.unfinished_tasks:
+                if not self._hilo.is_alive():
+                    break
+                self._cola.all_tasks_done.wait(0.5)
+            else:
+                return
+        self._escribir_pendientes()
+
+    def _escribir_pendientes(self):
+        filas = []
+        while True:
+            try:
+                elemento = self._cola.get_nowait()
+            except queue.Empty:
+                break
+            self._cola.task_done()
+            if elemento is not None:
+                filas.append(elemento)
+        if filas:
+            self._escribir(filas)
+
+escritor_historial = EscritorHistorial()
+atexit.register(escritor_historial.vaciar)
+
+def guardar_historial_db(asunto, destinatario, estado):
+    """Guardar en historial (se encola; el escritor lo graba por lotes)"""
+    escritor_historial.agregar(asunto, destinatario, estado)
+
+ESTADO_ENVIADO = 'Enviado'
+
+def _filtros_historial(desde=None, hasta=None, destinatario=None, estado=None, asunto=None):
+    """Condiciones WHERE del historial. `desde`/`hasta` son fechas (UTC, como
+    se guardan), `destinatario` se busca por prefijo para usar el índice,
+    `estado` es 'enviado' o 'error' y `asunto` se busca como texto contenido"""
+    condiciones = []
+    parametros = []
+    if desde:
+        condiciones.append('timestamp >= ?')
+        parametros.append(f"{desde:%Y-%m-%d}")
+    if hasta:
+        condiciones.append('timestamp < ?')
+        parametros.append(f"{hasta + timedelta(days=1):%Y-%m-%d}")
+    if destinatario:
+        condiciones.append('destinatario >= ? AND destinatario < ?')
+        parametros.extend([destinatario, destinatario + '\U0010ffff'])
+    if estado == 'enviado':
+        condiciones.append('estado = ?')
+        parametros.append(ESTADO_ENVIADO)
+    elif estado == 'error':
+        condiciones.append('estado != ?')
+        parametros.append(ESTADO_ENVIADO)
+    if asunto:
+        condiciones.append("asunto LIKE ? ESCAPE '\\'")
+        texto = asunto.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        parametros.append(f"%{texto}%")
+    return condiciones, parametros
+
+def cargar_historial_db(limite=100, despues_de=None, **filtros):
+    """Cargar una página del historial, del más reciente al más antiguo.
+
+    Paginación por llave: `despues_de` es el (timestamp, id) de la última fila
+    de la página anterior, así cada página cuesta lo mismo sin importar
+    cuántas filas tenga la tabla. `filtros` como en _filtros_historial."""
+    condiciones, parametros = _filtros_historial(**filtros)
+    if despues_de is not None:
+        condiciones.append('(timestamp < ? OR (timestamp = ? AND id < ?))')
+        parametros.extend([despues_de[0], despues_de[0], despues_de[1]])
+    where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ''
+    with conectar() as conn:
+        rows = conn.execute(f'''
+            SELECT id, timestamp, asunto, destinatario, estado 
+            FROM historial 
+            {where}
+            ORDER BY timestamp DESC, id DESC 
+            LIMIT ?
+        ''', (*parametros, limite)).fetchall()
+    historial = []
+    for row in rows:
+        historial.append({
+            'id': row[0],
+            'timestamp': row[1],
+            'asunto': row[2],
+            'destinatario': row[3],
+            'estado': row[4]
+        })
+    return historial
+
+def resumen_historial_db(**filtros):
+    """Totales de todo el historial (con los mismos filtros) calculados en SQL"""
+    condiciones, parametros = _filtros_historial(**filtros)
+    where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ''
+    with conectar() as conn:
+        total, enviados = conn.execute(f'''
+            SELECT COUNT(*), COALESCE(SUM(estado = ?), 0) FROM historial {where}
+        ''', (ESTADO_ENVIADO, *parametros)).fetchone()
+    return {'total': total, 'enviados': enviados, 'fallidos': total - enviados}
+
+def limpiar_historial_db():
+    """Limpiar historial"""
+    escritor_historial.vaciar()
+    with conectar() as conn:
+        conn.execute('DELETE FROM historial')
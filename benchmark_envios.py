@@ -0,0 +1,440 @@
+import argparse
+import os
+import random
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import base_datos
+import outbox
+from analisis import (
+    CONFIGURACIONES_INSTITUCIONES, clasificar_estudiantes, columnas_roster, emails_validos_roster,
+    formatear_fecha
+)
+from libros import leer_hoja
+from limitador import LimitadorEnvios
+from plantillas import PLANTILLAS_PRACTICAS, generar_mensaje_personalizado, redactar_lote, redactar_practicas
+from worker_envios import TrabajadorEnvios, construir_mensaje
+
+# =====================================================
+# BENCHMARK: ROSTERS SINTÉTICOS Y SERVIDOR SMTP LOCAL
+# =====================================================
+#
+# python benchmark_envios.py --filas 100 1000 --latencia-ms 20 --error-temporal 0.01
+#
+# Nada sale a Internet: los correos van a un servidor SMTP dentro del mismo
+# proceso y la bandeja de salida usa una base de datos temporal.
+
+TAMANOS = [100, 1000, 10000, 100000]
+ROSTERS = ["uveg", "novauniversitas", "practicas", "bienvenida_nova"]
+
+NOMBRES = ["Ana", "Luis", "María", "José", "Fernanda", "Carlos", "Sofía", "Miguel", "Valeria", "Jorge"]
+APELLIDOS = ["García", "Hernández", "López", "Martínez", "González", "Pérez", "Rodríguez", "Sánchez"]
+
+
+# =====================================================
+# SERVIDOR SMTP DE PRUEBA
+# =====================================================
+
+class _ManejadorSMTP(socketserver.StreamRequestHandler):
+    """Diálogo SMTP mínimo: acepta AUTH sin verificar y descarta los mensajes"""
+
+    def responder(self, texto):
+        self.wfile.write((texto + "\r\n").encode())
+
+    def handle(self):
+        servidor = self.server
+        with servidor.candado:
+            servidor.conexiones += 1
+        self.responder("220 sumidero ESMTP")
+        en_datos = False
+        while True:
+            linea = self.rfile.readline()
+            if not linea:
+                return
+            if en_datos:
+                if linea == b".\r\n":
+                    en_datos = False
+                    if servidor.latencia:
+                        time.sleep(servidor.latencia)
+                    with servidor.candado:
+                        servidor.mensajes += 1
+                    self.responder("250 2.0.0 OK")
+                continue
+            comando = linea.decode('utf-8', 'replace').strip().upper()
+            if comando.startswith(("EHLO", "HELO")):
+                self.wfile.write(b"250-sumidero\r\n250-8BITMIME\r\n250 AUTH PLAIN LOGIN\r\n")
+            elif comando.startswith("AUTH"):
+                self.responder("235 2.7.0 Authentication successful")
+            elif comando.startswith("RCPT"):
+                azar = servidor.azar.random()
+                if azar < servidor.error_permanente:
+                    self.responder("550 5.1.1 User unknown")
+                elif azar < servidor.error_permanente + servidor.error_temporal:
+                    self.responder("451 4.3.0 Try again later")
+                else:
+                    self.responder("250 2.1.5 OK")
+            elif comando.startswith("DATA"):
+                en_datos = True
+                self.responder("354 End data with <CR><LF>.<CR><LF>")
+            elif comando.startswith("QUIT"):
+                self.responder("221 2.0.0 Bye")
+                return
+            else:
+                self.responder("250 OK")
+
+
+class ServidorSMTPPrueba(socketserver.ThreadingTCPServer):
+    """Sumidero SMTP en 127.0.0.1 con latencia por mensaje y errores por
+    destinatario (`error_temporal` 451, `error_permanente` 550) inyectados"""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, latencia=0.0, error_temporal=0.0, error_permanente=0.0, semilla=0):
+        super().__init__(("127.0.0.1", 0), _ManejadorSMTP)
+        self.latencia = latencia
+        self.error_temporal = error_temporal
+        self.error_permanente = error_permanente
+        self.azar = random.Random(semilla)
+        self.candado = threading.Lock()
+        self.conexiones = 0
+        self.mensajes = 0
+
+    @property
+    def puerto(self):
+        return self.server_address[1]
+
+    def iniciar(self):
+        threading.Thread(target=self.serve_forever, name="smtp-prueba", daemon=True).start()
+        return self
+
+
+# =====================================================
+# ROSTERS SINTÉTICOS
+# =====================================================
+
+def _calificacion(azar):
+    """Valor de una actividad con la variedad que trae el Excel real"""
+    opcion = azar.random()
+    if opcion < 0.35:
+        return round(azar.uniform(6, 10), 2)
+    if opcion < 0.5:
+        return f"{azar.uniform(6, 10):.2f}"
+    if opcion < 0.7:
+        return "-"
+    if opcion < 0.8:
+        return 0
+    return None
+
+
+def generar_roster(tipo, filas, semilla=0, columnas_extra=0):
+    """DataFrame sintético con las columnas que espera cada pestaña, más
+    `columnas_extra` calificaciones que no usa (como un reporte de Moodle)"""
+    azar = random.Random(semilla)
+    registros = []
+    for i in range(filas):
+        nombre = azar.choice(NOMBRES)
+        apellidos = f"{azar.choice(APELLIDOS)} {azar.choice(APELLIDOS)}"
+        personal = f"alumno{i}@correo.example.com"
+        institucional = f"a{i:06d}@institucion.example.edu"
+        if tipo == "bienvenida_nova":
+            registro = {
+                'Nombre': f"{nombre} {apellidos}",
+                'Email_personal': personal,
+                'Correo Institucional': institucional,
+                'Contraseña': f"{azar.randrange(10 ** 9):010d}"
+            }
+            for k in range(columnas_extra):
+                registro[f"Dato extra {k + 1}"] = f"{azar.randrange(10 ** 6)}"
+            registros.append(registro)
+            continue
+        registro = {'Nombre': nombre, 'Apellido(s)': apellidos,
+                    'Correo Personal': personal, 'Dirección Email': institucional}
+        if tipo == "novauniversitas":
+            del registro['Apellido(s)']
+        if tipo in CONFIGURACIONES_INSTITUCIONES:
+            for columna in CONFIGURACIONES_INSTITUCIONES[tipo]['columnas_actividades']:
+                registro[columna] = _calificacion(azar)
+        for k in range(columnas_extra):
+            registro[f"Cuestionario:Actividad extra {k + 1} (Real)"] = _calificacion(azar)
+        registros.append(registro)
+    return pd.DataFrame(registros)
+
+
+def escribir_roster(tipo, filas, directorio, columnas_extra=0):
+    """Guardar el roster en .xlsx (se reutiliza si ya existe)"""
+    ruta = os.path.join(directorio, f"roster_{tipo}_{filas}_{columnas_extra}.xlsx")
+    if not os.path.exists(ruta):
+        hoja = "Calificaciones" if tipo == "practicas" else "Hoja1"
+        generar_roster(tipo, filas, columnas_extra=columnas_extra).to_excel(ruta, sheet_name=hoja, index=False)
+    return ruta
+
+
+# Columnas que lee cada pestaña (las mismas que en la app)
+COLUMNAS_PRACTICAS = ['Nombre', 'Apellido(s)', 'Correo Personal', 'Dirección Email']
+COLUMNAS_BIENVENIDA = ['Nombre', 'Email_personal', 'Correo Institucional', 'Contraseña']
+
+
+def leer_roster(tipo, ruta):
+    """Leer el roster como lo hace la pestaña correspondiente"""
+    with open(ruta, 'rb') as f:
+        contenido = f.read()
+    if tipo == "practicas":
+        return leer_hoja(contenido, 'Calificaciones', COLUMNAS_PRACTICAS, COLUMNAS_PRACTICAS)
+    if tipo != "bienvenida_nova":
+        return leer_hoja(contenido, 'Hoja1', *columnas_roster(CONFIGURACIONES_INSTITUCIONES[tipo]))
+    df = leer_hoja(contenido, 'Hoja1', COLUMNAS_BIENVENIDA, COLUMNAS_BIENVENIDA)
+    df = df.dropna(subset=['Nombre', 'Email_personal', 'Correo Institucional'])
+    df['emails_validos'] = emails_validos_roster(df, ['Email_personal'])
+    return df
+
+
+# =====================================================
+# ETAPAS
+# =====================================================
+
+def percentil(valores, p):
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+
+def rss_pico_mb():
+    """RSS máximo del proceso hasta ahora (Linux reporta KiB, macOS bytes)"""
+    if resource is None:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pico / (1024 * 1024) if sys.platform == "darwin" else pico / 1024
+
+
+def medir(etapa, roster, filas, funcion):
+    """Ejecutar una etapa y devolver (resultado, métricas); `funcion` devuelve
+    (resultado, mensajes, latencias en segundos)"""
+    inicio = time.perf_counter()
+    resultado, mensajes, latencias = funcion()
+    duracion = time.perf_counter() - inicio
+    p50 = percentil(latencias, 50)
+    p99 = percentil(latencias, 99)
+    return resultado, {
+        'roster': roster,
+        'filas': filas,
+        'etapa': etapa,
+        'mensajes': mensajes,
+        'segundos': round(duracion, 3),
+        'msgs/s': round(mensajes / duracion, 1) if duracion > 0 else None,
+        'p50 ms': round(p50 * 1000, 2) if p50 is not None else None,
+        'p99 ms': round(p99 * 1000, 2) if p99 is not None else None,
+        'RSS pico MB': round(rss_pico_mb(), 1) if resource else None
+    }
+
+
+def variables_semana(config_institucion, semana=2):
+    """Variables de plantilla como las arma la pestaña 1"""
+    return {
+        'modulo': "Matemáticas discretas",
+        'semana': f"semana {semana}",
+        'semana_actual': f"semana {semana}",
+        'institucion': config_institucion['nombre'],
+        'fecha_meta': formatear_fecha((datetime.now() + timedelta(days=7)).strftime("%Y-%m-%d")),
+        'fecha_sesion': "",
+        'hora_sesion': "",
+        'parrafo_sesion': ""
+    }
+
+
+def analizar(tipo, df):
+    """Clasificación de la pestaña 1; las otras pestañas no tienen análisis"""
+    if tipo not in CONFIGURACIONES_INSTITUCIONES:
+        return None, 0, []
+    config = CONFIGURACIONES_INSTITUCIONES[tipo]
+    df['emails_validos'] = emails_validos_roster(df)
+    grupos = clasificar_estudiantes(df, config, 3)
+    datos = {
+        'semana': 2,
+        'actividades_requeridas': 3,
+        'institucion': tipo,
+        'config_institucion': config,
+        'variables_extra': variables_semana(config),
+        'grupos': grupos
+    }
+    return datos, len(df), []
+
+
+def redactar(tipo, df, datos, remitente):
+    """Mensajes (destinatarios, asunto, cuerpo, estudiante, plantilla) y la
+    latencia de armar cada uno, incluido el MIME; el render de cada grupo se
+    hace en un lote y se reparte entre sus mensajes"""
+    mensajes = []
+    latencias = []
+
+    def agregar(destinatarios, asunto, cuerpo, indice, plantilla, inicio):
+        construir_mensaje(remitente, destinatarios, asunto, cuerpo).as_bytes()
+        latencias.append(time.perf_counter() - inicio)
+        mensajes.append((destinatarios, asunto, cuerpo, indice, plantilla))
+
+    if datos is not None:
+        for grupo, tipo_plantilla in zip(datos['grupos'],
+                                         ["felicitacion", "seguimiento_atraso", "seguimiento_sin_acceso"]):
+            inicio = time.perf_counter()
+            redactados = redactar_lote(grupo, tipo_plantilla, datos)
+            por_mensaje = (time.perf_counter() - inicio) / max(len(grupo), 1)
+            for indice, asunto, cuerpo, destinatarios in zip(
+                grupo.index, redactados['asunto'], redactados['mensaje'], grupo['emails_validos']
+            ):
+                if destinatarios:
+                    agregar(destinatarios, asunto, cuerpo, indice, tipo_plantilla, time.perf_counter() - por_mensaje)
+    elif tipo == "practicas":
+        plantilla = PLANTILLAS_PRACTICAS["Bienvenida"]
+        inicio = time.perf_counter()
+        cuerpos = redactar_practicas(df, plantilla["contenido"], {
+            'nombre_asesor': "Asesor", 'nombre_completo_asesor': "Asesor de prácticas",
+            'universidad': "UVEG", 'nombre_universidad': "Universidad Virtual del Estado de Guanajuato",
+            'fecha_cierre_actividad': "fecha_cierre_actividad",
+            'fecha_inicio_practicas': "fecha_inicio_practicas",
+            'fecha_fin_practicas': "fecha_fin_practicas", 'info_google_meet': "info_google_meet",
+            'numero_reto': "numero_reto", 'enlace_grabacion': "enlace_grabacion"
+        })
+        por_mensaje = (time.perf_counter() - inicio) / max(len(df), 1)
+        for indice, personal, institucional, cuerpo in zip(
+            df.index, df['Correo Personal'], df['Dirección Email'], cuerpos
+        ):
+            agregar([personal, institucional], plantilla["asunto"], cuerpo, indice, "Bienvenida",
+                    time.perf_counter() - por_mensaje)
+    else:
+        for indice, row in df.iterrows():
+            inicio = time.perf_counter()
+            cuerpo = generar_mensaje_personalizado(row['Nombre'], row['Correo Institucional'], row['Contraseña'])
+            if row['emails_validos']:
+                agregar(row['emails_validos'], "Bienvenida a NovaUniversitas", cuerpo,
+                        indice, "bienvenida_nova", inicio)
+    return mensajes, len(mensajes), latencias
+
+
+def escribir_adjunto(megas, directorio):
+    """Archivo binario de `megas` MB para adjuntar a cada mensaje (se reutiliza)"""
+    ruta = os.path.join(directorio, f"adjunto_{megas:g}mb.bin")
+    if not os.path.exists(ruta):
+        azar = random.Random(megas)
+        with open(ruta, 'wb') as f:
+            restante = int(megas * 1024 * 1024)
+            while restante > 0:
+                bloque = min(restante, 1024 * 1024)
+                f.write(azar.randbytes(bloque))
+                restante -= bloque
+    return ruta
+
+
+def enviar(mensajes, servidor, concurrencia, remitente, adjunto=None):
+    """Encolar en la bandeja y drenarla con el worker contra el servidor local"""
+    campana = outbox.nueva_campana()
+    if adjunto:
+        with open(adjunto, 'rb') as archivo:
+            outbox.encolar(mensajes, campana, "Benchmark", "127.0.0.1", servidor.puerto, remitente, "benchmark",
+                           [(os.path.basename(adjunto), archivo)], seguridad="ninguna")
+    else:
+        outbox.encolar(mensajes, campana, "Benchmark", "127.0.0.1", servidor.puerto, remitente, "benchmark",
+                       seguridad="ninguna")
+    limitador = LimitadorEnvios(por_minuto=10 ** 9, rafaga=10 ** 6, por_minuto_cuenta=10 ** 9,
+                                rafaga_cuenta=10 ** 6)
+    # Sin reintentos: los errores temporales se cuentan, no se esperan
+    trabajador = TrabajadorEnvios(limitador=limitador, concurrencia=concurrencia, max_intentos=1)
+    latencias = []
+    candado = threading.Lock()
+    enviar_fila = trabajador.enviar_fila
+
+    def enviar_medido(fila, preparado=None):
+        inicio = time.perf_counter()
+        try:
+            return enviar_fila(fila, preparado)
+        finally:
+            with candado:
+                latencias.append(time.perf_counter() - inicio)
+
+    trabajador.enviar_fila = enviar_medido
+    try:
+        trabajador.ejecutar(una_vez=True)
+    finally:
+        trabajador.pool.cerrar_todo()
+    return (trabajador.enviados, trabajador.fallidos), len(mensajes), latencias
+
+
+def ejecutar_benchmark(tamanos, rosters, directorio, servidor, concurrencia, sin_envio=False,
+                       columnas_extra=0, adjunto_mb=0):
+    remitente = "benchmark@institucion.example.edu"
+    adjunto = escribir_adjunto(adjunto_mb, directorio) if adjunto_mb else None
+    resultados = []
+    for filas in tamanos:
+        for tipo in rosters:
+            ruta = escribir_roster(tipo, filas, directorio, columnas_extra)
+            df, metricas = medir("lectura", tipo, filas, lambda: (leer_roster(tipo, ruta), filas, []))
+            resultados.append(metricas)
+            datos, metricas = medir("análisis", tipo, filas, lambda: analizar(tipo, df))
+            if datos is not None:
+                resultados.append(metricas)
+            mensajes, metricas = medir("render", tipo, filas, lambda: redactar(tipo, df, datos, remitente))
+            resultados.append(metricas)
+            if not sin_envio:
+                (enviados, fallidos), metricas = medir(
+                    "envío", tipo, filas, lambda: enviar(mensajes, servidor, concurrencia, remitente, adjunto)
+                )
+                metricas['destinatarios ok'] = enviados
+                metricas['destinatarios error'] = fallidos
+                resultados.append(metricas)
+            print(f"[{datetime.now():%H:%M:%S}] {tipo} {filas} filas listo", file=sys.stderr, flush=True)
+    return pd.DataFrame(resultados)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark de lectura, análisis, render y envío con rosters sintéticos y un servidor SMTP local"
+    )
+    parser.add_argument('--filas', type=int, nargs='+', default=TAMANOS, help="Tamaños de roster")
+    parser.add_argument('--rosters', nargs='+', choices=ROSTERS, default=ROSTERS, help="Rosters a generar")
+    parser.add_argument('--columnas-extra', type=int, default=0,
+                        help="Columnas que la app no usa en cada roster, como en un reporte de Moodle")
+    parser.add_argument('--directorio', help="Carpeta para los .xlsx generados (se reutilizan entre corridas)")
+    parser.add_argument('--latencia-ms', type=float, default=0.0, help="Latencia del servidor por mensaje")
+    parser.add_argument('--error-temporal', type=float, default=0.0, help="Fracción de RCPT con 451")
+    parser.add_argument('--error-permanente', type=float, default=0.0, help="Fracción de RCPT con 550")
+    parser.add_argument('--concurrencia', type=int, default=4, help="Envíos SMTP simultáneos")
+    parser.add_argument('--adjunto-mb', type=float, default=0,
+                        help="Adjuntar a cada mensaje un archivo de este tamaño")
+    parser.add_argument('--sin-envio', action='store_true', help="Medir sólo lectura, análisis y render")
+    parser.add_argument('--csv', help="Guardar los resultados en este archivo")
+    args = parser.parse_args()
+
+    directorio = args.directorio or tempfile.mkdtemp(prefix="benchmark_correos_")
+    os.makedirs(directorio, exist_ok=True)
+    # La bandeja y el historial del benchmark nunca tocan sistema_correos.db
+    base_datos.DB_FILE = os.path.join(tempfile.mkdtemp(prefix="benchmark_db_"), "benchmark.db")
+    base_datos.init_database()
+
+    servidor = ServidorSMTPPrueba(args.latencia_ms / 1000, args.error_temporal, args.error_permanente).iniciar()
+    try:
+        resultados = ejecutar_benchmark(args.filas, args.rosters, directorio, servidor,
+                                        args.concurrencia, args.sin_envio, args.columnas_extra,
+                                        args.adjunto_mb)
+    finally:
+        servidor.shutdown()
+
+    with pd.option_context('display.max_rows', None, 'display.width', 200):
+        print(resultados.to_string(index=False))
+    print(f"\nServidor SMTP: {servidor.conexiones} conexiones, {servidor.mensajes} mensajes")
+    if args.csv:
+        resultados.to_csv(args.csv, index=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# =====================================================
+# MOTOR DE ENVÍO MASIVO CONCURRENTE
+# =====================================================
+
+
+def enviar_masivo(trabajos, enviar, preparar, concurrencia=4, al_completar=None,
+                  preparadores=2, adelanto=None):
+    """Ejecutar `enviar(*argumentos, preparado)` para cada trabajo con hasta
+    `concurrencia` transacciones SMTP simultáneas. El tope de envíos por minuto
+    lo impone el limitador del pool SMTP, compartido con el resto de pestañas.
+
+    Una etapa previa de `preparadores` hilos calcula `preparar(*argumentos)`
+    (armar y serializar el mensaje) mientras los envíos anteriores esperan al
+    servidor. A lo más `adelanto` mensajes (por defecto 2 × concurrencia)
+    esperan listos en memoria; un error al preparar cuenta como envío fallido.
+
+    `enviar` es bloqueante y debe devolver (exito, resultado). Devuelve la lista
+    de (exito, resultado) en el orden de `trabajos`. `al_completar(indice, exito,
+    resultado)` se llama en el hilo que invoca esta función conforme termina
+    cada envío."""
+    if not trabajos:
+        return []
+    concurrencia = max(1, int(concurrencia))
+    preparadores = max(1, int(preparadores))
+    resultados = [None] * len(trabajos)
+    # Cola acotada: los preparadores se detienen cuando llevan `adelanto`
+    # mensajes listos que nadie ha enviado todavía
+    listos = queue.Queue(maxsize=max(1, int(adelanto or 2 * concurrencia)))
+    terminados = queue.Queue()
+    pendientes = iter(enumerate(trabajos))
+    candado = threading.Lock()
+    detener = threading.Event()
+
+    def siguiente():
+        # Los preparadores comparten el iterador y toman los trabajos en orden
+        with candado:
+            return next(pendientes, None)
+
+    def preparar_siguientes():
+        while not detener.is_set():
+            elemento = siguiente()
+            if elemento is None:
+                return
+            indice, argumentos = elemento
+            try:
+                preparado = preparar(*argumentos)
+            except Exception as e:
+                terminados.put((indice, False, f"Error: {str(e)}"))
+                continue
+            listos.put((indice, argumentos, preparado))
+
+    def enviar_listos():
+        while True:
+            elemento = listos.get()
+            if elemento is None:
+                return
+            if detener.is_set():
+                # Se abandonó el envío: sólo se vacía la cola
+                continue
+            indice, argumentos, preparado = elemento
+            try:
+                exito, resultado = enviar(*argumentos, preparado)
+            except Exception as e:
+                exito, resultado = False, f"Error: {str(e)}"
+            terminados.put((indice, exito, resultado))
+
+    with ThreadPoolExecutor(max_workers=preparadores) as preparacion, \
+            ThreadPoolExecutor(max_workers=concurrencia) as envio:
+        for _ in range(concurrencia):
+            envio.submit(enviar_listos)
+        preparando = [preparacion.submit(preparar_siguientes) for _ in range(preparadores)]
+        try:
+            for _ in range(len(trabajos)):
+                indice, exito, resultado = terminados.get()
+                resultados[indice] = (exito, resultado)
+                if al_completar:
+                    al_completar(indice, exito, resultado)
+        finally:
+            # Si al_completar falla, los hilos terminan sin enviar lo que falta
+            detener.set()
+            wait(preparando)
+            for _ in range(concurrencia):
+                listos.put(None)
+
+    return resultados
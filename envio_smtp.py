@@ -0,0 +1,285 @@
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+from email.message import Message
+
+# =====================================================
+# SESIONES SMTP PERSISTENTES Y POOL POR CUENTA
+# =====================================================
+
+SERVIDOR_GMAIL = "smtp.gmail.com"
+PUERTO_GMAIL_SSL = 465
+
+# Respuestas con las que el servidor cierra la sesión y conviene reconectar
+CODIGOS_RECONEXION = (421,)
+
+# Tamaño de cada escritura al socket al transmitir un mensaje por bloques
+ESCRITURA_DATA = 64 * 1024
+
+
+def codigo_smtp(error):
+    """Código de respuesta SMTP asociado a una excepción (None si no lo hay)"""
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code
+    if isinstance(error, smtplib.SMTPRecipientsRefused) and error.recipients:
+        return next(iter(error.recipients.values()))[0]
+    return None
+
+
+class MensajeEnBloques:
+    """Mensaje ya serializado (CRLF) que se transmite al socket por partes.
+
+    Cada segmento es bytes o una función que devuelve un iterable de bytes
+    (un adjunto leído del disco), así el mensaje nunca está completo en
+    memoria y puede volver a transmitirse si hay que reconectar."""
+
+    def __init__(self, segmentos):
+        self.segmentos = list(segmentos)
+
+    def con_prefijo(self, prefijo):
+        """El mismo mensaje con `prefijo` (una cabecera) al inicio"""
+        return MensajeEnBloques([prefijo, *self.segmentos])
+
+    def bloques(self):
+        for segmento in self.segmentos:
+            if isinstance(segmento, bytes):
+                yield segmento
+            else:
+                yield from segmento()
+
+
+def _datos_smtp(bloques):
+    """Bloques del cuerpo de DATA con los puntos al inicio de línea duplicados
+    y el terminador final, como smtplib.SMTP.data"""
+    inicio_linea = True
+    final = b''
+    for bloque in bloques:
+        if not bloque:
+            continue
+        if inicio_linea and bloque.startswith(b'.'):
+            bloque = b'.' + bloque
+        bloque = bloque.replace(b'\n.', b'\n..')
+        inicio_linea = bloque.endswith(b'\n')
+        final = bloque[-2:] if len(bloque) > 1 else final[-1:] + bloque
+        yield bloque
+    if final != b'\r\n':
+        yield b'\r\n'
+    yield b'.\r\n'
+
+
+class SesionSMTP:
+    """Conexión SMTP autenticada que se reutiliza entre mensajes"""
+
+    def __init__(self, servidor, puerto, usuario, password, seguridad=None,
+                 timeout=30, inactividad_noop=30, max_mensajes=90):
+        self.servidor = servidor
+        self.puerto = int(puerto)
+        self.usuario = usuario
+        self.password = password
+        # "ssl" (puerto 465), "starttls" o "ninguna"
+        self.seguridad = seguridad or ("ssl" if self.puerto == 465 else "starttls")
+        self.timeout = timeout
+        self.inactividad_noop = inactividad_noop
+        self.max_mensajes = max_mensajes
+        self.smtp = None
+        self.mensajes = 0
+        self.ultimo_uso = 0.0
+        self.ultima_latencia = None
+
+    def conectar(self):
+        """Abrir la conexión y autenticarse (una vez por sesión)"""
+        self.cerrar()
+        if self.seguridad == "ssl":
+            smtp = smtplib.SMTP_SSL(self.servidor, self.puerto, timeout=self.timeout)
+        else:
+            smtp = smtplib.SMTP(self.servidor, self.puerto, timeout=self.timeout)
+            if self.seguridad == "starttls":
+                smtp.starttls()
+        try:
+            if self.usuario and self.password:
+                smtp.login(self.usuario, self.password)
+        except Exception:
+            smtp.close()
+            raise
+        self.smtp = smtp
+        self.mensajes = 0
+        self.ultimo_uso = time.monotonic()
+
+    def cerrar(self):
+        """Cerrar la conexión sin propagar errores"""
+        if self.smtp is None:
+            return
+        try:
+            self.smtp.quit()
+        except Exception:
+            try:
+                self.smtp.close()
+            except Exception:
+                pass
+        self.smtp = None
+
+    def _viva(self):
+        """Comprobar con NOOP si una sesión inactiva sigue abierta"""
+        if self.smtp is None:
+            return False
+        if time.monotonic() - self.ultimo_uso < self.inactividad_noop:
+            return True
+        try:
+            codigo, _ = self.smtp.noop()
+            return codigo == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def _preparar(self):
+        """Dejar la sesión lista para una nueva transacción"""
+        if self.mensajes >= self.max_mensajes or not self._viva():
+            self.conectar()
+        elif self.mensajes:
+            # RSET entre transacciones sobre la misma conexión
+            self.smtp.rset()
+
+    def _transmitir(self, remitente, destinatarios, mensaje):
+        """sendmail de smtplib, pero el mensaje se escribe al socket por
+        bloques en lugar de copiarse completo en memoria"""
+        smtp = self.smtp
+        smtp.ehlo_or_helo_if_needed()
+        codigo, respuesta = smtp.mail(remitente)
+        if codigo != 250:
+            if codigo == 421:
+                smtp.close()
+            else:
+                smtp._rset()
+            raise smtplib.SMTPSenderRefused(codigo, respuesta, remitente)
+        rechazados = {}
+        for destinatario in destinatarios:
+            codigo, respuesta = smtp.rcpt(destinatario)
+            if codigo not in (250, 251):
+                rechazados[destinatario] = (codigo, respuesta)
+            if codigo == 421:
+                smtp.close()
+                raise smtplib.SMTPRecipientsRefused(rechazados)
+        if len(rechazados) == len(destinatarios):
+            smtp._rset()
+            raise smtplib.SMTPRecipientsRefused(rechazados)
+        smtp.putcmd("data")
+        codigo, respuesta = smtp.getreply()
+        if codigo != 354:
+            smtp._rset()
+            raise smtplib.SMTPDataError(codigo, respuesta)
+        # Escrituras de hasta ESCRITURA_DATA bytes, con el terminador en la
+        # última: varias escrituras pequeñas seguidas chocan con Nagle y el ACK
+        # diferido del servidor (~40 ms por mensaje)
+        pendiente = bytearray()
+        for bloque in _datos_smtp(mensaje.bloques()):
+            pendiente += bloque
+            if len(pendiente) >= ESCRITURA_DATA:
+                smtp.send(pendiente)
+                pendiente = bytearray()
+        smtp.send(pendiente)
+        codigo, respuesta = smtp.getreply()
+        if codigo != 250:
+            if codigo == 421:
+                smtp.close()
+            else:
+                smtp._rset()
+            raise smtplib.SMTPDataError(codigo, respuesta)
+        return rechazados
+
+    def enviar(self, remitente, destinatarios, mensaje):
+        """Enviar un mensaje reconectando una vez si el servidor cerró la sesión.
+
+        Devuelve el diccionario de destinatarios rechazados de sendmail."""
+        for intento in range(2):
+            try:
+                self._preparar()
+                inicio = time.monotonic()
+                if isinstance(mensaje, MensajeEnBloques):
+                    rechazados = self._transmitir(remitente, destinatarios, mensaje)
+                elif isinstance(mensaje, Message):
+                    rechazados = self.smtp.send_message(mensaje, remitente, destinatarios)
+                else:
+                    rechazados = self.smtp.sendmail(remitente, destinatarios, mensaje)
+                self.mensajes += 1
+                self.ultimo_uso = time.monotonic()
+                self.ultima_latencia = self.ultimo_uso - inicio
+                return rechazados
+            except smtplib.SMTPResponseException as e:
+                if e.smtp_code not in CODIGOS_RECONEXION or intento:
+                    raise
+            except smtplib.SMTPRecipientsRefused as e:
+                codigos = [codigo for codigo, _ in e.recipients.values()]
+                if intento or not codigos or any(c not in CODIGOS_RECONEXION for c in codigos):
+                    raise
+            except smtplib.SMTPServerDisconnected:
+                if intento:
+                    raise
+            except smtplib.SMTPException:
+                raise
+            except OSError:
+                # Timeout o conexión reiniciada
+                if intento:
+                    raise
+            self.cerrar()
+        return {}
+
+
+class PoolSMTP:
+    """Sesiones SMTP autenticadas compartidas por cuenta (servidor, puerto, usuario).
+
+    Si recibe un LimitadorEnvios, cada envío espera su turno en el cubo global
+    y en el de la cuenta, y la respuesta del servidor ajusta el ritmo."""
+
+    def __init__(self, max_por_cuenta=4, limitador=None, **opciones_sesion):
+        self.max_por_cuenta = max_por_cuenta
+        self.limitador = limitador
+        self.opciones_sesion = opciones_sesion
+        self._libres = {}
+        self._en_uso = {}
+        self._condicion = threading.Condition()
+
+    @contextmanager
+    def sesion(self, servidor, puerto, usuario, password, seguridad=None):
+        """Tomar una sesión de la cuenta y devolverla al pool al terminar"""
+        clave = (servidor, int(puerto), usuario, password, seguridad)
+        with self._condicion:
+            libres = self._libres.setdefault(clave, [])
+            while not libres and self._en_uso.get(clave, 0) >= self.max_por_cuenta:
+                self._condicion.wait()
+            if libres:
+                sesion = libres.pop()
+            else:
+                sesion = SesionSMTP(servidor, puerto, usuario, password,
+                                    seguridad=seguridad, **self.opciones_sesion)
+            self._en_uso[clave] = self._en_uso.get(clave, 0) + 1
+        try:
+            yield sesion
+        finally:
+            with self._condicion:
+                self._en_uso[clave] -= 1
+                self._libres[clave].append(sesion)
+                self._condicion.notify()
+
+    def enviar(self, servidor, puerto, usuario, password, destinatarios, mensaje,
+               remitente=None, seguridad=None):
+        """Enviar un mensaje usando una sesión del pool"""
+        if self.limitador:
+            self.limitador.adquirir(usuario)
+        try:
+            with self.sesion(servidor, puerto, usuario, password, seguridad) as sesion:
+                rechazados = sesion.enviar(remitente or usuario, destinatarios, mensaje)
+        except Exception as e:
+            if self.limitador:
+                self.limitador.reportar(usuario, codigo=codigo_smtp(e))
+            raise
+        if self.limitador:
+            self.limitador.reportar(usuario, latencia=sesion.ultima_latencia)
+        return rechazados
+
+    def cerrar_todo(self):
+        """Cerrar todas las sesiones libres"""
+        with self._condicion:
+            for sesiones in self._libres.values():
+                for sesion in sesiones:
+                    sesion.cerrar()
+            self._libres.clear()
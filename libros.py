@@ -0,0 +1,446 @@
+import glob
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+import time
+import zipfile
+from collections import OrderedDict
+from xml.etree import ElementTree
+
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+
+try:
+    import python_calamine  # noqa: F401  (motor en Rust, opcional)
+    MOTOR_RAPIDO = 'calamine'
+except ImportError:
+    MOTOR_RAPIDO = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # sin pyarrow no hay Parquet ni instantáneas
+    pa = pq = None
+
+# Formatos de roster aceptados por los tres uploaders
+TIPOS_ROSTER = ['xlsx', 'xls', 'csv', 'parquet']
+
+# CSV y Parquet tienen una sola tabla; se presenta como una hoja con este nombre
+HOJA_UNICA = 'Datos'
+
+# Carpeta de las instantáneas Parquet de los Excel ya leídos
+DIRECTORIO_INSTANTANEAS = os.environ.get('SISTEMA_CORREOS_CACHE', 'cache_rosters')
+
+# Una instantánea que no se usa en este tiempo se borra (tienen datos personales)
+CADUCIDAD_INSTANTANEAS = 7 * 24 * 3600
+
+# Hojas con columnas de contraseñas (Tab 3) nunca se guardan en disco
+PALABRAS_CREDENCIAL = ('contraseña', 'contrasena', 'password', 'passwd', 'clave')
+
+# =====================================================
+# LECTURA DE ROSTERS (EXCEL, CSV, PARQUET) POR COLUMNAS
+# =====================================================
+
+
+def hash_contenido(contenido):
+    """Identificador de un archivo por su contenido"""
+    return hashlib.sha256(contenido).hexdigest()
+
+
+def formato(contenido):
+    """'xlsx', 'xls', 'parquet' o 'csv' según los primeros bytes del archivo"""
+    if contenido[:2] == b'PK':
+        return 'xlsx'
+    if contenido[:8] == b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1':
+        return 'xls'
+    if contenido[:4] == b'PAR1':
+        return 'parquet'
+    return 'csv'
+
+
+def es_excel(contenido):
+    return formato(contenido) in ('xlsx', 'xls')
+
+
+def nombres_hojas(contenido):
+    """Nombres de las hojas sin leer sus celdas"""
+    tipo = formato(contenido)
+    if tipo == 'xlsx':
+        # Sólo xl/workbook.xml: ni estilos ni cadenas compartidas
+        with zipfile.ZipFile(io.BytesIO(contenido)) as archivo:
+            raiz = ElementTree.fromstring(archivo.read('xl/workbook.xml'))
+        return [hoja.get('name') for hoja in raiz.iter() if hoja.tag.rsplit('}', 1)[-1] == 'sheet']
+    if tipo == 'xls':
+        return pd.ExcelFile(io.BytesIO(contenido)).sheet_names
+    return [HOJA_UNICA]
+
+
+def _texto_csv(contenido):
+    """Texto del CSV: UTF-8 (con o sin BOM) o, si no lo es, Latin-1 como lo
+    guarda Excel en Windows"""
+    try:
+        return contenido.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        return contenido.decode('latin-1')
+
+
+def _separador(texto):
+    """Separador del CSV según la primera línea (',' de Moodle o ';' de Excel
+    en español)"""
+    primera = re.sub(r'"[^"]*"', '', texto.split('\n', 1)[0])
+    return max([',', ';', '\t', '|'], key=primera.count)
+
+
+def _columnas_parquet(contenido):
+    return pq.read_schema(io.BytesIO(contenido)).names
+
+
+def _requiere_pyarrow():
+    if pq is None:
+        raise ValueError("Para leer archivos Parquet instala pyarrow (pip install pyarrow)")
+
+
+def _texto(valor):
+    """Valor de celda como texto, como lo hace pandas con dtype=str"""
+    if valor is None or pd.isna(valor):
+        return np.nan
+    if isinstance(valor, float) and valor.is_integer():
+        valor = int(valor)
+    return str(valor)
+
+
+def _leer_openpyxl(contenido, hoja, columnas, texto):
+    """Recorrer la hoja en modo read-only conservando sólo `columnas`: el
+    encabezado se resuelve primero y de cada fila se copian esas celdas"""
+    libro = load_workbook(io.BytesIO(contenido), read_only=True, data_only=True)
+    try:
+        if hoja not in libro.sheetnames:
+            raise ValueError(f"Worksheet named '{hoja}' not found")
+        hoja_libro = libro[hoja]
+        encabezado = next(hoja_libro.iter_rows(max_row=1, values_only=True), ())
+        indices = {}
+        for i, nombre in enumerate(encabezado):
+            if nombre in columnas and nombre not in indices:
+                indices[nombre] = i
+        posiciones = list(indices.values())
+        registros = []
+        # Las celdas a la derecha de la última columna pedida no se convierten
+        filas = hoja_libro.iter_rows(min_row=2, max_col=max(posiciones, default=0) + 1, values_only=True)
+        for fila in filas:
+            valores = [fila[i] if i < len(fila) else None for i in posiciones]
+            # Como pandas: se omiten las filas en blanco
+            if any(valor is not None for valor in valores):
+                registros.append(valores)
+    finally:
+        libro.close()
+    df = pd.DataFrame.from_records(registros, columns=list(indices))
+    for col in df.columns:
+        if col in texto:
+            df[col] = pd.Series([_texto(v) for v in df[col].tolist()], index=df.index, dtype=object)
+        elif df[col].dtype == object:
+            # Celdas vacías como NaN, igual que pd.read_excel
+            df[col] = df[col].where(df[col].notna(), np.nan)
+    return df
+
+
+def _leer_csv(contenido, columnas, texto):
+    texto_csv = _texto_csv(contenido)
+    return pd.read_csv(
+        io.StringIO(texto_csv), sep=_separador(texto_csv),
+        usecols=None if columnas is None else (lambda c: c in columnas),
+        dtype={c: str for c in texto} or None
+    )
+
+
+def _leer_parquet(contenido, columnas, texto):
+    _requiere_pyarrow()
+    if columnas is not None:
+        columnas = [c for c in _columnas_parquet(contenido) if c in columnas]
+    df = pd.read_parquet(io.BytesIO(contenido), columns=columnas)
+    for col in texto:
+        if col in df.columns:
+            df[col] = pd.Series([_texto(v) for v in df[col].tolist()], index=df.index, dtype=object)
+    return df
+
+
+def leer_hoja(contenido, hoja, columnas=None, texto=()):
+    """Una hoja del libro con sólo las `columnas` indicadas (todas si es None);
+    las de `texto` se leen como texto. Las columnas que no existen se omiten.
+    En CSV y Parquet se ignora `hoja`"""
+    tipo = formato(contenido)
+    if columnas is not None:
+        columnas = set(columnas)
+        texto = [c for c in texto if c in columnas]
+    if tipo == 'csv':
+        return _leer_csv(contenido, columnas, texto)
+    if tipo == 'parquet':
+        return _leer_parquet(contenido, columnas, texto)
+    if columnas is None:
+        return pd.read_excel(io.BytesIO(contenido), sheet_name=hoja, dtype={c: str for c in texto} or None)
+    if MOTOR_RAPIDO:
+        return pd.read_excel(
+            io.BytesIO(contenido), sheet_name=hoja, engine=MOTOR_RAPIDO,
+            usecols=lambda c: c in columnas, dtype={c: str for c in texto} or None
+        )
+    if tipo == 'xlsx':
+        return _leer_openpyxl(contenido, hoja, columnas, texto)
+    return pd.read_excel(
+        io.BytesIO(contenido), sheet_name=hoja,
+        usecols=lambda c: c in columnas, dtype={c: str for c in texto} or None
+    )
+
+
+def leer_encabezado(contenido, hoja):
+    """Nombres de las columnas de una hoja (sólo la primera fila)"""
+    tipo = formato(contenido)
+    if tipo == 'csv':
+        texto_csv = _texto_csv(contenido)
+        return list(pd.read_csv(io.StringIO(texto_csv), sep=_separador(texto_csv), nrows=0).columns)
+    if tipo == 'parquet':
+        _requiere_pyarrow()
+        return _columnas_parquet(contenido)
+    if tipo == 'xlsx':
+        libro = load_workbook(io.BytesIO(contenido), read_only=True)
+        try:
+            if hoja not in libro.sheetnames:
+                raise ValueError(f"Worksheet named '{hoja}' not found")
+            encabezado = next(libro[hoja].iter_rows(max_row=1, values_only=True), ())
+        finally:
+            libro.close()
+        return [nombre for nombre in encabezado if nombre is not None]
+    return list(pd.read_excel(io.BytesIO(contenido), sheet_name=hoja, nrows=0).columns)
+
+
+# =====================================================
+# INSTANTÁNEAS PARQUET DE LOS EXCEL
+# =====================================================
+
+# Tipo de cada valor de una columna mezclada dentro de la instantánea
+VACIO, REAL, ENTERO, TEXTO = range(4)
+
+
+def _separar_mezclada(valores):
+    """Columna con tipos mezclados como (tipos, números, textos); los valores
+    que no son números se guardan como texto"""
+    tipos = np.full(len(valores), VACIO, dtype=np.int8)
+    numeros = np.full(len(valores), np.nan)
+    textos = np.full(len(valores), None, dtype=object)
+    for i, valor in enumerate(valores):
+        if valor is None or pd.isna(valor):
+            continue
+        if isinstance(valor, float):
+            tipos[i], numeros[i] = REAL, valor
+        elif isinstance(valor, int) and not isinstance(valor, bool):
+            tipos[i], numeros[i] = ENTERO, valor
+        else:
+            tipos[i], textos[i] = TEXTO, str(valor)
+    return tipos, numeros, textos
+
+
+def _unir_mezclada(tipos, numeros, textos):
+    valores = np.full(len(tipos), np.nan, dtype=object)
+    reales = tipos == REAL
+    valores[reales] = numeros[reales]
+    enteros = tipos == ENTERO
+    valores[enteros] = numeros[enteros].astype(np.int64)
+    de_texto = tipos == TEXTO
+    valores[de_texto] = textos[de_texto]
+    return valores
+
+
+def es_columna_credencial(columna):
+    return any(palabra in str(columna).lower() for palabra in PALABRAS_CREDENCIAL)
+
+
+def ruta_instantanea(directorio, clave):
+    return os.path.join(directorio, hashlib.sha256(repr(clave).encode('utf-8')).hexdigest()[:40] + '.parquet')
+
+
+def guardar_instantanea(ruta, df):
+    """Guardar una hoja ya leída en Parquet. Cada columna con tipos mezclados
+    (calificaciones con '-') se guarda en tres columnas tipadas; los metadatos
+    indican cómo devolver todas igual al cargarlas"""
+    objeto = [col for col in df.columns if df[col].dtype == object]
+    mezcladas = [col for col in objeto if pd.api.types.infer_dtype(df[col], skipna=True) not in ('string', 'empty')]
+    columnas = {}
+    for i, col in enumerate(df.columns):
+        if col in mezcladas:
+            tipos, numeros, textos = _separar_mezclada(df[col].tolist())
+            columnas[f"{i}:tipo"] = pa.array(tipos)
+            columnas[f"{i}:numero"] = pa.array(numeros)
+            columnas[f"{i}:texto"] = pa.array(textos, type=pa.string())
+        else:
+            columnas[str(i)] = pa.Array.from_pandas(df[col])
+    tabla = pa.table(columnas)
+    tabla = tabla.replace_schema_metadata({
+        **(tabla.schema.metadata or {}),
+        b'sistema_correos': json.dumps({
+            'columnas': list(df.columns), 'objeto': objeto, 'mezcladas': mezcladas
+        }, default=str).encode('utf-8')
+    })
+    os.makedirs(os.path.dirname(ruta) or '.', mode=0o700, exist_ok=True)
+    temporal = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+    pq.write_table(tabla, temporal)
+    os.replace(temporal, ruta)
+
+
+def cargar_instantanea(ruta, caducidad=CADUCIDAD_INSTANTANEAS):
+    """Hoja guardada con guardar_instantanea(), o None si no existe. Las
+    caducadas y las que tienen contraseñas (versiones anteriores) se borran"""
+    if not os.path.exists(ruta):
+        return None
+    if time.time() - os.path.getmtime(ruta) > caducidad:
+        os.remove(ruta)
+        return None
+    tabla = pq.read_table(ruta)
+    info = json.loads(tabla.schema.metadata[b'sistema_correos'])
+    if any(map(es_columna_credencial, info['columnas'])):
+        os.remove(ruta)
+        return None
+    datos = {}
+    for i, col in enumerate(info['columnas']):
+        if col in info['mezcladas']:
+            datos[col] = pd.Series(_unir_mezclada(
+                tabla.column(f"{i}:tipo").to_numpy(), tabla.column(f"{i}:numero").to_numpy(),
+                tabla.column(f"{i}:texto").to_numpy(zero_copy_only=False)
+            ), dtype=object)
+        elif col in info['objeto']:
+            serie = tabla.column(str(i)).to_pandas().astype(object)
+            datos[col] = serie.where(serie.notna(), np.nan)
+        else:
+            datos[col] = tabla.column(str(i)).to_pandas()
+    df = pd.DataFrame(datos)
+    os.utime(ruta)
+    return df
+
+
+def purgar_instantaneas(directorio, maximo, caducidad=CADUCIDAD_INSTANTANEAS):
+    """Conservar sólo las `maximo` instantáneas usadas más recientemente que
+    no hayan caducado"""
+    rutas = sorted(glob.glob(os.path.join(directorio, '*.parquet')), key=os.path.getmtime, reverse=True)
+    limite = time.time() - caducidad
+    for ruta in [r for r in rutas[:maximo] if os.path.getmtime(r) < limite] + rutas[maximo:]:
+        try:
+            os.remove(ruta)
+        except OSError:
+            pass
+
+
+# =====================================================
+# CACHÉ DE HOJAS YA LEÍDAS
+# =====================================================
+
+def _tamano(df, muestra=1000):
+    """Memoria aproximada de una hoja; medir cada texto de un roster grande
+    tarda tanto como cargar la instantánea, así que se estima con una muestra"""
+    if len(df) <= muestra:
+        return int(df.memory_usage(deep=True).sum())
+    return int(df.head(muestra).memory_usage(deep=True).sum() * len(df) / muestra)
+
+
+class CacheLibros:
+    """Hojas Excel leídas una sola vez, indexadas por hash de contenido, hoja
+    y columnas pedidas.
+
+    Volver a ejecutar la app (cada tecla en el editor de plantillas) o cambiar
+    de hoja no vuelve a leer el XML. Se descartan las menos usadas al superar
+    `max_bytes` en memoria. Con `directorio`, cada hoja leída de un Excel se
+    guarda además como instantánea Parquet: volver a cargar el mismo roster
+    (seguimiento de la semana 2, 3...) lee datos columnares aunque el
+    servidor se haya reiniciado. Las hojas con contraseñas no se guardan y
+    las instantáneas sin usar en `caducidad` segundos se borran."""
+
+    def __init__(self, max_bytes=512 * 1024 * 1024, max_libros=64, directorio=None,
+                 max_instantaneas=200, caducidad=CADUCIDAD_INSTANTANEAS):
+        self.max_bytes = max_bytes
+        self.max_libros = max_libros
+        self.directorio = directorio
+        self.max_instantaneas = max_instantaneas
+        self.caducidad = caducidad
+        if directorio is not None and os.path.isdir(directorio):
+            purgar_instantaneas(directorio, max_instantaneas, caducidad)
+        self._hojas = OrderedDict()
+        self._bytes = 0
+        self._nombres = OrderedDict()
+        self._encabezados = OrderedDict()
+        self._candado = threading.Lock()
+
+    def _recordar(self, guardados, clave, calcular):
+        """Caché pequeña de resultados baratos (nombres de hojas, encabezados)"""
+        with self._candado:
+            if clave in guardados:
+                guardados.move_to_end(clave)
+                return guardados[clave]
+        valor = calcular()
+        with self._candado:
+            guardados[clave] = valor
+            while len(guardados) > self.max_libros:
+                guardados.popitem(last=False)
+        return valor
+
+    def nombres_hojas(self, contenido):
+        return list(self._recordar(
+            self._nombres, hash_contenido(contenido), lambda: nombres_hojas(contenido)
+        ))
+
+    def _nombre(self, contenido, nombre):
+        if isinstance(nombre, int):
+            return self.nombres_hojas(contenido)[nombre]
+        return nombre
+
+    def encabezado(self, contenido, nombre=0):
+        """Todas las columnas de la hoja, aunque se lean sólo algunas"""
+        nombre = self._nombre(contenido, nombre)
+        return list(self._recordar(
+            self._encabezados, (hash_contenido(contenido), nombre),
+            lambda: leer_encabezado(contenido, nombre)
+        ))
+
+    def _leer(self, contenido, nombre, columnas, texto, clave):
+        """Leer de la instantánea Parquet si existe; si no, del archivo,
+        guardando la instantánea cuando es un Excel"""
+        if self.directorio is None or pq is None or not es_excel(contenido):
+            return leer_hoja(contenido, nombre, columnas, texto)
+        ruta = ruta_instantanea(self.directorio, clave)
+        try:
+            df = cargar_instantanea(ruta, self.caducidad)
+        except Exception:
+            df = None  # instantánea dañada: se vuelve a leer el Excel
+        if df is not None:
+            return df
+        df = leer_hoja(contenido, nombre, columnas, texto)
+        if any(map(es_columna_credencial, df.columns)):
+            return df
+        try:
+            guardar_instantanea(ruta, df)
+            purgar_instantaneas(self.directorio, self.max_instantaneas, self.caducidad)
+        except Exception:
+            pass  # la instantánea es opcional; el roster ya está leído
+        return df
+
+    def hoja(self, contenido, nombre=0, columnas=None, texto=()):
+        """Copia de una hoja, por nombre o por posición, que se puede modificar.
+        Con `columnas` sólo se leen esas; las de `texto` se leen como texto"""
+        nombre = self._nombre(contenido, nombre)
+        clave = (
+            hash_contenido(contenido), nombre,
+            None if columnas is None else tuple(sorted(set(columnas))), tuple(sorted(set(texto)))
+        )
+        with self._candado:
+            if clave in self._hojas:
+                self._hojas.move_to_end(clave)
+                return self._hojas[clave][0].copy()
+        df = self._leer(contenido, nombre, columnas, texto, clave)
+        tamano = _tamano(df)
+        with self._candado:
+            if clave not in self._hojas:
+                self._hojas[clave] = (df, tamano)
+                self._bytes += tamano
+                while self._bytes > self.max_bytes and len(self._hojas) > 1:
+                    _, (_, descartado) = self._hojas.popitem(last=False)
+                    self._bytes -= descartado
+            return self._hojas[clave][0].copy()
@@ -0,0 +1,138 @@
+import threading
+import time
+
+# =====================================================
+# LIMITADOR DE ENVÍOS (CUBO DE TOKENS ADAPTATIVO)
+# =====================================================
+
+# Respuestas con las que el servidor pide bajar el ritmo
+CODIGOS_CONGESTION = (421, 450, 451, 452)
+
+
+class CuboTokens:
+    """Cubo de tokens que se repone a `por_minuto` y admite ráfagas de `rafaga`.
+
+    La tasa efectiva puede bajar ante congestión y se recupera poco a poco
+    hasta la tasa objetivo."""
+
+    def __init__(self, por_minuto, rafaga, tasa_minima=2):
+        self.objetivo = float(por_minuto)
+        self.tasa = float(por_minuto)
+        self.rafaga = float(max(1, rafaga))
+        self.tasa_minima = float(tasa_minima)
+        self.tokens = self.rafaga
+        self.actualizado = time.monotonic()
+
+    def _reponer(self, ahora):
+        transcurrido = ahora - self.actualizado
+        self.tokens = min(self.rafaga, self.tokens + transcurrido * self.tasa / 60.0)
+        self.actualizado = ahora
+
+    def espera(self, ahora):
+        """Segundos hasta que haya un token libre (sin consumirlo)"""
+        self._reponer(ahora)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) * 60.0 / self.tasa
+
+    def reservar(self, ahora):
+        """Consumir un token (puede quedar en deuda) y devolver la espera necesaria"""
+        espera = self.espera(ahora)
+        self.tokens -= 1
+        return espera
+
+    def configurar(self, por_minuto, rafaga):
+        if float(por_minuto) != self.objetivo:
+            self.objetivo = float(por_minuto)
+            self.tasa = self.objetivo
+        self.rafaga = float(max(1, rafaga))
+        self.tokens = min(self.tokens, self.rafaga)
+
+    def reducir(self, factor):
+        self._reponer(time.monotonic())
+        self.tasa = max(self.tasa_minima, min(self.objetivo, self.tasa * factor))
+
+    def recuperar(self):
+        if self.tasa < self.objetivo:
+            self._reponer(time.monotonic())
+            self.tasa = min(self.objetivo, self.tasa + self.objetivo * 0.05)
+
+
+class LimitadorEnvios:
+    """Cubo global más un cubo por cuenta. Sólo se reduce el ritmo cuando el
+    servidor responde 421/450/451/452 o la latencia se dispara; en envíos sanos
+    no se espera más de lo que marca la tasa configurada."""
+
+    def __init__(self, por_minuto=240, rafaga=20, por_minuto_cuenta=60, rafaga_cuenta=10,
+                 factor_lentitud=3.0):
+        self.por_minuto_cuenta = por_minuto_cuenta
+        self.rafaga_cuenta = rafaga_cuenta
+        self.factor_lentitud = factor_lentitud
+        self.global_ = CuboTokens(por_minuto, rafaga)
+        self._cuentas = {}
+        self._latencias = {}
+        self._candado = threading.Lock()
+
+    def configurar(self, por_minuto, rafaga, por_minuto_cuenta, rafaga_cuenta=None):
+        """Actualizar las tasas objetivo (se llama en cada rerun desde la interfaz)"""
+        with self._candado:
+            self.global_.configurar(por_minuto, rafaga)
+            self.por_minuto_cuenta = por_minuto_cuenta
+            if rafaga_cuenta is not None:
+                self.rafaga_cuenta = rafaga_cuenta
+            for cubo in self._cuentas.values():
+                cubo.configurar(self.por_minuto_cuenta, self.rafaga_cuenta)
+
+    def _cubo(self, cuenta):
+        if cuenta not in self._cuentas:
+            self._cuentas[cuenta] = CuboTokens(self.por_minuto_cuenta, self.rafaga_cuenta)
+        return self._cuentas[cuenta]
+
+    def espera(self, cuenta=None):
+        """Segundos hasta que la cuenta pueda enviar, sin reservar"""
+        with self._candado:
+            ahora = time.monotonic()
+            espera = self.global_.espera(ahora)
+            if cuenta is not None:
+                espera = max(espera, self._cubo(cuenta).espera(ahora))
+            return espera
+
+    def _reservar(self, cuenta):
+        with self._candado:
+            ahora = time.monotonic()
+            espera = self.global_.reservar(ahora)
+            if cuenta is not None:
+                espera = max(espera, self._cubo(cuenta).reservar(ahora))
+            return espera
+
+    def adquirir(self, cuenta=None):
+        """Bloquear hasta que haya cupo en el cubo global y en el de la cuenta"""
+        espera = self._reservar(cuenta)
+        if espera > 0:
+            time.sleep(espera)
+        return espera
+
+    def reportar(self, cuenta=None, codigo=None, latencia=None):
+        """Ajustar el ritmo según la respuesta del servidor a un envío"""
+        with self._candado:
+            cubo = self._cubo(cuenta) if cuenta is not None else self.global_
+            if codigo in CODIGOS_CONGESTION:
+                cubo.reducir(0.5)
+                return
+            if latencia is None:
+                return
+            # Lentitud: latencia muy por encima de la media móvil reciente
+            media = self._latencias.get(cuenta, latencia)
+            self._latencias[cuenta] = 0.8 * media + 0.2 * latencia
+            if latencia > 1.0 and latencia > self.factor_lentitud * media:
+                cubo.reducir(0.8)
+            else:
+                cubo.recuperar()
+
+    def resumen(self):
+        """Tasas efectivas para mostrar en la interfaz"""
+        with self._candado:
+            filas = [{'cubo': 'Global', 'objetivo': self.global_.objetivo, 'actual': round(self.global_.tasa, 1)}]
+            for cuenta, cubo in self._cuentas.items():
+                filas.append({'cubo': cuenta, 'objetivo': cubo.objetivo, 'actual': round(cubo.tasa, 1)})
+            return filas
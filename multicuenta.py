@@ -0,0 +1,139 @@
+import smtplib
+import threading
+import time
+
+from envio_smtp import codigo_smtp
+from reintentos import CODIGOS_AUTENTICACION, ErrorDeCuenta, es_error_de_cuota
+
+# =====================================================
+# REPARTO DE UNA CAMPAÑA ENTRE VARIAS CUENTAS
+# =====================================================
+
+# Respuestas con las que el servidor limita temporalmente a la cuenta
+CODIGOS_LIMITE_TEMPORAL = (421, 454)
+
+
+class SinCuentasDisponibles(ErrorDeCuenta):
+    """Ninguna cuenta seleccionada puede enviar el mensaje"""
+
+
+class EstadoCuenta:
+    """Cuota y estado de una cuenta durante el día"""
+
+    def __init__(self, nombre, email, password, cuota_diaria):
+        self.nombre = nombre
+        self.email = email
+        self.password = password
+        self.cuota_diaria = cuota_diaria
+        self.enviados = 0
+        self.fallos = 0
+        self.pausada_hasta = 0.0
+        self.deshabilitada = None
+
+    def restante(self):
+        return max(0, self.cuota_diaria - self.enviados)
+
+    def espera(self, ahora, limitador=None):
+        """Segundos hasta que la cuenta pueda enviar (None si ya no puede hoy)"""
+        if self.deshabilitada or not self.restante():
+            return None
+        espera = max(0.0, self.pausada_hasta - ahora)
+        if limitador:
+            espera = max(espera, limitador.espera(self.email))
+        return espera
+
+
+class RepartidorCuentas:
+    """Reparte los mensajes de una campaña entre varias cuentas con failover.
+
+    El ritmo de cada cuenta lo marca su cubo en el limitador; el repartidor
+    prefiere la cuenta que puede enviar antes y, a igualdad, la menos usada."""
+
+    def __init__(self, cuentas, cuota_diaria=500, limitador=None, pausa_limite=300):
+        self.cuentas = [
+            EstadoCuenta(nombre, datos['email'], datos['password'], cuota_diaria)
+            for nombre, datos in cuentas.items()
+        ]
+        self.limitador = limitador
+        self.pausa_limite = pausa_limite
+        self._condicion = threading.Condition()
+
+    def tomar(self, excluir=()):
+        """Elegir la cuenta que antes pueda enviar (a igualdad, la menos usada);
+        espera si todas están pausadas. None si no queda ninguna."""
+        with self._condicion:
+            while True:
+                ahora = time.monotonic()
+                candidatas = []
+                for cuenta in self.cuentas:
+                    if cuenta.nombre in excluir:
+                        continue
+                    espera = cuenta.espera(ahora, self.limitador)
+                    if espera is not None:
+                        candidatas.append((espera, cuenta.enviados, cuenta))
+                if not candidatas:
+                    return None
+                espera, _, cuenta = min(candidatas, key=lambda c: (c[0], c[1]))
+                # La espera del limitador la hace el pool al enviar; aquí sólo
+                # se espera a que termine la pausa de alguna cuenta limitada
+                if espera <= 0 or cuenta.pausada_hasta <= ahora:
+                    # Se reserva el envío para que otros hilos vean la cuota ocupada
+                    cuenta.enviados += 1
+                    return cuenta
+                self._condicion.wait(espera)
+
+    def reportar_fallo(self, cuenta, error):
+        """Actualizar el estado de la cuenta; True si el error es de la cuenta
+        (autenticación, cuota o límite) y conviene reintentar con otra"""
+        codigo = codigo_smtp(error)
+        with self._condicion:
+            cuenta.fallos += 1
+            # El envío reservado en tomar() no se realizó
+            cuenta.enviados -= 1
+            if isinstance(error, smtplib.SMTPAuthenticationError) or codigo in CODIGOS_AUTENTICACION:
+                cuenta.deshabilitada = "Autenticación rechazada"
+            elif es_error_de_cuota(error):
+                cuenta.deshabilitada = "Cuota diaria agotada"
+            elif codigo in CODIGOS_LIMITE_TEMPORAL or (codigo is None and not isinstance(error, smtplib.SMTPException)):
+                # Límite temporal del servidor o conexión caída
+                cuenta.pausada_hasta = time.monotonic() + self.pausa_limite
+            else:
+                return False
+            self._condicion.notify_all()
+            return True
+
+    def enviar(self, funcion):
+        """Ejecutar `funcion(cuenta)` con una cuenta disponible, cambiando de
+        cuenta si la elegida es rechazada o limitada por el servidor"""
+        intentadas = set()
+        while True:
+            cuenta = self.tomar(excluir=intentadas)
+            if cuenta is None:
+                raise SinCuentasDisponibles("Ninguna cuenta disponible (cuota agotada, limitadas o rechazadas)")
+            try:
+                return funcion(cuenta)
+            except Exception as e:
+                if not self.reportar_fallo(cuenta, e):
+                    raise
+                intentadas.add(cuenta.nombre)
+
+    def resumen(self):
+        """Estado de cada cuenta para mostrar en la interfaz"""
+        ahora = time.monotonic()
+        filas = []
+        for cuenta in self.cuentas:
+            if cuenta.deshabilitada:
+                estado = cuenta.deshabilitada
+            elif cuenta.pausada_hasta > ahora:
+                estado = f"Pausada {int(cuenta.pausada_hasta - ahora)} s"
+            else:
+                estado = "Activa"
+            filas.append({
+                'cuenta': cuenta.nombre,
+                'email': cuenta.email,
+                'enviados': cuenta.enviados,
+                'restante': cuenta.restante(),
+                'fallos': cuenta.fallos,
+                'estado': estado
+            })
+        return filas
@@ -0,0 +1,499 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from adjuntos import BLOQUE, hash_archivo, leer_por_bloques
+from base_datos import conectar
+
+# =====================================================
+# BANDEJA DE SALIDA (OUTBOX) PERSISTENTE
+# =====================================================
+
+PENDIENTE = "pendiente"
+ENVIANDO = "enviando"
+ENVIADO = "enviado"
+FALLIDO = "error"
+PAUSADO = "pausado"
+CANCELADO = "cancelado"
+
+# Estados de una campaña (tabla campanas); sin fila, la campaña está activa
+ACTIVA = "activa"
+CAMPANA_PAUSADA = "pausada"
+CAMPANA_CANCELADA = "cancelada"
+
+# Estado que toman los mensajes por enviar de una campaña detenida
+ESTADO_DETENIDO = {CAMPANA_PAUSADA: PAUSADO, CAMPANA_CANCELADA: CANCELADO}
+
+# Estados de una entrega (clave de idempotencia)
+EN_CURSO = "enviando"
+ENTREGADO = "entregado"
+NO_ENTREGADO = "fallida"
+
+# Un mensaje tomado por un worker que no renovó la reserva en este tiempo se
+# considera huérfano (worker caído) y vuelve a la cola. El worker renueva las
+# reservas de su lote mientras lo envía
+ANTIGUEDAD_HUERFANO = 600
+
+# Días que se conservan los mensajes terminados y sus entregas antes de borrarlos
+DIAS_RETENCION = 30
+
+# Lectura y escritura de BLOB por bloques (Python 3.11+); antes se copian completos
+BLOB_POR_BLOQUES = hasattr(sqlite3.Connection, 'blobopen')
+
+# Contraseñas de las campañas encoladas por este proceso, {campana: (usuario,
+# password)}. Nunca se guardan en la base de datos; un worker de otro proceso
+# usa la cuenta guardada con ese correo
+_credenciales = {}
+_candado_credenciales = threading.Lock()
+
+
+def nueva_campana():
+    """Identificador único de campaña"""
+    return f"{datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:6]}"
+
+
+def clave_idempotencia(campana, estudiante, destinatario, plantilla):
+    """Clave de un envío: una campaña nunca entrega dos veces la misma
+    plantilla al mismo estudiante en la misma dirección"""
+    texto = "\x1f".join(str(parte) for parte in (campana, estudiante, destinatario.lower(), plantilla))
+    return hashlib.sha256(texto.encode('utf-8')).hexdigest()[:32]
+
+
+def _guardar_adjuntos(cursor, adjuntos):
+    """Guardar cada adjunto una sola vez y devolver las referencias [hash, nombre].
+    El contenido puede ser bytes (o memoryview) o un archivo abierto, que se
+    copia por bloques"""
+    referencias = []
+    for nombre, contenido in adjuntos or []:
+        if not BLOB_POR_BLOQUES and not isinstance(contenido, (bytes, bytearray, memoryview)):
+            contenido = b''.join(leer_por_bloques(contenido))
+        if isinstance(contenido, (bytes, bytearray, memoryview)):
+            hash_contenido = hashlib.sha256(contenido).hexdigest()
+            cursor.execute('INSERT OR IGNORE INTO outbox_adjuntos (hash, contenido) VALUES (?, ?)',
+                           (hash_contenido, contenido))
+        else:
+            hash_contenido = hash_archivo(contenido)
+            tamano = contenido.seek(0, 2)
+            cursor.execute('INSERT OR IGNORE INTO outbox_adjuntos (hash, contenido) VALUES (?, zeroblob(?))',
+                           (hash_contenido, tamano))
+            if cursor.rowcount and tamano:
+                with cursor.connection.blobopen('outbox_adjuntos', 'contenido', cursor.lastrowid) as blob:
+                    for bloque in leer_por_bloques(contenido):
+                        blob.write(bloque)
+        referencias.append([hash_contenido, nombre])
+    return referencias
+
+
+def recordar_credencial(campana, usuario, password):
+    """Contraseña con la que el worker de este proceso envía la campaña"""
+    with _candado_credenciales:
+        _credenciales[campana] = (usuario, password)
+
+
+def credencial(campana, usuario):
+    """Contraseña recordada para la campaña si es la de `usuario`, o None"""
+    with _candado_credenciales:
+        recordada = _credenciales.get(campana)
+    if recordada and recordada[0] == usuario:
+        return recordada[1]
+    return None
+
+
+def encolar(mensajes, campana, origen, servidor, puerto, usuario, password,
+            adjuntos=None, cuentas=None, cuota=None, seguridad=None):
+    """Agregar a la bandeja los mensajes (destinatarios, asunto, cuerpo, estudiante,
+    plantilla) de una campaña; cada dirección recibe su clave de idempotencia.
+
+    `adjuntos` es una lista de (nombre, contenido) común a todos los mensajes;
+    el contenido puede ser bytes, un memoryview (getbuffer() de st.file_uploader)
+    o un archivo abierto.
+    Con `cuentas` (nombres de cuentas guardadas) el worker reparte los envíos
+    entre ellas con `cuota` diaria por cuenta. `seguridad` como en SesionSMTP.
+    La contraseña queda sólo en la memoria del proceso (recordar_credencial).
+    Devuelve los mensajes encolados."""
+    recordar_credencial(campana, usuario, password)
+    with conectar() as conn:
+        cursor = conn.cursor()
+        referencias = json.dumps(_guardar_adjuntos(cursor, adjuntos))
+        cuentas_json = json.dumps(list(cuentas)) if cuentas else None
+        filas = []
+        for destinatarios, asunto, cuerpo, estudiante, plantilla in mensajes:
+            claves = {d: clave_idempotencia(campana, estudiante, d, plantilla) for d in destinatarios}
+            filas.append((
+                campana, origen, servidor, int(puerto), seguridad, usuario, cuentas_json, cuota,
+                json.dumps(list(destinatarios)), asunto, cuerpo, referencias, json.dumps(claves)
+            ))
+        cursor.executemany('''
+            INSERT INTO outbox (campana, origen, servidor, puerto, seguridad, usuario,
+                                cuentas, cuota, destinatarios, asunto, cuerpo, adjuntos, claves)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', filas)
+        # Campaña pausada o cancelada mientras se encolaba (ya con la escritura
+        # bloqueada, así que no se cruza con pausar_campana)
+        cursor.execute('SELECT estado FROM campanas WHERE campana = ?', (campana,))
+        row = cursor.fetchone()
+        if row and row[0] in ESTADO_DETENIDO:
+            _detener_mensajes(cursor, campana, row[0])
+        return len(filas)
+
+
+def _fila_a_dict(cursor, row):
+    fila = {columna[0]: valor for columna, valor in zip(cursor.description, row)}
+    fila['destinatarios'] = json.loads(fila['destinatarios'])
+    fila['adjuntos'] = json.loads(fila['adjuntos'] or '[]')
+    fila['cuentas'] = json.loads(fila['cuentas']) if fila['cuentas'] else None
+    fila['claves'] = json.loads(fila['claves'] or '{}')
+    return fila
+
+
+def tomar(trabajador, limite=50):
+    """Reservar para `trabajador` hasta `limite` mensajes listos para enviarse"""
+    ahora = time.time()
+    with conectar() as conn:
+        cursor = conn.cursor()
+        # BEGIN IMMEDIATE: dos workers nunca toman el mismo mensaje
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('''
+            SELECT id FROM outbox
+            WHERE estado = ? AND proximo_intento <= ?
+            ORDER BY proximo_intento, id
+            LIMIT ?
+        ''', (PENDIENTE, ahora, limite))
+        ids = [row[0] for row in cursor.fetchall()]
+        if not ids:
+            conn.rollback()
+            return []
+        marcas = ','.join('?' * len(ids))
+        cursor.execute(f'''
+            UPDATE outbox SET estado = ?, trabajador = ?, tomado = ?, actualizado = CURRENT_TIMESTAMP
+            WHERE id IN ({marcas})
+        ''', (ENVIANDO, trabajador, ahora, *ids))
+        cursor.execute(f'SELECT * FROM outbox WHERE id IN ({marcas}) ORDER BY id', ids)
+        filas = [_fila_a_dict(cursor, row) for row in cursor.fetchall()]
+        return filas
+
+
+def renovar(trabajador):
+    """Renovar la reserva de los mensajes que `trabajador` tiene tomados"""
+    with conectar() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE outbox SET tomado = ? WHERE estado = ? AND trabajador = ?
+        ''', (time.time(), ENVIANDO, trabajador))
+
+
+def bloques_adjunto(hash_contenido, tamano=BLOQUE):
+    """Contenido de un adjunto de la bandeja leído por bloques"""
+    with conectar() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT rowid FROM outbox_adjuntos WHERE hash = ?', (hash_contenido,))
+        row = cursor.fetchone()
+        if row is None:
+            raise KeyError(f"Adjunto {hash_contenido[:12]} no encontrado en la bandeja")
+        if not BLOB_POR_BLOQUES:
+            cursor.execute('SELECT contenido FROM outbox_adjuntos WHERE rowid = ?', (row[0],))
+            contenido = cursor.fetchone()[0]
+            for inicio in range(0, len(contenido), tamano):
+                yield contenido[inicio:inicio + tamano]
+            return
+        with conn.blobopen('outbox_adjuntos', 'contenido', row[0], readonly=True) as blob:
+            while True:
+                bloque = blob.read(tamano)
+                if not bloque:
+                    return
+                yield bloque
+
+
+def _fijar_estado_campana(cursor, campana, estado):
+    cursor.execute('''
+        INSERT INTO campanas (campana, estado) VALUES (?, ?)
+        ON CONFLICT(campana) DO UPDATE SET estado = excluded.estado, actualizado = CURRENT_TIMESTAMP
+    ''', (campana, estado))
+
+
+def _detener_mensajes(cursor, campana, estado):
+    """Sacar de la cola los mensajes por enviar de una campaña detenida; los
+    que un worker está enviando terminan y los demás ya no se toman"""
+    if estado == CAMPANA_CANCELADA:
+        cursor.execute('''
+            UPDATE outbox
+            SET estado = ?, resultado = ?, cuerpo = NULL, actualizado = CURRENT_TIMESTAMP
+            WHERE campana = ? AND estado IN (?, ?)
+        ''', (CANCELADO, "Cancelado por el usuario", campana, PENDIENTE, PAUSADO))
+    else:
+        cursor.execute('''
+            UPDATE outbox SET estado = ?, actualizado = CURRENT_TIMESTAMP
+            WHERE campana = ? AND estado = ?
+        ''', (PAUSADO, campana, PENDIENTE))
+    return cursor.rowcount
+
+
+def pausar_campana(campana):
+    """Pausar una campaña: ningún mensaje más sale hasta continuar_campana.
+    Devuelve los mensajes que quedaron en pausa"""
+    with conectar() as conn:
+        cursor = conn.cursor()
+        _fijar_estado_campana(cursor, campana, CAMPANA_PAUSADA)
+        pausados = _detener_mensajes(cursor, campana, CAMPANA_PAUSADA)
+    return pausados
+
+
+def continuar_campana(campana):
+    """Continuar una campaña pausada desde el siguiente mensaje: los cuerpos ya
+    están redactados en la bandeja y los enviados no se vuelven a tomar"""
+    with conectar() as conn:
+        cursor = conn.cursor()
+        _fijar_estado_campana(cursor, campana, ACTIVA)
+        cursor.execute('''
+            UPDATE outbox SET estado = ?, actualizado = CURRENT_TIMESTAMP
+            WHERE campana = ? AND estado = ?
+        ''', (PENDIENTE, campana, PAUSADO))
+        continuados = cursor.rowcount
+    return continuados
+
+
+def cancelar_campana(campana):
+    """Cancelar una campaña: los mensajes por enviar se descartan. Devuelve
+    cuántos se cancelaron"""
+    with conectar() as conn:
+        cursor = conn.cursor()
+        _fijar_estado_campana(cursor, campana, CAMPANA_CANCELADA)
+        cancelados = _detener_mensajes(cursor, campana, CAMPANA_CANCELADA)
+    return cancelados
+
+
+def campanas_detenidas(campanas):
+    """{campana: estado} de las campañas pausadas o canceladas entre `campanas`"""
+    campanas = list(set(campanas))
+    if not campanas:
+        return {}
+    with conectar() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT campana, estado FROM campanas
+            WHERE estado != ? AND campana IN ({','.join('?' * len(campanas))})
+        ''', (ACTIVA, *campanas))
+        detenidas = dict(cursor.fetchall())
+    return detenidas
+
+
+def devolver(id_mensaje):
+    """Devolver sin enviarlo un mensaje tomado de una campaña detenida; no
+    cuenta como intento. Toma el estado que la campaña tenga en ese momento"""
+    with conectar() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE outbox
+            SET estado = CASE (SELECT estado FROM campanas WHERE campanas.campana = outbox.campana)
+                             WHEN ? THEN ? WHEN ? THEN ? ELSE ? END,
+                trabajador = NULL, tomado = NULL, actualizado = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (CAMPANA_PAUSADA, PAUSADO, CAMPANA_CANCELADA, CANCELADO, PENDIENTE, id_mensaje))
+        cursor.execute('''
+            UPDATE outbox SET resultado = ?, cuerpo = NULL WHERE id = ? AND estado = ?
+        ''', ("Cancelado por el usuario", id_mensaje, CANCELADO))
+
+
+def reprogramar(id_mensaje, destinatarios, proximo_intento, resultado):
+    """Devolver a la cola un mensaje con los destinatarios que siguen pendientes"""
+    with conectar() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE outbox
+            SET estado = ?, destinatarios = ?, intentos = intentos + 1, proximo_intento = ?,
+                resultado = ?, trabajador = NULL, tomado = NULL, actualizado = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (PENDIENTE, json.dumps(list(destinatarios)), proximo_intento, resultado, id_mensaje))
+
+
+def finalizar(id_mensaje, estado, resultado):
+    """Marcar un mensaje como enviado o fallido. El cuerpo de un enviado ya no
+    hace falta y se borra; el de un fallido se conserva para reanudarlo"""
+    with conectar() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE outbox
+            SET estado = ?, resultado = ?, intentos = intentos + 1,
+                cuerpo = CASE WHEN ? = ? THEN NULL ELSE cuerpo END,
+                trabajador = NULL, tomado = NULL, actualizado = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (estado, resultado, estado, ENVIADO, id_mensaje))
+
+
+def reservar_entregas(entregas):
+    """Registrar antes de la transacción SMTP las entregas (clave, campana,
+    destinatario) que se van a intentar. Devuelve (entregadas, desconocidas):
+    las claves que ya constan como entregadas y las que siguen en curso desde
+    un intento anterior que nunca se confirmó (worker caído entre el envío y
+    la confirmación). Ninguna de las dos debe enviarse otra vez por sí sola"""
+    if not entregas:
+        return set(), set()
+    with conectar() as conn:
+        cursor = conn.cursor()
+        entregadas = set()
+        desconocidas = set()
+        claves = [clave for clave, _, _ in entregas]
+        for inicio in range(0, len(claves), 500):
+            bloque = claves[inicio:inicio + 500]
+            cursor.execute(f'''
+                SELECT clave, estado FROM entregas
+                WHERE estado IN (?, ?) AND clave IN ({','.join('?' * len(bloque))})
+            ''', (ENTREGADO, EN_CURSO, *bloque))
+            for clave, estado in cursor.fetchall():
+                (entregadas if estado == ENTREGADO else desconocidas).add(clave)
+        cursor.executemany('''
+            INSERT INTO entregas (clave, campana, destinatario, estado) VALUES (?, ?, ?, ?)
+            ON CONFLICT(clave) DO UPDATE SET estado = excluded.estado, actualizado = CURRENT_TIMESTAMP
+            WHERE entregas.estado NOT IN (?, ?)
+        ''', [(clave, campana, destinatario, EN_CURSO, ENTREGADO, EN_CURSO)
+              for clave, campana, destinatario in entregas
+              if clave not in entregadas and clave not in desconocidas])
+        return entregadas, desconocidas
+
+
+def confirmar_entregas(claves, estado=ENTREGADO):
+    """Registrar después de la transacción SMTP el resultado de cada clave"""
+    if not claves:
+        return
+    with conectar() as conn:
+        cursor = conn.cursor()
+        cursor.executemany('''
+            UPDATE entregas SET estado = ?, actualizado = CURRENT_TIMESTAMP WHERE clave = ?
+        ''', [(estado, clave) for clave in claves])
+
+
+def reanudar_campana(campana):
+    """Devolver a la cola los mensajes con error de una campaña; el worker
+    omite las direcciones que ya constan como entregadas"""
+    with conectar() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE outbox
+            SET estado = ?, intentos = 0, proximo_intento = 0, actualizado = CURRENT_TIMESTAMP
+            WHERE campana = ? AND estado = ?
+        ''', (PENDIENTE, campana, FALLIDO))
+        reanudados = cursor.rowcount
+    return reanudados
+
+
+def liberar_huerfanos(antiguedad=ANTIGUEDAD_HUERFANO):
+    """Devolver a la cola los mensajes de workers que dejaron de responder"""
+    with conectar() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE outbox SET estado = ?, trabajador = NULL, tomado = NULL
+            WHERE estado = ? AND tomado < ?
+        ''', (PENDIENTE, ENVIANDO, time.time() - antiguedad))
+        liberados = cursor.rowcount
+    return liberados
+
+
+def purgar_adjuntos():
+    """Borrar los adjuntos que ya no necesita ningún mensaje por enviar"""
+    with conectar() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT adjuntos FROM outbox WHERE estado IN (?, ?, ?)', (PENDIENTE, ENVIANDO, PAUSADO))
+        en_uso = {hash_contenido for (adjuntos,) in cursor.fetchall()
+                  for hash_contenido, _ in json.loads(adjuntos or '[]')}
+        cursor.execute('SELECT hash FROM outbox_adjuntos')
+        sobrantes = [(row[0],) for row in cursor.fetchall() if row[0] not in en_uso]
+        cursor.executemany('DELETE FROM outbox_adjuntos WHERE hash = ?', sobrantes)
+    return len(sobrantes)
+
+
+def purgar_terminados(dias=DIAS_RETENCION):
+    """Borrar los mensajes enviados, fallidos o cancelados hace más de `dias`
+    días, las entregas de las campañas que ya no tienen mensajes y su estado.
+    Devuelve cuántos mensajes se borraron"""
+    limite = f'-{int(dias)} days'
+    with conectar() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            DELETE FROM outbox WHERE estado IN (?, ?, ?) AND actualizado < datetime('now', ?)
+        ''', (ENVIADO, FALLIDO, CANCELADO, limite))
+        borrados = cursor.rowcount
+        # Mientras quede un mensaje de la campaña, sus claves evitan duplicados
+        # al reanudarla
+        cursor.execute('''
+            DELETE FROM entregas
+            WHERE actualizado < datetime('now', ?)
+              AND NOT EXISTS (SELECT 1 FROM outbox WHERE outbox.campana = entregas.campana)
+        ''', (limite,))
+        cursor.execute('''
+            DELETE FROM campanas
+            WHERE actualizado < datetime('now', ?)
+              AND NOT EXISTS (SELECT 1 FROM outbox WHERE outbox.campana = campanas.campana)
+        ''', (limite,))
+    return borrados
+
+
+def resumen_campanas(limite=20):
+    """Estado de las campañas más recientes para mostrar en la interfaz"""
+    with conectar() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT campana, origen, MIN(creado),
+                   SUM(estado = ?), SUM(estado = ?), SUM(estado = ?), SUM(estado = ?),
+                   SUM(estado = ?), SUM(estado = ?), COUNT(*)
+            FROM outbox
+            GROUP BY campana
+            ORDER BY MIN(id) DESC
+            LIMIT ?
+        ''', (PENDIENTE, ENVIANDO, ENVIADO, FALLIDO, PAUSADO, CANCELADO, limite))
+        campanas = []
+        for row in cursor.fetchall():
+            campanas.append({
+                'campana': row[0],
+                'origen': row[1],
+                'creada': row[2],
+                'pendientes': row[3],
+                'enviando': row[4],
+                'enviados': row[5],
+                'errores': row[6],
+                'pausados': row[7],
+                'cancelados': row[8],
+                'total': row[9]
+            })
+    return campanas
+
+
+def progreso_campana(campana):
+    """Mensajes de una campaña por estado ({estado: cantidad})"""
+    with conectar() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT estado, COUNT(*) FROM outbox WHERE campana = ? GROUP BY estado', (campana,))
+        conteos = dict(cursor.fetchall())
+    return conteos
+
+
+def ultimos_resultados(campana, limite=20):
+    """Últimos mensajes de una campaña con resultado (enviados, fallidos o
+    reprogramados), del más reciente al más antiguo"""
+    with conectar() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT actualizado, destinatarios, estado, resultado FROM outbox
+            WHERE campana = ? AND resultado IS NOT NULL
+            ORDER BY actualizado DESC, id DESC
+            LIMIT ?
+        ''', (campana, limite))
+        resultados = [
+            {'hora': row[0], 'destinatarios': json.loads(row[1]), 'estado': row[2], 'resultado': row[3]}
+            for row in cursor.fetchall()
+        ]
+    return resultados
+
+
+def contar_pendientes(pausados=False):
+    """Mensajes que aún no terminan (por enviar, en envío o esperando reintento);
+    con `pausados` también los de campañas en pausa"""
+    estados = (PENDIENTE, ENVIANDO, PAUSADO) if pausados else (PENDIENTE, ENVIANDO)
+    with conectar() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'SELECT COUNT(*) FROM outbox WHERE estado IN ({",".join("?" * len(estados))})', estados)
+        total = cursor.fetchone()[0]
+    return total
@@ -0,0 +1,664 @@
+import itertools
+import re
+import string
+import threading
+from functools import lru_cache
+
+import pandas as pd
+
+from analisis import (
+    lista_actividades_completadas, lista_actividades_faltantes, mascaras_completadas, matriz_completadas,
+    nombres_roster
+)
+from base_datos import al_guardar_plantilla, cargar_plantilla_db
+
+# =====================================================
+# PLANTILLAS DE CORREO
+# =====================================================
+
+PLANTILLAS_BASE = {
+    "uveg": {
+        "bienvenida": {
+            "nombre": "Bienvenida al Módulo",
+            "asunto": "Bienvenida al módulo {modulo} - UVEG",
+            "mensaje": """Buen día {nombre}.
+
+Mi nombre es Juan Manuel y seré tu asesor virtual en el módulo "{modulo}" de la UVEG. Te doy la bienvenida al curso y quiero compartirte algunas recomendaciones para organizar tu avance.
+
+Como sugerencia, te he marcado como meta entregar las primeras tres actividades antes del próximo {fecha_meta} al mediodía. Sin embargo, si comprendes bien los temas, puedes avanzar a tu propio ritmo, ya que el módulo tiene una duración total de 24 días naturales.
+
+El propósito de este mensaje es conocer si tienes algún inconveniente en este momento, como falta de tiempo, dificultades con las actividades, problemas de acceso a un dispositivo o Internet, o si simplemente tu estrategia de estudio no sigue el ritmo sugerido. Además, quiero que sepas que estaré pendiente de tu desarrollo académico y disponible para cualquier duda que tengas.
+
+A partir del martes, recibirás un correo con información sobre tu avance y para mantenernos en contacto. No es mi intención abrumarte, sino brindarte el soporte necesario para que tengas éxito en el curso.
+
+Importante: Te invito a revisar la sección "AVISOS" en tu aula virtual para estar al tanto de cualquier información relevante.
+
+Por último tenemos una cita este {fecha_sesion} a las {hora_sesion} horas, sesión síncrona para resolver dudas. El enlace lo encuentras dentro de tu aula virtual.
+
+Te pido me confirmes de recibido este correo.
+
+¡Mucho éxito en el módulo! Estoy aquí para ayudarte.
+
+Dr. Juan Manuel Martínez Zaragoza"""
+        },
+        "seguimiento_sin_acceso_semana_1": {
+            "nombre": "Seguimiento - Sin Acceso (Semana 1)",
+            "asunto": "Seguimiento {modulo} - Semana {semana} - UVEG",
+            "mensaje": """Buen día {nombre}.
+
+Mi nombre es Juan Manuel y soy tu asesor virtual en el módulo de "{modulo}" de la UVEG, en este momento estamos en la {semana_actual} semana del módulo, solo hemos avanzado algunos retos, con lo cual no presentas un gran atraso, te invito a que inicies tus actividades dentro de la plataforma (https://campus.uveg.edu.mx) y si tienes alguna duda con toda confianza me puedes contactar ya sea por este medio, por el mensajero de la plataforma o xxx por whatsapp.
+
+Agradecería pudieras comentarme la situación por la cual no has accedido al módulo, espero todo se encuentre bien.
+
+Dr. Juan Manuel Martínez Zaragoza"""
+        },
+        "seguimiento_sin_acceso_semana_2": {
+            "nombre": "Seguimiento - Sin Acceso (Semana 2)",
+            "asunto": "Seguimiento {modulo} - Semana {semana} - UVEG",
+            "mensaje": """Buen día {nombre}.
+
+Mi nombre es Juan Manuel y soy tu asesor virtual en el módulo de "{modulo}" de la UVEG. He tratado de comunicarme anteriormente contigo sin éxito.
+
+En este momento nos encontramos en la {semana_actual} semana del módulo y observo que aún no has iniciado ninguna actividad en la plataforma. Aunque todavía hay tiempo para ponerte al día, es importante que comiences cuanto antes para evitar un atraso mayor.
+
+Te invito cordialmente a que accedas a tu aula virtual (https://campus.uveg.edu.mx) y empieces con los retos programados. Recuerda que estoy aquí para apoyarte con cualquier duda o dificultad que tengas, ya sea por este medio, por el mensajero de la plataforma o xxx por whatsapp.
+
+Me preocupa no haber tenido noticias tuyas. Por favor, hazme saber si existe alguna situación que esté impidiendo tu participación en el módulo. Tu éxito académico es importante para mí.
+
+Quedo al pendiente de tu respuesta.
+
+Dr. Juan Manuel Martínez Zaragoza"""
+        },
+        "seguimiento_sin_acceso_semana_3": {
+            "nombre": "Seguimiento - Sin Acceso (Semana 3)",
+            "asunto": "Seguimiento URGENTE {modulo} - Semana {semana} - UVEG",
+            "mensaje": """Buen día {nombre}.
+
+Mi nombre es Juan Manuel y soy tu asesor virtual en el módulo de "{modulo}" de la UVEG. Espero puedas culminar tus actividades ya que el módulo está próximo a cerrar. No pude contactarte anteriormente, espero que todo vaya bien.
+
+Nos encontramos en la {semana_actual} semana del módulo y lamentablemente no he detectado actividad alguna de tu parte en la plataforma. El módulo cerrará la próxima semana y es crucial que inicies tus entregas lo antes posible para poder acreditar.
+
+Esta es tu última oportunidad para ponerte al corriente. Te exhorto a que ingreses de inmediato a tu aula virtual (https://campus.uveg.edu.mx) y comiences con los retos. Aunque el tiempo es limitado, aún es posible completar el módulo si actúas con rapidez.
+
+Si enfrentas alguna dificultad técnica, personal o académica, por favor comunícate conmigo de inmediato por cualquier medio: este correo, mensajero de la plataforma o xxx por whatsapp. Estoy dispuesto a brindarte todo el apoyo necesario.
+
+Espero sinceramente tener noticias tuyas y poder ayudarte a concluir exitosamente este módulo.
+
+Dr. Juan Manuel Martínez Zaragoza"""
+        },
+        "seguimiento_atraso_semana_1": {
+            "nombre": "Seguimiento - Tareas Pendientes (Semana 1)",
+            "asunto": "Seguimiento de avance {modulo} - Semana {semana} - UVEG",
+            "mensaje": """Buen día {nombre}.
+
+Mi nombre es Juan Manuel y soy tu asesor virtual en el módulo de "{modulo}" en la UVEG, en este momento estamos en la {semana_actual} semana del módulo. Me pongo en contacto, para saber si tienes algún inconveniente que no te este permitiendo avanzar al ritmo que les he marcado, ya que veo que tienes algunos retos pendientes y en tu avance semanal se ve reflejado.
+
+Retos pendientes:
+{actividades_faltantes}
+
+Recuerda que esta es solo una sugerencia, si consideras que no tienes inconveniente en avanzar a tu ritmo, haz caso omiso a este y los siguientes mensajes.
+
+Dr. Juan Manuel Martínez Zaragoza"""
+        },
+        "seguimiento_atraso_semana_2": {
+            "nombre": "Seguimiento - Tareas Pendientes (Semana 2)",
+            "asunto": "Seguimiento de avance {modulo} - Semana {semana} - UVEG",
+            "mensaje": """Buen día {nombre}.
+
+Mi nombre es Juan Manuel y soy tu asesor virtual en el módulo de "{modulo}" en la UVEG. Nos encontramos en la {semana_actual} semana del módulo y me comunico nuevamente contigo para dar seguimiento a tu progreso académico.
+
+He revisado tu avance y observo que aún tienes retos pendientes que deberías haber completado hasta esta semana. Estos son los retos que tienes pendientes hasta esta semana:
+
+Retos pendientes:
+{actividades_faltantes}
+
+Es importante que consideres ponerte al día con estas actividades para mantener un buen ritmo y evitar acumulación de trabajo al final del módulo. Si estás enfrentando alguna dificultad específica con los contenidos o tienes algún impedimento para avanzar, por favor comunícamelo para poder apoyarte.
+
+Recuerda que estas recomendaciones buscan ayudarte a tener éxito en el módulo. Si prefieres manejar tu propio ritmo de estudio, puedes hacer caso omiso a estos mensajes.
+
+Estoy disponible para resolver cualquier duda que tengas.
+
+Dr. Juan Manuel Martínez Zaragoza"""
+        },
+        "seguimiento_atraso_semana_3": {
+            "nombre": "Seguimiento - Tareas Pendientes (Semana 3)",
+            "asunto": "Seguimiento URGENTE de avance {modulo} - Semana {semana} - UVEG",
+            "mensaje": """Buen día {nombre}.
+
+Mi nombre es Juan Manuel y soy tu asesor virtual en el módulo de "{modulo}" en la UVEG. Estamos en la {semana_actual} semana y debo informarte que el módulo cierra la próxima semana.
+
+He realizado una revisión de tu expediente y me preocupa observar que tienes varios retos sin completar. Estos son TODOS tus retos pendientes:
+
+Retos pendientes:
+{actividades_faltantes}
+
+Es fundamental que te enfoques en completar estas actividades durante los próximos días para poder acreditar el módulo. El tiempo se está agotando y necesitas actuar con urgencia.
+
+Te ofrezco mi apoyo total para ayudarte a concluir. Si tienes dudas sobre algún tema, dificultades técnicas o necesitas orientación para organizar tu tiempo, no dudes en contactarme de inmediato por este medio, el mensajero de la plataforma o xxx por whatsapp.
+
+Esta es una situación crítica pero aún estás a tiempo de recuperarte. Te insto a que dediques el máximo esfuerzo posible en estos días finales.
+
+Quedo al pendiente y disponible para apoyarte en todo lo que necesites.
+
+Dr. Juan Manuel Martínez Zaragoza"""
+        },
+        "seguimiento_sin_acceso_semana_4": {
+            "nombre": "Seguimiento - Sin Acceso (Semana 4)",
+            "asunto": "ÚLTIMA OPORTUNIDAD {modulo} - Semana {semana} - UVEG",
+            "mensaje": """Buen día {nombre}.
+
+Mi nombre es Juan Manuel y soy tu asesor virtual en el módulo de "{modulo}" de la UVEG. Este es mi último intento de comunicación contigo.
+
+Nos encontramos en la {semana_actual} y ÚLTIMA semana del módulo. Lamentablemente, no he detectado ninguna actividad de tu parte durante todo el módulo y el cierre es INMINENTE.
+
+Esta es tu ÚLTIMA OPORTUNIDAD para acreditar el módulo. Si no entregas tus actividades en los próximos días, reprobarás el curso.
+
+Te URJO a que ingreses de inmediato a tu aula virtual (https://campus.uveg.edu.mx) y comiences con los retos. El tiempo se ha agotado y necesitas actuar AHORA MISMO.
+
+Si existe alguna razón de fuerza mayor que te ha impedido participar, comunícate conmigo URGENTEMENTE por cualquier medio: este correo, mensajero de la plataforma o xxx por whatsapp.
+
+Este es el cierre del módulo. Por favor, hazme saber tu situación lo antes posible.
+
+Dr. Juan Manuel Martínez Zaragoza"""
+        },
+        "seguimiento_atraso_semana_4": {
+            "nombre": "Seguimiento - Tareas Pendientes (Semana 4)",
+            "asunto": "CIERRE DEL MÓDULO {modulo} - Semana {semana} - UVEG",
+            "mensaje": """Buen día {nombre}.
+
+Mi nombre es Juan Manuel y soy tu asesor virtual en el módulo de "{modulo}" en la UVEG. Este mensaje es CRÍTICO: estamos en la {semana_actual} y ÚLTIMA semana del módulo, y el CIERRE ES INMINENTE.
+
+He revisado tu expediente y tienes los siguientes retos pendientes que DEBES completar URGENTEMENTE para poder acreditar:
+
+Retos pendientes:
+{actividades_faltantes}
+
+QUEDAN MUY POCOS DÍAS para el cierre del módulo. Si no completas estos retos INMEDIATAMENTE, reprobarás el curso.
+
+Esta es tu ÚLTIMA OPORTUNIDAD. Te exhorto a que dediques TODO tu tiempo disponible en las próximas horas/días para completar las actividades pendientes.
+
+Estoy disponible las 24 horas para resolver tus dudas de manera urgente. Contáctame de inmediato por este medio, el mensajero de la plataforma o xxx por whatsapp si necesitas ayuda.
+
+El tiempo se acabó. Actúa AHORA.
+
+Dr. Juan Manuel Martínez Zaragoza"""
+        },
+        "felicitacion": {
+            "nombre": "Felicitación por Desempeño",
+            "asunto": "Felicitaciones por tu desempeño - {modulo} - UVEG",
+            "mensaje": """Un gusto saludarte {nombre}.
+
+Por medio del presente, permíteme felicitarte por tu alto desempeño durante esta semana, con esto demuestras tu compromiso para con tu carrera y la resiliencia del día a día.
+
+Retos completados:
+{actividades_completadas}
+
+Continua así y no olvides revisar el tablero de avisos.
+
+Dr. Juan Manuel Martínez Zaragoza"""
+        }
+    },
+    "novauniversitas": {
+        "bienvenida": {
+            "nombre": "Bienvenida al Módulo",
+            "asunto": "Bienvenida al módulo {modulo} - NovaUniversitas",
+            "mensaje": """Apreciable {nombre},
+
+Mi nombre es Juan Manuel y seré tu asesor virtual en el módulo "{modulo}" de NovaUniversitas. Te doy la más cordial bienvenida al curso y quiero compartirte algunas recomendaciones importantes para tu éxito académico.
+
+Como guía inicial, te sugiero completar los primeros tres desafíos antes del {fecha_meta}. Sin embargo, tienes la flexibilidad de avanzar a tu propio ritmo, considerando que el módulo tiene una duración de 24 días naturales.
+
+Este mensaje tiene como propósito identificar si enfrentas algún inconveniente que pueda afectar tu rendimiento académico, tales como:
+- Limitaciones de tiempo
+- Dificultades técnicas con los desafíos
+- Problemas de conectividad o acceso a dispositivos
+- Necesidad de ajustar tu estrategia de estudio
+
+Estaré monitoreando constantemente tu progreso académico y me encuentro disponible para resolver cualquier duda o inquietud que puedas tener.
+
+A partir de la próxima semana, recibirás comunicaciones periódicas sobre tu avance académico para mantener un seguimiento personalizado de tu aprendizaje.
+
+Importante: Te recomiendo revisar regularmente la sección de "ANUNCIOS" en tu campus virtual para mantenerte informado sobre comunicaciones relevantes.{parrafo_sesion}
+
+Te solicito confirmar la recepción de este correo.
+
+¡Te deseo mucho éxito en tu trayectoria académica!
+
+Dr. Juan Manuel Martínez Zaragoza
+Asesor Virtual - NovaUniversitas"""
+        },
+        "seguimiento_sin_acceso": {
+            "nombre": "Seguimiento - Sin Acceso",
+            "asunto": "Seguimiento académico {modulo} - Semana {semana} - NovaUniversitas",
+            "mensaje": """Apreciable {nombre},
+
+Mi nombre es Juan Manuel, tu asesor virtual del módulo "{modulo}" en NovaUniversitas. Me dirijo a ti en relación a tu progreso académico en la {semana_actual} semana del módulo.
+
+He observado que aún no has iniciado actividades en la plataforma educativa. Aunque esto no representa un atraso significativo en este momento, es importante que comiences con los desafíos programados para mantener un ritmo adecuado de aprendizaje.
+
+Te invito cordialmente a:
+- Acceder a tu campus virtual de NovaUniversitas
+- Revisar los desafíos disponibles
+- Contactarme ante cualquier duda o dificultad
+
+Estoy disponible para brindarte apoyo a través de:
+- Este correo electrónico
+- Mensajería interna del campus virtual
+- WhatsApp: xxx (agrega tu número)
+
+Me interesa conocer si existe alguna situación particular que esté impidiendo tu participación en el módulo. Tu bienestar y éxito académico son mi prioridad.
+
+Quedo atento a tu pronta respuesta.
+
+Saludos cordiales,
+
+Dr. Juan Manuel Martínez Zaragoza
+Asesor Virtual - NovaUniversitas"""
+        },
+        "seguimiento_atraso": {
+            "nombre": "Seguimiento - Desafíos Pendientes",
+            "asunto": "Seguimiento de progreso {modulo} - Semana {semana} - NovaUniversitas",
+            "mensaje": """Apreciable {nombre},
+
+Mi nombre es Juan Manuel, tu asesor virtual del módulo "{modulo}" en NovaUniversitas. Me pongo en contacto contigo para hacer un seguimiento de tu progreso académico en la {semana_actual} semana del módulo.
+
+He revisado tu expediente académico y he identificado algunos desafíos pendientes que requieren tu atención para mantener el ritmo de aprendizaje sugerido:
+
+Desafíos pendientes por completar:
+{actividades_faltantes}
+
+Es importante mencionar que estas recomendaciones de ritmo están diseñadas para optimizar tu experiencia de aprendizaje. Si consideras que puedes manejar un ritmo diferente y no requieres este seguimiento, puedes hacer caso omiso a estas comunicaciones.
+
+Sin embargo, si necesitas apoyo o tienes alguna dificultad específica, estoy aquí para ayudarte. Podemos trabajar juntos en una estrategia personalizada que se adapte a tus necesidades.
+
+Opciones de contacto:
+- Responder a este correo
+- Mensajería del campus virtual
+- WhatsApp: xxx (agrega tu número)
+
+Tu éxito académico es importante para mí.
+
+Saludos cordiales,
+
+Dr. Juan Manuel Martínez Zaragoza
+Asesor Virtual - NovaUniversitas"""
+        },
+        "felicitacion": {
+            "nombre": "Reconocimiento Académico",
+            "asunto": "Felicitaciones por tu excelente desempeño - {modulo} - NovaUniversitas",
+            "mensaje": """Apreciable {nombre},
+
+Es un placer dirigirme a ti para reconocer tu destacado desempeño académico en el módulo "{modulo}" de NovaUniversitas durante esta semana.
+
+Tu dedicación y compromiso con tu formación profesional son evidentes a través de los resultados obtenidos:
+
+Desafíos completados exitosamente:
+{actividades_completadas}
+
+Este nivel de excelencia académica refleja tu seriedad y determinación hacia tus objetivos educativos. Tu constancia y esfuerzo son cualidades que sin duda te llevarán al éxito profesional.
+
+Te motivo a continuar con esta actitud ejemplar y te recordamos revisar periódicamente el tablero de anuncios en tu campus virtual para mantenerte informado sobre novedades importantes.
+
+Sigue adelante con esa misma dedicación. ¡Tu futuro profesional se construye con cada logro como este!
+
+Felicitaciones nuevamente por tu excelente trabajo.
+
+Saludos cordiales,
+
+Dr. Juan Manuel Martínez Zaragoza
+Asesor Virtual - NovaUniversitas"""
+        }
+    }
+}
+
+TIPOS_POR_SEMANA = ["seguimiento_sin_acceso", "seguimiento_atraso"]
+
+class CachePlantillas:
+    """Plantillas ya resueltas (BD o PLANTILLAS_BASE) por (institucion, tipo, semana).
+
+    Cada entrada recuerda qué filas de la tabla plantillas consultó para
+    resolverse; al guardar una plantilla sólo se descartan las entradas que
+    dependen de esa fila."""
+
+    def __init__(self):
+        self._plantillas = {}
+        self._dependencias = {}
+        self._version = 0
+        self._candado = threading.Lock()
+
+    def obtener(self, clave, resolver):
+        """Plantilla de `clave`; `resolver()` devuelve (plantilla, filas consultadas)"""
+        with self._candado:
+            if clave in self._plantillas:
+                return self._plantillas[clave].copy()
+            version = self._version
+        plantilla, consultadas = resolver()
+        with self._candado:
+            # Si se guardó una plantilla mientras tanto, no guardar lo resuelto
+            if version == self._version:
+                self._plantillas[clave] = plantilla
+                for fila in consultadas:
+                    self._dependencias.setdefault(fila, set()).add(clave)
+        return plantilla.copy()
+
+    def invalidar(self, institucion, tipo):
+        with self._candado:
+            self._version += 1
+            for clave in self._dependencias.pop((institucion, tipo), ()):
+                self._plantillas.pop(clave, None)
+
+cache_plantillas = CachePlantillas()
+al_guardar_plantilla(cache_plantillas.invalidar)
+
+def _resolver_plantilla(institucion, tipo, semana):
+    consultadas = []
+    # Para UVEG, si se proporciona semana, usar la plantilla específica
+    if semana:
+        tipo_con_semana = f"{tipo}_semana_{semana}"
+        consultadas.append((institucion, tipo_con_semana))
+        plantilla_db = cargar_plantilla_db(institucion, tipo_con_semana)
+        if plantilla_db:
+            return plantilla_db, consultadas
+        elif tipo_con_semana in PLANTILLAS_BASE[institucion]:
+            return PLANTILLAS_BASE[institucion][tipo_con_semana].copy(), consultadas
+    
+    # Caso por defecto
+    consultadas.append((institucion, tipo))
+    plantilla_db = cargar_plantilla_db(institucion, tipo)
+    if plantilla_db:
+        return plantilla_db, consultadas
+    else:
+        return PLANTILLAS_BASE[institucion][tipo].copy(), consultadas
+
+def obtener_plantilla(institucion, tipo, semana=None):
+    """Obtiene la plantilla correcta según institución, tipo y semana"""
+    if not (institucion == "uveg" and tipo in TIPOS_POR_SEMANA):
+        semana = None
+    return cache_plantillas.obtener(
+        (institucion, tipo, semana), lambda: _resolver_plantilla(institucion, tipo, semana)
+    )
+
+# =====================================================
+# PLANTILLAS COMPILADAS
+# =====================================================
+
+class PlantillaInvalida(ValueError):
+    """Plantilla con llaves mal cerradas o con campos que no existen"""
+
+
+_formateador = string.Formatter()
+
+
+class PlantillaCompilada:
+    """Texto con campos {asi} (sintaxis de str.format) analizado una sola vez.
+
+    Conoce los campos que necesita, de modo que se valida contra las variables
+    disponibles antes de empezar un envío, y redacta un roster completo en una
+    llamada armando una sola vez los tramos que no cambian entre estudiantes."""
+
+    def __init__(self, texto):
+        self.texto = texto
+        self._partes = []
+        self.campos = set()
+        try:
+            for literal, campo, formato, conversion in _formateador.parse(texto):
+                raiz = None
+                if campo is not None:
+                    raiz = re.match(r'[^.\[]*', campo).group()
+                    if not raiz or raiz.isdigit():
+                        raise PlantillaInvalida("Los campos deben tener nombre, por ejemplo {nombre}; '{}' no es válido")
+                    if '{' in formato:
+                        raise PlantillaInvalida(f"Formato anidado no permitido en {{{campo}:{formato}}}")
+                    self.campos.add(raiz)
+                self._partes.append((literal, campo, raiz, conversion, formato))
+        except ValueError as e:
+            if isinstance(e, PlantillaInvalida):
+                raise
+            raise PlantillaInvalida(f"Llaves mal cerradas en la plantilla ({e}); para escribir una llave usa {{{{ o }}}}") from e
+
+    def faltantes(self, disponibles):
+        return sorted(self.campos - set(disponibles))
+
+    def validar(self, disponibles, donde="La plantilla"):
+        faltantes = self.faltantes(disponibles)
+        if faltantes:
+            raise PlantillaInvalida(
+                f"{donde} usa campos que no existen: {', '.join('{' + c + '}' for c in faltantes)}. "
+                f"Disponibles: {', '.join('{' + c + '}' for c in sorted(disponibles))}"
+            )
+
+    @staticmethod
+    def _valor(campo, conversion, formato, valores):
+        valor = _formateador.get_field(campo, (), valores)[0]
+        return format(_formateador.convert_field(valor, conversion), formato)
+
+    def render(self, **valores):
+        return ''.join(
+            literal if campo is None else literal + self._valor(campo, conversion, formato, valores)
+            for literal, campo, _, conversion, formato in self._partes
+        )
+
+    def render_lote(self, comunes, por_fila):
+        """Textos de muchas filas en una llamada: `comunes` son los valores
+        iguales para todas y `por_fila` {campo: lista con un valor por fila}"""
+        filas = len(next(iter(por_fila.values()))) if por_fila else 1
+        tramos = []
+        fijo = []
+        for literal, campo, raiz, conversion, formato in self._partes:
+            fijo.append(literal)
+            if campo is None:
+                continue
+            if raiz not in por_fila:
+                fijo.append(self._valor(campo, conversion, formato, comunes))
+                continue
+            tramos.append(''.join(fijo))
+            fijo = []
+            if campo == raiz and conversion is None and not formato:
+                tramos.append([v if isinstance(v, str) else format(v) for v in por_fila[raiz]])
+            else:
+                tramos.append([self._valor(campo, conversion, formato, {raiz: v}) for v in por_fila[raiz]])
+        tramos.append(''.join(fijo))
+        if len(tramos) == 1:
+            return [tramos[0]] * filas
+        columnas = [itertools.repeat(t, filas) if isinstance(t, str) else t for t in tramos]
+        return [''.join(partes) for partes in zip(*columnas)]
+
+
+@lru_cache(maxsize=256)
+def compilar(texto):
+    """Plantilla compilada de un texto; cada texto se analiza una sola vez"""
+    return PlantillaCompilada(texto)
+
+
+# Campos que cada tipo de plantilla toma de la fila del estudiante, además
+# de variables_extra
+CAMPOS_FILA = {
+    "felicitacion": ["nombre", "actividades_completadas"],
+    "seguimiento_atraso": ["nombre", "actividades_faltantes"],
+}
+CAMPOS_FILA_DEFECTO = ["nombre"]
+
+
+def compilar_plantilla(plantilla, tipo_plantilla, variables_extra):
+    """(asunto, mensaje) compilados y validados; lanza PlantillaInvalida antes
+    de redactar el primer mensaje si falta algún campo"""
+    asunto = compilar(plantilla['asunto'])
+    asunto.validar(variables_extra, "El asunto")
+    mensaje = compilar(plantilla['mensaje'])
+    mensaje.validar(set(variables_extra) | set(CAMPOS_FILA.get(tipo_plantilla, CAMPOS_FILA_DEFECTO)), "El mensaje")
+    return asunto, mensaje
+
+
+def _mascaras(estudiantes, config_institucion):
+    """Máscaras de actividades calculadas en el análisis (o para estas filas)"""
+    if 'mascara_actividades' in estudiantes.columns:
+        return [int(m) for m in estudiantes['mascara_actividades'].tolist()]
+    columnas = config_institucion['columnas_actividades']
+    return mascaras_completadas(matriz_completadas(estudiantes, columnas), columnas).tolist()
+
+
+def _campos_fila(estudiantes, tipo_plantilla, datos):
+    """Valores por estudiante de los campos de la plantilla, en listas"""
+    institucion = datos['institucion']
+    config_institucion = datos['config_institucion']
+    campos = {'nombre': nombres_roster(estudiantes)}
+    if tipo_plantilla == "felicitacion":
+        campos['actividades_completadas'] = [
+            lista_actividades_completadas(institucion, mascara)
+            for mascara in _mascaras(estudiantes, config_institucion)
+        ]
+    elif tipo_plantilla == "seguimiento_atraso":
+        # Para semana 3, mostrar TODAS las actividades pendientes
+        num_actividades_a_revisar = len(config_institucion['columnas_actividades']) if datos['semana'] == 3 else datos['actividades_requeridas']
+        campos['actividades_faltantes'] = [
+            lista_actividades_faltantes(institucion, mascara, num_actividades_a_revisar)
+            for mascara in _mascaras(estudiantes, config_institucion)
+        ]
+    return campos
+
+
+def redactar_lote(estudiantes, tipo_plantilla, datos, plantilla=None):
+    """Asunto y mensaje de cada estudiante del DataFrame con la plantilla del
+    tipo indicado (o con `plantilla`, p. ej. el texto que se está editando);
+    devuelve un DataFrame con columnas 'asunto' y 'mensaje' y el mismo índice.
+    `datos` es el resultado del análisis (institución, semana, variables...)"""
+    variables_extra = datos['variables_extra']
+    if plantilla is None:
+        plantilla = obtener_plantilla(datos['institucion'], tipo_plantilla, datos['semana'])
+    asunto, mensaje = compilar_plantilla(plantilla, tipo_plantilla, variables_extra)
+    return pd.DataFrame({
+        'asunto': asunto.render_lote(variables_extra, {}) * len(estudiantes),
+        'mensaje': mensaje.render_lote(variables_extra, _campos_fila(estudiantes, tipo_plantilla, datos))
+    }, index=estudiantes.index)
+
+
+def redactar_mensaje(estudiante, tipo_plantilla, datos, plantilla=None):
+    """Asunto y mensaje de un solo estudiante (vista previa)"""
+    fila = redactar_lote(estudiante.to_frame().T, tipo_plantilla, datos, plantilla).iloc[0]
+    return fila['asunto'], fila['mensaje']
+
+# =====================================================
+# PLANTILLAS DE PRÁCTICAS (TAB 2) Y BIENVENIDA NOVA (TAB 3)
+# =====================================================
+
+PLANTILLAS_PRACTICAS = {
+    "Bienvenida": {
+        "asunto": "Bienvenida y primer reto - Estancias Profesionales UVEG",
+        "contenido": """Apreciable {nombre_completo}:
+
+Mi nombre es {nombre_asesor}, y seré tu asesor durante el desarrollo de las Estancias Profesionales en la {universidad}. Te doy la más cordial bienvenida al curso y aprovecho para compartirte información importante.
+
+Primer Reto (Reto 1 - Carta de Autorización):  
+He programado como fecha de entrega el {fecha_cierre_actividad} a medio día.  
+Es importante que todos los datos solicitados estén correctos y completos, ya que la evaluación será binaria (100 o 0 puntos).  
+Si no acreditas el Reto 1, no podrás continuar con los siguientes retos.
+
+Periodo de prácticas profesionales:  
+- Inicio: {fecha_inicio_practicas}  
+- Término: {fecha_fin_practicas}
+
+Importante: Revisa con atención la rúbrica del Reto 1. Es fundamental que cumplas todos los criterios exactamente como se indican.
+
+También te pido que revises la sección de "Avisos" en tu aula virtual para mantenerte al tanto de cualquier novedad.
+
+Quedo a tu disposición para cualquier duda. Recuerda que no estás solo/a, estoy aquí para ayudarte durante todo el proceso.
+
+Te agradeceré que me confirmes la recepción de este correo.
+
+Atentamente,  
+{nombre_completo_asesor}  
+Asesor Virtual  
+{nombre_universidad}"""
+    },
+    
+    "Sesión Síncrona": {
+        "asunto": "Invitación - Sesión síncrona de las prácticas profesionales",
+        "contenido": """Buen día, {nombre}:
+
+El presente tiene el objetivo de invitarte a la: Sesión síncrona de las prácticas profesionales
+
+{info_google_meet}
+
+Te esperamos puntualmente.
+
+Saludos cordiales,
+{nombre_asesor}"""
+    },
+    
+    "Envío de Grabación": {
+        "asunto": "Grabación de sesión síncrona - Reto {numero_reto}",
+        "contenido": """Buen día, {nombre}:
+
+Envío la grabación de la sesión síncrona, correspondiente al reto {numero_reto}:
+
+Enlace: {enlace_grabacion}
+
+Agradeceré me contestes de recibido este mensaje.
+
+Quedo al pendiente.
+
+Saludos,
+{nombre_asesor}"""
+    },
+    
+    "Libre": {
+        "asunto": "",
+        "contenido": """Apreciable {nombre}:
+
+[Escribe aquí tu mensaje personalizado]
+
+Saludos cordiales,
+{nombre_asesor}"""
+    }
+}
+
+# Campos de las plantillas de prácticas que salen de cada fila; el resto
+# (asesor, universidad, fechas...) son iguales para todos
+CAMPOS_FILA_PRACTICAS = ["nombre", "nombre_completo"]
+
+def redactar_practicas(estudiantes, contenido, variables):
+    """Contenido de la plantilla de prácticas para cada estudiante, validado
+    contra `variables` antes de redactar el primero"""
+    plantilla = compilar(contenido)
+    plantilla.validar(set(variables) | set(CAMPOS_FILA_PRACTICAS), "El contenido")
+    nombres = estudiantes['Nombre'].tolist()
+    return plantilla.render_lote(variables, {
+        'nombre': nombres,
+        'nombre_completo': [f"{nombre} {apellidos}" for nombre, apellidos in zip(nombres, estudiantes['Apellido(s)'].tolist())]
+    })
+
+def generar_mensaje_personalizado(nombre, correo_institucional, contrasena):
+    """Genera el mensaje personalizado para cada estudiante"""
+    mensaje = f"""Apreciable {nombre},
+
+¡Te damos la más cordial bienvenida a **NovaUniversitas**! Nos complace que formes parte de nuestra comunidad académica en esta nueva etapa de aprendizaje.
+
+Para acceder a tu **cuenta de correo institucional**:
+
+**Correo institucional:** {correo_institucional}
+**Contraseña temporal:** {contrasena}
+
+**Si estás recursando, mantienes tu contraseña que has modificado.**
+
+Te recomendamos acceder cuanto antes y cambiar tu contraseña por una más segura.
+
+**IMPORTANTE**: Una vez dentro de tu correo, busca el mensaje que contiene el usuario y contraseña de la plataforma virtual:
+https://virtual.novauniversitas.edu.mx
+
+**Tutorial para inicio de sesiones:**
+https://youtu.be/75ib7aN0Tvw?feature=shared
+
+Desde **Coordinación Virtual**, estamos aquí para apoyarte en todo este proceso. Si tienes dudas o necesitas ayuda con el acceso, no dudes en contactarnos en mesadeayuda@virtual.novauniversitas.edu.mx
+
+Te dejo un enlace a los lineamientos que debes seguir con el uso del correo institucional.
+
+**Por favor, confirme de recibido.**
+
+¡Te deseamos mucho éxito en esta nueva etapa!
+
+Atentamente,
+**M.D. Juan Manuel Martínez Zaragoza**
+Coordinación Virtual
+**www.virtual.novauniversitas.edu.mx**"""
+    
+    return mensaje
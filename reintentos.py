@@ -0,0 +1,80 @@
+import random
+import smtplib
+
+from envio_smtp import codigo_smtp
+
+# =====================================================
+# CLASIFICACIÓN DE ERRORES SMTP Y ESPERA ENTRE REINTENTOS
+# =====================================================
+
+PERMANENTE = "permanente"
+TRANSITORIO = "temporal"
+CUENTA = "cuenta/cuota"
+# Un intento anterior se interrumpió sin confirmar la entrega (no es un error SMTP)
+DESCONOCIDO = "entrega desconocida"
+
+CODIGOS_AUTENTICACION = (530, 534, 535)
+TEXTOS_CUOTA = ("quota", "limit exceeded", "5.4.5")
+
+
+class ErrorDeCuenta(Exception):
+    """La cuenta remitente no puede enviar (credenciales o cuota)"""
+
+
+def es_error_de_cuota(error):
+    codigo = codigo_smtp(error)
+    texto = str(error).lower()
+    return bool(codigo) and codigo >= 500 and any(t in texto for t in TEXTOS_CUOTA)
+
+
+def clasificar_error_smtp(error):
+    """Clasificar un error de envío en PERMANENTE, TRANSITORIO o CUENTA
+    según el código de respuesta SMTP"""
+    codigo = codigo_smtp(error)
+    if isinstance(error, (smtplib.SMTPAuthenticationError, ErrorDeCuenta)) \
+            or codigo in CODIGOS_AUTENTICACION or es_error_de_cuota(error):
+        return CUENTA
+    if codigo is not None:
+        return TRANSITORIO if 400 <= codigo < 500 else PERMANENTE
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return TRANSITORIO
+    if isinstance(error, smtplib.SMTPException):
+        return PERMANENTE
+    if isinstance(error, OSError):
+        # Timeouts y conexiones rechazadas o reiniciadas
+        return TRANSITORIO
+    return PERMANENTE
+
+
+def clasificar_destinatarios(destinatarios, rechazados=None, error=None):
+    """Resultado de cada destinatario de una transacción con varios RCPT TO.
+
+    Devuelve {destinatario: (clase, detalle)}; clase es None si el servidor
+    aceptó la dirección. `rechazados` es el diccionario que devuelve sendmail
+    y `error` la excepción de la transacción, si la hubo."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        rechazados = error.recipients
+    elif error is not None:
+        clase = clasificar_error_smtp(error)
+        return {destinatario: (clase, str(error)) for destinatario in destinatarios}
+    rechazados = rechazados or {}
+    resultado = {}
+    for destinatario in destinatarios:
+        if destinatario not in rechazados:
+            # Con SMTPRecipientsRefused no se llegó a enviar el mensaje (todos
+            # rechazados o 421 a mitad de los RCPT): las aceptadas se reintentan
+            resultado[destinatario] = (None, None) if error is None else \
+                (TRANSITORIO, "Transacción interrumpida antes de enviar el mensaje")
+            continue
+        codigo, texto = rechazados[destinatario]
+        if isinstance(texto, bytes):
+            texto = texto.decode('utf-8', 'replace')
+        error_rcpt = smtplib.SMTPRecipientsRefused({destinatario: (codigo, texto)})
+        resultado[destinatario] = (clasificar_error_smtp(error_rcpt), f"({codigo}) {texto}")
+    return resultado
+
+
+def espera_reintento(intento, espera_base=5, espera_maxima=300):
+    """Segundos antes del reintento número `intento`: backoff exponencial con jitter"""
+    espera = min(espera_maxima, espera_base * 2 ** (intento - 1))
+    return espera * random.uniform(0.5, 1.5)
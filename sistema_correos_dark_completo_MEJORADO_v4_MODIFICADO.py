@@ -1,16 +1,32 @@
 import streamlit as st
 import pandas as pd
 import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email import encoders
-import mimetypes
 from datetime import datetime, timedelta
+from functools import partial
 import time
-import sqlite3
 import json
 import os
+from base_datos import (
+    init_database, gestor_conexiones, escritor_historial, guardar_cuenta_db,
+    cargar_cuentas_db, eliminar_cuenta_db, guardar_plantilla_db, guardar_historial_db,
+    cargar_historial_db, resumen_historial_db, limpiar_historial_db
+)
+from envio_smtp import PoolSMTP, SERVIDOR_GMAIL, PUERTO_GMAIL_SSL
+from limitador import LimitadorEnvios
+from reintentos import clasificar_error_smtp
+from adjuntos import CacheAdjuntos, hash_archivo, leer_por_bloques
+from libros import CacheLibros, DIRECTORIO_INSTANTANEAS, TIPOS_ROSTER
+from outbox import contar_pendientes, encolar, reanudar_campana, recordar_credencial, resumen_campanas
+from trabajos import EN_PAUSA, RegistroTrabajos
+from worker_envios import TrabajadorEnvios, con_remitente, preparar_mensaje
+from analisis import (
+    CONFIGURACIONES_INSTITUCIONES, emails_validos_roster, obtener_nombre_completo,
+    formatear_fecha, columnas_roster, clasificar_estudiantes
+)
+from plantillas import (
+    PLANTILLAS_BASE, PLANTILLAS_PRACTICAS, PlantillaInvalida, compilar_plantilla, obtener_plantilla,
+    redactar_lote, redactar_mensaje, redactar_practicas, generar_mensaje_personalizado
+)
 
 # Configuración de página con tema oscuro
 st.set_page_config(
@@ -191,159 +207,69 @@ st.markdown("""
 # BASE DE DATOS SQLITE PERSISTENTE
 # =====================================================
 
-DB_FILE = "sistema_correos.db"
-
-def init_database():
-    """Inicializar base de datos SQLite"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    # Tabla de cuentas
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS cuentas (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            nombre TEXT UNIQUE NOT NULL,
-            email TEXT NOT NULL,
-            password TEXT NOT NULL,
-            ultima_uso TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Tabla de plantillas
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS plantillas (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            institucion TEXT NOT NULL,
-            tipo TEXT NOT NULL,
-            nombre TEXT NOT NULL,
-            asunto TEXT NOT NULL,
-            mensaje TEXT NOT NULL,
-            fecha_modificacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(institucion, tipo)
-        )
-    ''')
-    
-    # Tabla de historial
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS historial (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            asunto TEXT,
-            destinatario TEXT,
-            estado TEXT
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
-
-def guardar_cuenta_db(nombre, email, password):
-    """Guardar cuenta en base de datos"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    try:
-        cursor.execute('''
-            INSERT OR REPLACE INTO cuentas (nombre, email, password, ultima_uso)
-            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
-        ''', (nombre, email, password))
-        conn.commit()
-        return True
-    except Exception as e:
-        st.error(f"Error al guardar cuenta: {e}")
-        return False
-    finally:
-        conn.close()
-
-def cargar_cuentas_db():
-    """Cargar todas las cuentas de la base de datos"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute('SELECT nombre, email, password, ultima_uso FROM cuentas ORDER BY ultima_uso DESC')
-    cuentas = {}
-    for row in cursor.fetchall():
-        cuentas[row[0]] = {
-            'email': row[1],
-            'password': row[2],
-            'ultima_uso': row[3]
-        }
-    conn.close()
-    return cuentas
-
-def eliminar_cuenta_db(nombre):
-    """Eliminar cuenta de la base de datos"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM cuentas WHERE nombre = ?', (nombre,))
-    conn.commit()
-    conn.close()
-
-def guardar_plantilla_db(institucion, tipo, nombre, asunto, mensaje):
-    """Guardar plantilla en base de datos"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT OR REPLACE INTO plantillas (institucion, tipo, nombre, asunto, mensaje, fecha_modificacion)
-        VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-    ''', (institucion, tipo, nombre, asunto, mensaje))
-    conn.commit()
-    conn.close()
-
-def cargar_plantilla_db(institucion, tipo):
-    """Cargar plantilla de la base de datos"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT nombre, asunto, mensaje FROM plantillas 
-        WHERE institucion = ? AND tipo = ?
-    ''', (institucion, tipo))
-    row = cursor.fetchone()
-    conn.close()
-    if row:
-        return {'nombre': row[0], 'asunto': row[1], 'mensaje': row[2]}
-    return None
-
-def guardar_historial_db(asunto, destinatario, estado):
-    """Guardar en historial"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO historial (timestamp, asunto, destinatario, estado)
-        VALUES (CURRENT_TIMESTAMP, ?, ?, ?)
-    ''', (asunto, destinatario, estado))
-    conn.commit()
-    conn.close()
-
-def cargar_historial_db(limite=100):
-    """Cargar historial de base de datos"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT timestamp, asunto, destinatario, estado 
-        FROM historial 
-        ORDER BY timestamp DESC 
-        LIMIT ?
-    ''', (limite,))
-    historial = []
-    for row in cursor.fetchall():
-        historial.append({
-            'timestamp': row[0],
-            'asunto': row[1],
-            'destinatario': row[2],
-            'estado': row[3]
-        })
-    conn.close()
-    return historial
-
-def limpiar_historial_db():
-    """Limpiar historial"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM historial')
-    conn.commit()
-    conn.close()
+@st.cache_resource
+def obtener_gestor_conexiones():
+    """Conexiones SQLite en modo WAL compartidas entre reruns; las tablas se
+    crean una sola vez por proceso"""
+    init_database()
+    return gestor_conexiones
 
 # Inicializar base de datos al inicio
-init_database()
+obtener_gestor_conexiones()
+
+# =====================================================
+# POOL DE CONEXIONES SMTP
+# =====================================================
+
+@st.cache_resource
+def obtener_limitador():
+    """Limitador de ritmo global y por cuenta, compartido por las tres pestañas"""
+    return LimitadorEnvios()
+
+@st.cache_resource
+def obtener_pool_smtp():
+    """Pool de sesiones SMTP compartido entre reruns"""
+    return PoolSMTP(max_por_cuenta=10, limitador=obtener_limitador())
+
+@st.cache_resource
+def obtener_cache_adjuntos():
+    """Adjuntos codificados una sola vez por contenido, compartidos entre reruns"""
+    return CacheAdjuntos()
+
+@st.cache_resource
+def obtener_trabajador():
+    """Worker de la bandeja de salida dentro del servidor: sigue enviando
+    aunque se cierre la pestaña o se haga rerun"""
+    return TrabajadorEnvios(
+        pool=obtener_pool_smtp(),
+        limitador=obtener_limitador(),
+        cache_adjuntos=obtener_cache_adjuntos()
+    )
+
+@st.cache_resource
+def obtener_registro_trabajos():
+    """Campañas lanzadas desde la interfaz, con su avance; compartido entre
+    reruns y sesiones"""
+    return RegistroTrabajos()
+
+@st.cache_resource
+def obtener_cache_libros():
+    """Rosters leídos una sola vez por contenido, compartidos por las tres
+    pestañas y entre reruns; los Excel quedan además como instantánea Parquet"""
+    return CacheLibros(directorio=DIRECTORIO_INSTANTANEAS)
+
+def preparar_adjuntos(archivos):
+    """Adjuntos (hash, nombre, cargar) de los archivos subidos; se codifican en
+    disco una sola vez y se leen por bloques en cada mensaje"""
+    adjuntos = []
+    for archivo in archivos or []:
+        if archivo is None:
+            continue
+        try:
+            adjuntos.append((hash_archivo(archivo), archivo.name, partial(leer_por_bloques, archivo)))
+        except Exception as e:
+            st.warning(f"No se pudo adjuntar {archivo.name}: {str(e)}")
+    return adjuntos
 
 # Título principal
 st.title("📧 Sistema de Correos Académicos")
@@ -499,6 +425,161 @@ if 'email_actual' not in st.session_state or 'password_actual' not in st.session
 REMITENTE = st.session_state.email_actual
 CLAVE_APP = st.session_state.password_actual
 
+# =====================================================
+# RITMO DE ENVÍO
+# =====================================================
+
+with st.expander("⏱️ Ritmo de envío"):
+    col_global, col_rafaga, col_cuenta, col_simultaneos = st.columns(4)
+    with col_global:
+        correos_por_minuto = st.number_input("Correos por minuto (total):", value=240, min_value=1, key="ritmo_global")
+    with col_rafaga:
+        rafaga_envio = st.number_input("Ráfaga máxima:", value=20, min_value=1, key="ritmo_rafaga")
+    with col_cuenta:
+        correos_por_minuto_cuenta = st.number_input("Correos por minuto por cuenta:", value=60, min_value=1, key="ritmo_cuenta")
+    with col_simultaneos:
+        envios_simultaneos = st.number_input(
+            "Envíos simultáneos:", value=4, min_value=1, max_value=10, key="ritmo_concurrencia",
+            help="Transacciones SMTP en paralelo del worker de la bandeja de salida"
+        )
+    
+    obtener_limitador().configurar(correos_por_minuto, rafaga_envio, correos_por_minuto_cuenta)
+    obtener_trabajador().concurrencia = envios_simultaneos
+    st.caption("El ritmo sólo se reduce si el servidor responde 421/450/451/452 o se vuelve lento, y se recupera solo.")
+    st.dataframe(pd.DataFrame(obtener_limitador().resumen()), use_container_width=True)
+
+# =====================================================
+# MODO MULTICUENTA
+# =====================================================
+
+repartidor = None
+# Cuentas entre las que el worker reparte las campañas encoladas (None: cuenta de la pestaña)
+cuentas_envio = None
+cuota_envio = None
+
+with st.expander("🔀 Modo multicuenta"):
+    modo_multicuenta = st.checkbox(
+        "Repartir los envíos entre varias cuentas guardadas",
+        key="modo_multicuenta",
+        disabled=len(cuentas) < 2,
+        help="Cada campaña se reparte entre las cuentas seleccionadas; si una cuenta es limitada o rechazada se usa otra"
+    )
+    
+    if modo_multicuenta:
+        nombres_multicuenta = st.multiselect(
+            "Cuentas a usar:",
+            options=list(cuentas.keys()),
+            default=list(cuentas.keys()),
+            key="cuentas_multicuenta"
+        )
+        
+        cuota_diaria_cuenta = st.number_input("Cuota diaria por cuenta:", value=500, min_value=1, key="cuota_multicuenta")
+        
+        if nombres_multicuenta:
+            # El mismo repartidor que usa el worker, para ver cuotas y estado reales
+            repartidor = obtener_trabajador().repartidor(nombres_multicuenta, cuota_diaria_cuenta)
+            cuentas_envio = nombres_multicuenta
+            cuota_envio = cuota_diaria_cuenta
+            st.dataframe(pd.DataFrame(repartidor.resumen()), use_container_width=True)
+        else:
+            st.warning("⚠ Selecciona al menos una cuenta")
+
+# =====================================================
+# BANDEJA DE SALIDA
+# =====================================================
+
+with st.expander("📬 Bandeja de salida"):
+    trabajador_integrado = st.checkbox(
+        "Enviar la bandeja desde este servidor",
+        value=True,
+        key="trabajador_integrado",
+        help="Desactívalo si la bandeja la procesa un worker aparte: python worker_envios.py"
+    )
+    if trabajador_integrado:
+        obtener_trabajador().iniciar()
+    else:
+        obtener_trabajador().detener()
+    
+    col_estado, col_actualizar = st.columns([3, 1])
+    with col_estado:
+        estado_worker = "🟢 activo" if obtener_trabajador().activo() else "⚪ detenido"
+        st.caption(f"Worker integrado: {estado_worker} | Enviados: {obtener_trabajador().enviados} | Errores: {obtener_trabajador().fallidos} | Historial por escribir: {escritor_historial.pendientes()}")
+        if obtener_trabajador().ultimo_error:
+            st.caption(f"Último error: {obtener_trabajador().ultimo_error}")
+        if escritor_historial.perdidas:
+            st.caption(f"Historial: {escritor_historial.perdidas} filas sin guardar | Último error: {escritor_historial.ultimo_error}")
+    with col_actualizar:
+        st.button("🔄 Actualizar", key="actualizar_bandeja")
+    
+    campanas_bandeja = resumen_campanas()
+    if campanas_bandeja:
+        st.dataframe(pd.DataFrame(campanas_bandeja), use_container_width=True)
+        
+        # Reanudar: los mensajes con error vuelven a la cola y el worker omite
+        # las direcciones que ya constan como entregadas en esa campaña. Si la
+        # campaña se envía desde la cuenta seleccionada, se usa su contraseña
+        campanas_con_errores = [c['campana'] for c in campanas_bandeja if c['errores']]
+        if campanas_con_errores:
+            col_campana, col_reanudar = st.columns([3, 1])
+            with col_campana:
+                campana_reanudar = st.selectbox("Campaña con errores:", campanas_con_errores, key="campana_reanudar")
+            with col_reanudar:
+                if st.button("🔁 Reanudar", key="reanudar_campana"):
+                    recordar_credencial(campana_reanudar, REMITENTE, CLAVE_APP)
+                    reanudados = reanudar_campana(campana_reanudar)
+                    st.success(f"🔁 {reanudados} mensajes de nuevo en la bandeja; se omiten los ya entregados")
+    else:
+        st.info("La bandeja de salida está vacía")
+
+def lotes_destinatarios(direcciones, agrupado):
+    """Direcciones únicas de un estudiante: un solo mensaje con varios RCPT TO
+    (agrupado) o un mensaje por dirección"""
+    direcciones = list(dict.fromkeys(d.strip() for d in direcciones if isinstance(d, str) and d.strip()))
+    if agrupado:
+        return [direcciones] if direcciones else []
+    return [[direccion] for direccion in direcciones]
+
+def mensajes_tab1(estudiantes, tipo_plantilla, datos, agrupado):
+    """Mensajes de la bandeja para un grupo de estudiantes de la pestaña 1; la
+    plantilla se compila y valida antes de redactar el primero"""
+    redactados = redactar_lote(estudiantes, tipo_plantilla, datos)
+    mensajes = []
+    for indice, asunto, mensaje, emails in zip(
+        estudiantes.index, redactados['asunto'], redactados['mensaje'], estudiantes['emails_validos']
+    ):
+        for lote in lotes_destinatarios(emails, agrupado):
+            mensajes.append((lote, asunto, mensaje, indice, tipo_plantilla))
+    return mensajes
+
+def encolar_campana(origen, mensajes, servidor, puerto, usuario, password, archivos=None):
+    """Lanzar en segundo plano una campaña con los mensajes (destinatarios, asunto,
+    cuerpo, estudiante, plantilla): un hilo la encola y el worker la envía, y el
+    script sigue sin esperar. El avance se ve en «Envíos en curso»"""
+    if not mensajes:
+        st.warning("⚠ No hay mensajes que enviar")
+        return None
+    # getbuffer(): vista sin copia del archivo subido, segura para leer desde el hilo
+    adjuntos = [(archivo.name, archivo.getbuffer()) for archivo in archivos or [] if archivo is not None]
+    cuentas, cuota = cuentas_envio, cuota_envio
+    
+    def encolar_en_segundo_plano(campana):
+        return encolar(
+            mensajes, campana, origen, servidor, puerto, usuario, password, adjuntos,
+            cuentas=cuentas, cuota=cuota
+        )
+    
+    trabajo = obtener_registro_trabajos().lanzar(origen, encolar_en_segundo_plano)
+    st.success(f"📬 {len(mensajes)} mensajes enviándose en segundo plano (campaña {trabajo.campana}). "
+               "Puedes seguir trabajando; el avance se muestra en «Envíos en curso».")
+    return trabajo.campana
+
+# =====================================================
+# ENVÍOS EN CURSO
+# =====================================================
+
+# Se llena al final del script, cuando ya se lanzaron las campañas de este rerun
+panel_envios = st.container()
+
 # =====================================================
 # TABS PRINCIPALES
 # =====================================================
@@ -521,506 +602,6 @@ with tab1:
     if 'datos_estudiantes_tab1' not in st.session_state:
         st.session_state.datos_estudiantes_tab1 = None
 
-    CONFIGURACIONES_INSTITUCIONES = {
-        "uveg": {
-            "nombre": "UVEG",
-            "columnas_actividades": [
-                "Paquete SCORM:R1. Conversiones entre sistemas numéricos (Real)",
-                "Paquete SCORM:R2. Operaciones aritméticas con sistema binario, octal y hexadecimal (Real)",
-                "Tarea:R3. Operaciones con conjuntos y su representación (Real)",
-                "Tarea:R4. Proposiciones lógicas (Real)",
-                "Paquete SCORM:R5. Operadores lógicos y tablas de verdad (Real)",
-                "Paquete SCORM:R6. Relaciones y operaciones con relaciones (Real)",
-                "Tarea:R7. Propiedades de las relaciones: representación gráfica (Real)"
-            ],
-            "nombres_actividades": [
-                "R1. Conversiones entre sistemas numéricos",
-                "R2. Operaciones aritméticas con sistema binario, octal y hexadecimal",
-                "R3. Operaciones con conjuntos y su representación",
-                "R4. Proposiciones lógicas",
-                "R5. Operadores lógicos y tablas de verdad",
-                "R6. Relaciones y operaciones con relaciones",
-                "R7. Propiedades de las relaciones: representación gráfica"
-            ],
-            "columnas_requeridas": ["Nombre", "Apellido(s)", "Correo Personal", "Dirección Email"],
-            "modulo_default": "Matemáticas Discretas"
-        },
-        "novauniversitas": {
-            "nombre": "NovaUniversitas",
-            "columnas_actividades": [
-                "Examen:Examen desafío 1 (Real)",
-                "Examen:Examen desafío 2 (Real)",
-                "Tarea:Evaluación desafío 3 (Real)",
-                "Tarea:Examen desafío 4 (Real)",
-                "Examen:Evaluación desafío 5 (Real)",
-                "Examen:Evaluación desafío 6 (Real)",
-                "Foro:todo el foro Foro desafío 7 (Real)"
-            ],
-            "nombres_actividades": [
-                "Desafío 1. Examen desafío 1",
-                "Desafío 2. Examen desafío 2",
-                "Desafío 3. Evaluación desafío 3",
-                "Desafío 4. Examen desafío 4",
-                "Desafío 5. Evaluación desafío 5",
-                "Desafío 6. Evaluación desafío 6",
-                "Desafío 7. Foro desafío 7"
-            ],
-            "columnas_requeridas": ["Nombre", "Correo Personal", "Dirección Email"],
-            "modulo_default": "Matemáticas Discretas"
-        }
-    }
-
-    PLANTILLAS_BASE = {
-        "uveg": {
-            "bienvenida": {
-                "nombre": "Bienvenida al Módulo",
-                "asunto": "Bienvenida al módulo {modulo} - UVEG",
-                "mensaje": """Buen día {nombre}.
-
-Mi nombre es Juan Manuel y seré tu asesor virtual en el módulo "{modulo}" de la UVEG. Te doy la bienvenida al curso y quiero compartirte algunas recomendaciones para organizar tu avance.
-
-Como sugerencia, te he marcado como meta entregar las primeras tres actividades antes del próximo {fecha_meta} al mediodía. Sin embargo, si comprendes bien los temas, puedes avanzar a tu propio ritmo, ya que el módulo tiene una duración total de 24 días naturales.
-
-El propósito de este mensaje es conocer si tienes algún inconveniente en este momento, como falta de tiempo, dificultades con las actividades, problemas de acceso a un dispositivo o Internet, o si simplemente tu estrategia de estudio no sigue el ritmo sugerido. Además, quiero que sepas que estaré pendiente de tu desarrollo académico y disponible para cualquier duda que tengas.
-
-A partir del martes, recibirás un correo con información sobre tu avance y para mantenernos en contacto. No es mi intención abrumarte, sino brindarte el soporte necesario para que tengas éxito en el curso.
-
-Importante: Te invito a revisar la sección "AVISOS" en tu aula virtual para estar al tanto de cualquier información relevante.
-
-Por último tenemos una cita este {fecha_sesion} a las {hora_sesion} horas, sesión síncrona para resolver dudas. El enlace lo encuentras dentro de tu aula virtual.
-
-Te pido me confirmes de recibido este correo.
-
-¡Mucho éxito en el módulo! Estoy aquí para ayudarte.
-
-Dr. Juan Manuel Martínez Zaragoza"""
-            },
-            "seguimiento_sin_acceso_semana_1": {
-                "nombre": "Seguimiento - Sin Acceso (Semana 1)",
-                "asunto": "Seguimiento {modulo} - Semana {semana} - UVEG",
-                "mensaje": """Buen día {nombre}.
-
-Mi nombre es Juan Manuel y soy tu asesor virtual en el módulo de "{modulo}" de la UVEG, en este momento estamos en la {semana_actual} semana del módulo, solo hemos avanzado algunos retos, con lo cual no presentas un gran atraso, te invito a que inicies tus actividades dentro de la plataforma (https://campus.uveg.edu.mx) y si tienes alguna duda con toda confianza me puedes contactar ya sea por este medio, por el mensajero de la plataforma o xxx por whatsapp.
-
-Agradecería pudieras comentarme la situación por la cual no has accedido al módulo, espero todo se encuentre bien.
-
-Dr. Juan Manuel Martínez Zaragoza"""
-            },
-            "seguimiento_sin_acceso_semana_2": {
-                "nombre": "Seguimiento - Sin Acceso (Semana 2)",
-                "asunto": "Seguimiento {modulo} - Semana {semana} - UVEG",
-                "mensaje": """Buen día {nombre}.
-
-Mi nombre es Juan Manuel y soy tu asesor virtual en el módulo de "{modulo}" de la UVEG. He tratado de comunicarme anteriormente contigo sin éxito.
-
-En este momento nos encontramos en la {semana_actual} semana del módulo y observo que aún no has iniciado ninguna actividad en la plataforma. Aunque todavía hay tiempo para ponerte al día, es importante que comiences cuanto antes para evitar un atraso mayor.
-
-Te invito cordialmente a que accedas a tu aula virtual (https://campus.uveg.edu.mx) y empieces con los retos programados. Recuerda que estoy aquí para apoyarte con cualquier duda o dificultad que tengas, ya sea por este medio, por el mensajero de la plataforma o xxx por whatsapp.
-
-Me preocupa no haber tenido noticias tuyas. Por favor, hazme saber si existe alguna situación que esté impidiendo tu participación en el módulo. Tu éxito académico es importante para mí.
-
-Quedo al pendiente de tu respuesta.
-
-Dr. Juan Manuel Martínez Zaragoza"""
-            },
-            "seguimiento_sin_acceso_semana_3": {
-                "nombre": "Seguimiento - Sin Acceso (Semana 3)",
-                "asunto": "Seguimiento URGENTE {modulo} - Semana {semana} - UVEG",
-                "mensaje": """Buen día {nombre}.
-
-Mi nombre es Juan Manuel y soy tu asesor virtual en el módulo de "{modulo}" de la UVEG. Espero puedas culminar tus actividades ya que el módulo está próximo a cerrar. No pude contactarte anteriormente, espero que todo vaya bien.
-
-Nos encontramos en la {semana_actual} semana del módulo y lamentablemente no he detectado actividad alguna de tu parte en la plataforma. El módulo cerrará la próxima semana y es crucial que inicies tus entregas lo antes posible para poder acreditar.
-
-Esta es tu última oportunidad para ponerte al corriente. Te exhorto a que ingreses de inmediato a tu aula virtual (https://campus.uveg.edu.mx) y comiences con los retos. Aunque el tiempo es limitado, aún es posible completar el módulo si actúas con rapidez.
-
-Si enfrentas alguna dificultad técnica, personal o académica, por favor comunícate conmigo de inmediato por cualquier medio: este correo, mensajero de la plataforma o xxx por whatsapp. Estoy dispuesto a brindarte todo el apoyo necesario.
-
-Espero sinceramente tener noticias tuyas y poder ayudarte a concluir exitosamente este módulo.
-
-Dr. Juan Manuel Martínez Zaragoza"""
-            },
-            "seguimiento_atraso_semana_1": {
-                "nombre": "Seguimiento - Tareas Pendientes (Semana 1)",
-                "asunto": "Seguimiento de avance {modulo} - Semana {semana} - UVEG",
-                "mensaje": """Buen día {nombre}.
-
-Mi nombre es Juan Manuel y soy tu asesor virtual en el módulo de "{modulo}" en la UVEG, en este momento estamos en la {semana_actual} semana del módulo. Me pongo en contacto, para saber si tienes algún inconveniente que no te este permitiendo avanzar al ritmo que les he marcado, ya que veo que tienes algunos retos pendientes y en tu avance semanal se ve reflejado.
-
-Retos pendientes:
-{actividades_faltantes}
-
-Recuerda que esta es solo una sugerencia, si consideras que no tienes inconveniente en avanzar a tu ritmo, haz caso omiso a este y los siguientes mensajes.
-
-Dr. Juan Manuel Martínez Zaragoza"""
-            },
-            "seguimiento_atraso_semana_2": {
-                "nombre": "Seguimiento - Tareas Pendientes (Semana 2)",
-                "asunto": "Seguimiento de avance {modulo} - Semana {semana} - UVEG",
-                "mensaje": """Buen día {nombre}.
-
-Mi nombre es Juan Manuel y soy tu asesor virtual en el módulo de "{modulo}" en la UVEG. Nos encontramos en la {semana_actual} semana del módulo y me comunico nuevamente contigo para dar seguimiento a tu progreso académico.
-
-He revisado tu avance y observo que aún tienes retos pendientes que deberías haber completado hasta esta semana. Estos son los retos que tienes pendientes hasta esta semana:
-
-Retos pendientes:
-{actividades_faltantes}
-
-Es importante que consideres ponerte al día con estas actividades para mantener un buen ritmo y evitar acumulación de trabajo al final del módulo. Si estás enfrentando alguna dificultad específica con los contenidos o tienes algún impedimento para avanzar, por favor comunícamelo para poder apoyarte.
-
-Recuerda que estas recomendaciones buscan ayudarte a tener éxito en el módulo. Si prefieres manejar tu propio ritmo de estudio, puedes hacer caso omiso a estos mensajes.
-
-Estoy disponible para resolver cualquier duda que tengas.
-
-Dr. Juan Manuel Martínez Zaragoza"""
-            },
-            "seguimiento_atraso_semana_3": {
-                "nombre": "Seguimiento - Tareas Pendientes (Semana 3)",
-                "asunto": "Seguimiento URGENTE de avance {modulo} - Semana {semana} - UVEG",
-                "mensaje": """Buen día {nombre}.
-
-Mi nombre es Juan Manuel y soy tu asesor virtual en el módulo de "{modulo}" en la UVEG. Estamos en la {semana_actual} semana y debo informarte que el módulo cierra la próxima semana.
-
-He realizado una revisión de tu expediente y me preocupa observar que tienes varios retos sin completar. Estos son TODOS tus retos pendientes:
-
-Retos pendientes:
-{actividades_faltantes}
-
-Es fundamental que te enfoques en completar estas actividades durante los próximos días para poder acreditar el módulo. El tiempo se está agotando y necesitas actuar con urgencia.
-
-Te ofrezco mi apoyo total para ayudarte a concluir. Si tienes dudas sobre algún tema, dificultades técnicas o necesitas orientación para organizar tu tiempo, no dudes en contactarme de inmediato por este medio, el mensajero de la plataforma o xxx por whatsapp.
-
-Esta es una situación crítica pero aún estás a tiempo de recuperarte. Te insto a que dediques el máximo esfuerzo posible en estos días finales.
-
-Quedo al pendiente y disponible para apoyarte en todo lo que necesites.
-
-Dr. Juan Manuel Martínez Zaragoza"""
-            },
-            "seguimiento_sin_acceso_semana_4": {
-                "nombre": "Seguimiento - Sin Acceso (Semana 4)",
-                "asunto": "ÚLTIMA OPORTUNIDAD {modulo} - Semana {semana} - UVEG",
-                "mensaje": """Buen día {nombre}.
-
-Mi nombre es Juan Manuel y soy tu asesor virtual en el módulo de "{modulo}" de la UVEG. Este es mi último intento de comunicación contigo.
-
-Nos encontramos en la {semana_actual} y ÚLTIMA semana del módulo. Lamentablemente, no he detectado ninguna actividad de tu parte durante todo el módulo y el cierre es INMINENTE.
-
-Esta es tu ÚLTIMA OPORTUNIDAD para acreditar el módulo. Si no entregas tus actividades en los próximos días, reprobarás el curso.
-
-Te URJO a que ingreses de inmediato a tu aula virtual (https://campus.uveg.edu.mx) y comiences con los retos. El tiempo se ha agotado y necesitas actuar AHORA MISMO.
-
-Si existe alguna razón de fuerza mayor que te ha impedido participar, comunícate conmigo URGENTEMENTE por cualquier medio: este correo, mensajero de la plataforma o xxx por whatsapp.
-
-Este es el cierre del módulo. Por favor, hazme saber tu situación lo antes posible.
-
-Dr. Juan Manuel Martínez Zaragoza"""
-            },
-            "seguimiento_atraso_semana_4": {
-                "nombre": "Seguimiento - Tareas Pendientes (Semana 4)",
-                "asunto": "CIERRE DEL MÓDULO {modulo} - Semana {semana} - UVEG",
-                "mensaje": """Buen día {nombre}.
-
-Mi nombre es Juan Manuel y soy tu asesor virtual en el módulo de "{modulo}" en la UVEG. Este mensaje es CRÍTICO: estamos en la {semana_actual} y ÚLTIMA semana del módulo, y el CIERRE ES INMINENTE.
-
-He revisado tu expediente y tienes los siguientes retos pendientes que DEBES completar URGENTEMENTE para poder acreditar:
-
-Retos pendientes:
-{actividades_faltantes}
-
-QUEDAN MUY POCOS DÍAS para el cierre del módulo. Si no completas estos retos INMEDIATAMENTE, reprobarás el curso.
-
-Esta es tu ÚLTIMA OPORTUNIDAD. Te exhorto a que dediques TODO tu tiempo disponible en las próximas horas/días para completar las actividades pendientes.
-
-Estoy disponible las 24 horas para resolver tus dudas de manera urgente. Contáctame de inmediato por este medio, el mensajero de la plataforma o xxx por whatsapp si necesitas ayuda.
-
-El tiempo se acabó. Actúa AHORA.
-
-Dr. Juan Manuel Martínez Zaragoza"""
-            },
-            "felicitacion": {
-                "nombre": "Felicitación por Desempeño",
-                "asunto": "Felicitaciones por tu desempeño - {modulo} - UVEG",
-                "mensaje": """Un gusto saludarte {nombre}.
-
-Por medio del presente, permíteme felicitarte por tu alto desempeño durante esta semana, con esto demuestras tu compromiso para con tu carrera y la resiliencia del día a día.
-
-Retos completados:
-{actividades_completadas}
-
-Continua así y no olvides revisar el tablero de avisos.
-
-Dr. Juan Manuel Martínez Zaragoza"""
-            }
-        },
-        "novauniversitas": {
-            "bienvenida": {
-                "nombre": "Bienvenida al Módulo",
-                "asunto": "Bienvenida al módulo {modulo} - NovaUniversitas",
-                "mensaje": """Apreciable {nombre},
-
-Mi nombre es Juan Manuel y seré tu asesor virtual en el módulo "{modulo}" de NovaUniversitas. Te doy la más cordial bienvenida al curso y quiero compartirte algunas recomendaciones importantes para tu éxito académico.
-
-Como guía inicial, te sugiero completar los primeros tres desafíos antes del {fecha_meta}. Sin embargo, tienes la flexibilidad de avanzar a tu propio ritmo, considerando que el módulo tiene una duración de 24 días naturales.
-
-Este mensaje tiene como propósito identificar si enfrentas algún inconveniente que pueda afectar tu rendimiento académico, tales como:
-- Limitaciones de tiempo
-- Dificultades técnicas con los desafíos
-- Problemas de conectividad o acceso a dispositivos
-- Necesidad de ajustar tu estrategia de estudio
-
-Estaré monitoreando constantemente tu progreso académico y me encuentro disponible para resolver cualquier duda o inquietud que puedas tener.
-
-A partir de la próxima semana, recibirás comunicaciones periódicas sobre tu avance académico para mantener un seguimiento personalizado de tu aprendizaje.
-
-Importante: Te recomiendo revisar regularmente la sección de "ANUNCIOS" en tu campus virtual para mantenerte informado sobre comunicaciones relevantes.{parrafo_sesion}
-
-Te solicito confirmar la recepción de este correo.
-
-¡Te deseo mucho éxito en tu trayectoria académica!
-
-Dr. Juan Manuel Martínez Zaragoza
-Asesor Virtual - NovaUniversitas"""
-            },
-            "seguimiento_sin_acceso": {
-                "nombre": "Seguimiento - Sin Acceso",
-                "asunto": "Seguimiento académico {modulo} - Semana {semana} - NovaUniversitas",
-                "mensaje": """Apreciable {nombre},
-
-Mi nombre es Juan Manuel, tu asesor virtual del módulo "{modulo}" en NovaUniversitas. Me dirijo a ti en relación a tu progreso académico en la {semana_actual} semana del módulo.
-
-He observado que aún no has iniciado actividades en la plataforma educativa. Aunque esto no representa un atraso significativo en este momento, es importante que comiences con los desafíos programados para mantener un ritmo adecuado de aprendizaje.
-
-Te invito cordialmente a:
-- Acceder a tu campus virtual de NovaUniversitas
-- Revisar los desafíos disponibles
-- Contactarme ante cualquier duda o dificultad
-
-Estoy disponible para brindarte apoyo a través de:
-- Este correo electrónico
-- Mensajería interna del campus virtual
-- WhatsApp: xxx (agrega tu número)
-
-Me interesa conocer si existe alguna situación particular que esté impidiendo tu participación en el módulo. Tu bienestar y éxito académico son mi prioridad.
-
-Quedo atento a tu pronta respuesta.
-
-Saludos cordiales,
-
-Dr. Juan Manuel Martínez Zaragoza
-Asesor Virtual - NovaUniversitas"""
-            },
-            "seguimiento_atraso": {
-                "nombre": "Seguimiento - Desafíos Pendientes",
-                "asunto": "Seguimiento de progreso {modulo} - Semana {semana} - NovaUniversitas",
-                "mensaje": """Apreciable {nombre},
-
-Mi nombre es Juan Manuel, tu asesor virtual del módulo "{modulo}" en NovaUniversitas. Me pongo en contacto contigo para hacer un seguimiento de tu progreso académico en la {semana_actual} semana del módulo.
-
-He revisado tu expediente académico y he identificado algunos desafíos pendientes que requieren tu atención para mantener el ritmo de aprendizaje sugerido:
-
-Desafíos pendientes por completar:
-{actividades_faltantes}
-
-Es importante mencionar que estas recomendaciones de ritmo están diseñadas para optimizar tu experiencia de aprendizaje. Si consideras que puedes manejar un ritmo diferente y no requieres este seguimiento, puedes hacer caso omiso a estas comunicaciones.
-
-Sin embargo, si necesitas apoyo o tienes alguna dificultad específica, estoy aquí para ayudarte. Podemos trabajar juntos en una estrategia personalizada que se adapte a tus necesidades.
-
-Opciones de contacto:
-- Responder a este correo
-- Mensajería del campus virtual
-- WhatsApp: xxx (agrega tu número)
-
-Tu éxito académico es importante para mí.
-
-Saludos cordiales,
-
-Dr. Juan Manuel Martínez Zaragoza
-Asesor Virtual - NovaUniversitas"""
-            },
-            "felicitacion": {
-                "nombre": "Reconocimiento Académico",
-                "asunto": "Felicitaciones por tu excelente desempeño - {modulo} - NovaUniversitas",
-                "mensaje": """Apreciable {nombre},
-
-Es un placer dirigirme a ti para reconocer tu destacado desempeño académico en el módulo "{modulo}" de NovaUniversitas durante esta semana.
-
-Tu dedicación y compromiso con tu formación profesional son evidentes a través de los resultados obtenidos:
-
-Desafíos completados exitosamente:
-{actividades_completadas}
-
-Este nivel de excelencia académica refleja tu seriedad y determinación hacia tus objetivos educativos. Tu constancia y esfuerzo son cualidades que sin duda te llevarán al éxito profesional.
-
-Te motivo a continuar con esta actitud ejemplar y te recordamos revisar periódicamente el tablero de anuncios en tu campus virtual para mantenerte informado sobre novedades importantes.
-
-Sigue adelante con esa misma dedicación. ¡Tu futuro profesional se construye con cada logro como este!
-
-Felicitaciones nuevamente por tu excelente trabajo.
-
-Saludos cordiales,
-
-Dr. Juan Manuel Martínez Zaragoza
-Asesor Virtual - NovaUniversitas"""
-            }
-        }
-    }
-
-    def convertir_a_numerico(valor):
-        if pd.isna(valor):
-            return 0
-        if isinstance(valor, str):
-            valor_limpio = valor.strip()
-            if not valor_limpio:
-                return 0
-            try:
-                return float(valor_limpio)
-            except ValueError:
-                return 0
-        try:
-            return float(valor)
-        except (ValueError, TypeError):
-            return 0
-
-    def contar_actividades_completadas(row, columnas_actividades):
-        completadas = 0
-        for col in columnas_actividades:
-            if col in row.index:
-                valor_numerico = convertir_a_numerico(row[col])
-                if valor_numerico > 0:
-                    completadas += 1
-        return completadas
-
-    def obtener_actividades_completadas(row, columnas_actividades, nombres_actividades):
-        actividades_completadas = []
-        for i, col in enumerate(columnas_actividades):
-            if col in row.index:
-                valor_numerico = convertir_a_numerico(row[col])
-                if valor_numerico > 0:
-                    actividades_completadas.append(nombres_actividades[i])
-        return actividades_completadas
-
-    def obtener_actividades_faltantes(row, columnas_actividades, nombres_actividades, actividades_requeridas):
-        actividades_faltantes = []
-        for i in range(actividades_requeridas):
-            col = columnas_actividades[i]
-            nombre = nombres_actividades[i]
-            if col in row.index:
-                valor_numerico = convertir_a_numerico(row[col])
-                if valor_numerico <= 0:
-                    actividades_faltantes.append(nombre)
-            else:
-                actividades_faltantes.append(nombre)
-        return actividades_faltantes
-
-    def validar_email(email):
-        if not email or pd.isna(email):
-            return False
-        email_str = str(email).strip()
-        return "@" in email_str and "." in email_str.split("@")[-1]
-
-    def obtener_emails_validos(estudiante):
-        emails_validos = []
-        if 'Correo Personal' in estudiante.index and validar_email(estudiante['Correo Personal']):
-            emails_validos.append(str(estudiante['Correo Personal']).strip())
-        if 'Dirección Email' in estudiante.index and validar_email(estudiante['Dirección Email']):
-            email_institucional = str(estudiante['Dirección Email']).strip()
-            emails_validos.append(email_institucional)
-        return emails_validos
-
-    def obtener_nombre_completo(estudiante, institucion):
-        nombre = str(estudiante.get('Nombre', 'Apreciable estudiante'))
-        if institucion == "uveg":
-            apellidos = str(estudiante.get('Apellido(s)', ''))
-            return nombre, apellidos
-        else:
-            return nombre, ""
-
-    def formatear_fecha(fecha_str):
-        try:
-            fecha = datetime.strptime(fecha_str, "%Y-%m-%d")
-            dias = ["lunes", "martes", "miércoles", "jueves", "viernes", "sábado", "domingo"]
-            meses = ["enero", "febrero", "marzo", "abril", "mayo", "junio",
-                    "julio", "agosto", "septiembre", "octubre", "noviembre", "diciembre"]
-            dia_semana = dias[fecha.weekday()]
-            dia = fecha.day
-            mes = meses[fecha.month - 1]
-            return f"{dia_semana} {dia} de {mes}"
-        except:
-            return fecha_str
-
-    def enviar_correo_con_adjuntos(destinatario, asunto, cuerpo, archivos_adjuntos=None):
-        try:
-            msg = MIMEMultipart()
-            msg["Subject"] = asunto
-            msg["From"] = REMITENTE
-            msg["To"] = destinatario
-            msg.attach(MIMEText(cuerpo, 'plain', 'utf-8'))
-            
-            if archivos_adjuntos:
-                for archivo in archivos_adjuntos:
-                    try:
-                        archivo.seek(0)
-                        mime_type, _ = mimetypes.guess_type(archivo.name)
-                        if mime_type is None:
-                            mime_type = 'application/octet-stream'
-                        maintype, subtype = mime_type.split('/', 1)
-                        part = MIMEBase(maintype, subtype)
-                        part.set_payload(archivo.read())
-                        encoders.encode_base64(part)
-                        part.add_header('Content-Disposition', f'attachment; filename="{archivo.name}"')
-                        msg.attach(part)
-                    except Exception as e:
-                        st.warning(f"No se pudo adjuntar {archivo.name}: {str(e)}")
-            
-            with smtplib.SMTP_SSL("smtp.gmail.com", 465) as smtp:
-                smtp.login(REMITENTE, CLAVE_APP)
-                smtp.send_message(msg)
-            
-            guardar_historial_db(asunto, destinatario, 'Enviado')
-            return True, "Enviado correctamente"
-        except Exception as e:
-            error_msg = f"Error: {str(e)}"
-            guardar_historial_db(asunto, destinatario, error_msg)
-            return False, error_msg
-
-    def enviar_a_todos_los_emails(emails_validos, asunto, cuerpo, nombre_estudiante, archivos_adjuntos=None):
-        resultados = []
-        emails_enviados = []
-        
-        for email in emails_validos:
-            if email and email not in emails_enviados:
-                exito, mensaje = enviar_correo_con_adjuntos(email, asunto, cuerpo, archivos_adjuntos)
-                resultados.append({'email': email, 'exito': exito, 'mensaje': mensaje})
-                emails_enviados.append(email)
-                
-                if exito:
-                    st.success(f"✓ {email}")
-                else:
-                    st.error(f"✗ {email}: {mensaje}")
-                
-                time.sleep(0.8)
-        
-        exitosos = sum(1 for r in resultados if r['exito'])
-        return exitosos, len(resultados), emails_enviados
-
-    def obtener_plantilla(institucion, tipo, semana=None):
-        """Obtiene la plantilla correcta según institución, tipo y semana"""
-        # Para UVEG, si se proporciona semana, usar la plantilla específica
-        if institucion == "uveg" and semana and tipo in ["seguimiento_sin_acceso", "seguimiento_atraso"]:
-            tipo_con_semana = f"{tipo}_semana_{semana}"
-            plantilla_db = cargar_plantilla_db(institucion, tipo_con_semana)
-            if plantilla_db:
-                return plantilla_db
-            elif tipo_con_semana in PLANTILLAS_BASE[institucion]:
-                return PLANTILLAS_BASE[institucion][tipo_con_semana].copy()
-        
-        # Caso por defecto
-        plantilla_db = cargar_plantilla_db(institucion, tipo)
-        if plantilla_db:
-            return plantilla_db
-        else:
-            return PLANTILLAS_BASE[institucion][tipo].copy()
-
     st.divider()
     
     col1, col2 = st.columns([3, 1])
@@ -1124,14 +705,15 @@ Asesor Virtual - NovaUniversitas"""
 
     st.divider()
     archivo_excel = st.file_uploader(
-        "📄 Archivo Excel", 
-        type=["xlsx", "xls"],
+        "📄 Archivo Excel, CSV o Parquet", 
+        type=TIPOS_ROSTER,
         key="archivo_excel_tab1"
     )
 
     if archivo_excel:
         try:
-            df = pd.read_excel(archivo_excel)
+            columnas_tab1, texto_tab1 = columnas_roster(config_institucion)
+            df = obtener_cache_libros().hoja(archivo_excel.getvalue(), 0, columnas_tab1, texto_tab1)
             st.success(f"✓ {len(df)} estudiantes")
             
             if institucion_seleccionada == "novauniversitas":
@@ -1149,7 +731,8 @@ Asesor Virtual - NovaUniversitas"""
                     st.dataframe(df[config_institucion['columnas_requeridas']].head(5), use_container_width=True)
                 
                 total_estudiantes = len(df)
-                emails_validos = sum(1 for _, fila in df.iterrows() if obtener_emails_validos(fila))
+                df['emails_validos'] = emails_validos_roster(df)
+                emails_validos = int(df['emails_validos'].str.len().gt(0).sum())
                 st.info(f"📊 {total_estudiantes} estudiantes | {emails_validos} con emails")
                 
                 st.subheader("⚙️ Configuración")
@@ -1252,15 +835,10 @@ Asesor Virtual - NovaUniversitas"""
                         variables_extra['parrafo_sesion'] = ""
                     
                     if tipo_envio == "automatico":
-                        df['actividades_completadas'] = df.apply(
-                            lambda row: contar_actividades_completadas(row, config_institucion['columnas_actividades']), 
-                            axis=1
+                        estudiantes_completos, estudiantes_incompletos, estudiantes_sin_entregas = clasificar_estudiantes(
+                            df, config_institucion, actividades_requeridas
                         )
                         
-                        estudiantes_completos = df[df['actividades_completadas'] >= actividades_requeridas]
-                        estudiantes_incompletos = df[(df['actividades_completadas'] > 0) & (df['actividades_completadas'] < actividades_requeridas)]
-                        estudiantes_sin_entregas = df[df['actividades_completadas'] == 0]
-                        
                         st.session_state.datos_estudiantes_tab1 = {
                             'completos': estudiantes_completos,
                             'incompletos': estudiantes_incompletos,
@@ -1352,42 +930,13 @@ Asesor Virtual - NovaUniversitas"""
                     else:
                         plantilla = obtener_plantilla(datos['institucion'], tipo_plantilla_key)
                     
-                    # Generar ejemplo del mensaje
+                    # Generar ejemplo del mensaje (con la misma plantilla compilada del envío)
                     nombre, apellidos = obtener_nombre_completo(estudiante_ejemplo, datos['institucion'])
-                    
-                    if tipo_plantilla_key == "felicitacion":
-                        actividades_completadas = obtener_actividades_completadas(
-                            estudiante_ejemplo,
-                            config_institucion['columnas_actividades'],
-                            config_institucion['nombres_actividades']
-                        )
-                        actividades_lista = "\n".join([f"{i+1}. {act}" for i, act in enumerate(actividades_completadas)])
-                        mensaje_ejemplo = plantilla['mensaje'].format(
-                            nombre=nombre,
-                            actividades_completadas=actividades_lista,
-                            **variables_extra
-                        )
-                    elif tipo_plantilla_key == "seguimiento_atraso":
-                        num_actividades_a_revisar = len(config_institucion['columnas_actividades']) if semana_plantilla == 4 else datos['actividades_requeridas']
-                        actividades_faltantes = obtener_actividades_faltantes(
-                            estudiante_ejemplo,
-                            config_institucion['columnas_actividades'],
-                            config_institucion['nombres_actividades'],
-                            num_actividades_a_revisar
-                        )
-                        actividades_lista = "\n".join([f"{i+1}. {act}" for i, act in enumerate(actividades_faltantes)])
-                        mensaje_ejemplo = plantilla['mensaje'].format(
-                            nombre=nombre,
-                            actividades_faltantes=actividades_lista,
-                            **variables_extra
-                        )
-                    else:  # seguimiento_sin_acceso
-                        mensaje_ejemplo = plantilla['mensaje'].format(
-                            nombre=nombre,
-                            **variables_extra
-                        )
-                    
-                    asunto_ejemplo = plantilla['asunto'].format(**variables_extra)
+                    try:
+                        asunto_ejemplo, mensaje_ejemplo = redactar_mensaje(estudiante_ejemplo, tipo_plantilla_key, datos, plantilla)
+                    except PlantillaInvalida as e:
+                        st.error(f"✗ Plantilla guardada inválida: {str(e)}")
+                        asunto_ejemplo = plantilla['asunto']
                     
                     st.info(f"📌 Ejemplo para: **{nombre} {apellidos}**")
                     
@@ -1404,6 +953,14 @@ Asesor Virtual - NovaUniversitas"""
                         st.write("")  # Espaciado
                         st.write("")  # Espaciado
                         if st.button("💾", key="guardar_cambios_prev", help="Guardar cambios en BD"):
+                            texto_guardar = st.session_state.get('mensaje_preview_edit_value', plantilla['mensaje'])
+                            try:
+                                # Validar antes de guardar para no romper un envío posterior
+                                compilar_plantilla({'asunto': nuevo_asunto_prev, 'mensaje': texto_guardar},
+                                                   tipo_plantilla_key, variables_extra)
+                            except PlantillaInvalida as e:
+                                st.error(f"✗ {str(e)}")
+                                st.stop()
                             # Determinar el tipo correcto para guardar
                             if tipo_plantilla_key in ["seguimiento_atraso", "seguimiento_sin_acceso"] and datos['institucion'] == "uveg":
                                 tipo_guardar = f"{tipo_plantilla_key}_semana_{semana_plantilla}"
@@ -1416,7 +973,7 @@ Asesor Virtual - NovaUniversitas"""
                                 tipo_guardar,
                                 plantilla['nombre'],
                                 nuevo_asunto_prev,
-                                st.session_state.get('mensaje_preview_edit_value', plantilla['mensaje'])
+                                texto_guardar
                             )
                             st.success("✅ Cambios guardados en la base de datos")
                             time.sleep(1)
@@ -1436,25 +993,14 @@ Asesor Virtual - NovaUniversitas"""
                     
                     # Mostrar cómo se verá el mensaje final
                     with st.expander("👁️ Vista previa del mensaje final (con variables reemplazadas)", expanded=False):
-                        if tipo_plantilla_key == "felicitacion":
-                            mensaje_final_preview = nuevo_mensaje_prev.format(
-                                nombre=nombre,
-                                actividades_completadas=actividades_lista,
-                                **variables_extra
-                            )
-                        elif tipo_plantilla_key == "seguimiento_atraso":
-                            mensaje_final_preview = nuevo_mensaje_prev.format(
-                                nombre=nombre,
-                                actividades_faltantes=actividades_lista,
-                                **variables_extra
-                            )
-                        else:
-                            mensaje_final_preview = nuevo_mensaje_prev.format(
-                                nombre=nombre,
-                                **variables_extra
+                        try:
+                            _, mensaje_final_preview = redactar_mensaje(
+                                estudiante_ejemplo, tipo_plantilla_key, datos,
+                                {'asunto': plantilla['asunto'], 'mensaje': nuevo_mensaje_prev}
                             )
-                        
-                        st.text_area("", value=mensaje_final_preview, height=300, disabled=True, key="final_preview_display")
+                            st.text_area("", value=mensaje_final_preview, height=300, disabled=True, key="final_preview_display")
+                        except PlantillaInvalida as e:
+                            st.error(f"✗ {str(e)}")
                     
                     if nuevo_asunto_prev != asunto_ejemplo or nuevo_mensaje_prev != plantilla['mensaje']:
                         st.warning("⚠️ Has realizado cambios. Haz clic en 💾 para guardarlos en la base de datos.")
@@ -1464,12 +1010,11 @@ Asesor Virtual - NovaUniversitas"""
                 plantilla = obtener_plantilla(datos['institucion'], 'bienvenida')
                 estudiante_ejemplo = estudiantes_bienvenida.iloc[0]
                 nombre, apellidos = obtener_nombre_completo(estudiante_ejemplo, datos['institucion'])
-                
-                mensaje_ejemplo = plantilla['mensaje'].format(
-                    nombre=nombre,
-                    **variables_extra
-                )
-                asunto_ejemplo = plantilla['asunto'].format(**variables_extra)
+                try:
+                    asunto_ejemplo, mensaje_ejemplo = redactar_mensaje(estudiante_ejemplo, 'bienvenida', datos, plantilla)
+                except PlantillaInvalida as e:
+                    st.error(f"✗ Plantilla guardada inválida: {str(e)}")
+                    asunto_ejemplo = plantilla['asunto']
                 
                 st.info(f"📌 Ejemplo para: **{nombre} {apellidos}**")
                 
@@ -1486,12 +1031,19 @@ Asesor Virtual - NovaUniversitas"""
                     st.write("")
                     st.write("")
                     if st.button("💾", key="guardar_bien", help="Guardar en BD"):
+                        texto_guardar = st.session_state.get('mensaje_bienvenida_value', plantilla['mensaje'])
+                        try:
+                            compilar_plantilla({'asunto': nuevo_asunto_bien, 'mensaje': texto_guardar},
+                                               'bienvenida', variables_extra)
+                        except PlantillaInvalida as e:
+                            st.error(f"✗ {str(e)}")
+                            st.stop()
                         guardar_plantilla_db(
                             datos['institucion'],
                             'bienvenida',
                             plantilla['nombre'],
                             nuevo_asunto_bien,
-                            st.session_state.get('mensaje_bienvenida_value', plantilla['mensaje'])
+                            texto_guardar
                         )
                         st.success("✅ Guardado")
                         time.sleep(1)
@@ -1507,8 +1059,14 @@ Asesor Virtual - NovaUniversitas"""
                 st.session_state['mensaje_bienvenida_value'] = nuevo_mensaje_bien
                 
                 with st.expander("👁️ Vista previa final", expanded=False):
-                    mensaje_final = nuevo_mensaje_bien.format(nombre=nombre, **variables_extra)
-                    st.text_area("", value=mensaje_final, height=300, disabled=True, key="bien_final_preview")
+                    try:
+                        _, mensaje_final = redactar_mensaje(
+                            estudiante_ejemplo, 'bienvenida', datos,
+                            {'asunto': plantilla['asunto'], 'mensaje': nuevo_mensaje_bien}
+                        )
+                        st.text_area("", value=mensaje_final, height=300, disabled=True, key="bien_final_preview")
+                    except PlantillaInvalida as e:
+                        st.error(f"✗ {str(e)}")
                 
                 if nuevo_asunto_bien != asunto_ejemplo or nuevo_mensaje_bien != plantilla['mensaje']:
                     st.warning("⚠️ Cambios pendientes. Haz clic en 💾 para guardar.")
@@ -1516,233 +1074,135 @@ Asesor Virtual - NovaUniversitas"""
         st.divider()
         st.subheader("📧 Envío")
         
+        envio_agrupado = st.checkbox(
+            "📨 Un solo mensaje para todas las direcciones del estudiante",
+            value=True,
+            help="Envía el correo personal y el institucional en una sola transacción SMTP; el historial registra el resultado de cada dirección",
+            key="envio_agrupado_tab1"
+        )
+        
         if tipo_envio == "automatico":
             col1, col2, col3 = st.columns(3)
             
             with col1:
                 if st.button("✓ Felicitaciones", disabled=len(estudiantes_completos)==0, key="felicit_tab1"):
-                    for _, estudiante in estudiantes_completos.iterrows():
-                        nombre, apellidos = obtener_nombre_completo(estudiante, datos['institucion'])
-                        nombre_completo = f"{nombre} {apellidos}".strip()
-                        
-                        actividades_completadas = obtener_actividades_completadas(
-                            estudiante, 
-                            config_institucion['columnas_actividades'],
-                            config_institucion['nombres_actividades']
-                        )
-                        
-                        plantilla = obtener_plantilla(datos['institucion'], 'felicitacion')
-                        asunto = plantilla['asunto'].format(**variables_extra)
-                        
-                        actividades_lista = "\n".join([f"{i+1}. {act}" for i, act in enumerate(actividades_completadas)])
-                        mensaje = plantilla['mensaje'].format(
-                            nombre=nombre,
-                            actividades_completadas=actividades_lista,
-                            **variables_extra
-                        )
-                        
-                        emails_validos = obtener_emails_validos(estudiante)
-                        if emails_validos:
-                            enviar_a_todos_los_emails(emails_validos, asunto, mensaje, nombre_completo, archivos_adjuntos)
-                        
-                        time.sleep(1)
-                    st.success("✓ Enviados")
+                    try:
+                        mensajes = mensajes_tab1(estudiantes_completos, 'felicitacion', datos, envio_agrupado)
+                        encolar_campana("Tab 1 - Felicitaciones", mensajes, SERVIDOR_GMAIL, PUERTO_GMAIL_SSL, REMITENTE, CLAVE_APP, archivos_adjuntos)
+                    except PlantillaInvalida as e:
+                        st.error(f"✗ No se envió nada: {str(e)}")
             
             with col2:
                 if st.button("⚠ Recordatorios", disabled=len(estudiantes_incompletos)==0, key="recordat_tab1"):
-                    for _, estudiante in estudiantes_incompletos.iterrows():
-                        nombre, apellidos = obtener_nombre_completo(estudiante, datos['institucion'])
-                        nombre_completo = f"{nombre} {apellidos}".strip()
-                        
-                        # Para semana 3, mostrar TODAS las actividades pendientes
-                        num_actividades_a_revisar = len(config_institucion['columnas_actividades']) if datos['semana'] == 3 else datos['actividades_requeridas']
-                        
-                        actividades_faltantes = obtener_actividades_faltantes(
-                            estudiante,
-                            config_institucion['columnas_actividades'],
-                            config_institucion['nombres_actividades'],
-                            num_actividades_a_revisar
-                        )
-                        
-                        plantilla = obtener_plantilla(datos['institucion'], 'seguimiento_atraso', datos['semana'])
-                        asunto = plantilla['asunto'].format(**variables_extra)
-                        
-                        actividades_lista = "\n".join([f"{i+1}. {act}" for i, act in enumerate(actividades_faltantes)])
-                        mensaje = plantilla['mensaje'].format(
-                            nombre=nombre,
-                            actividades_faltantes=actividades_lista,
-                            **variables_extra
-                        )
-                        
-                        emails_validos = obtener_emails_validos(estudiante)
-                        if emails_validos:
-                            enviar_a_todos_los_emails(emails_validos, asunto, mensaje, nombre_completo, archivos_adjuntos)
-                        
-                        time.sleep(1)
-                    st.success("✓ Enviados")
+                    try:
+                        mensajes = mensajes_tab1(estudiantes_incompletos, 'seguimiento_atraso', datos, envio_agrupado)
+                        encolar_campana("Tab 1 - Recordatorios", mensajes, SERVIDOR_GMAIL, PUERTO_GMAIL_SSL, REMITENTE, CLAVE_APP, archivos_adjuntos)
+                    except PlantillaInvalida as e:
+                        st.error(f"✗ No se envió nada: {str(e)}")
             
             with col3:
                 if st.button("✗ Alertas", disabled=len(estudiantes_sin_entregas)==0, key="alertas_tab1"):
-                    for _, estudiante in estudiantes_sin_entregas.iterrows():
-                        nombre, apellidos = obtener_nombre_completo(estudiante, datos['institucion'])
-                        nombre_completo = f"{nombre} {apellidos}".strip()
-                        
-                        plantilla = obtener_plantilla(datos['institucion'], 'seguimiento_sin_acceso', datos['semana'])
-                        asunto = plantilla['asunto'].format(**variables_extra)
-                        mensaje = plantilla['mensaje'].format(
-                            nombre=nombre,
-                            **variables_extra
-                        )
-                        
-                        emails_validos = obtener_emails_validos(estudiante)
-                        if emails_validos:
-                            enviar_a_todos_los_emails(emails_validos, asunto, mensaje, nombre_completo, archivos_adjuntos)
-                        
-                        time.sleep(1)
-                    st.success("✓ Enviados")
+                    try:
+                        mensajes = mensajes_tab1(estudiantes_sin_entregas, 'seguimiento_sin_acceso', datos, envio_agrupado)
+                        encolar_campana("Tab 1 - Alertas", mensajes, SERVIDOR_GMAIL, PUERTO_GMAIL_SSL, REMITENTE, CLAVE_APP, archivos_adjuntos)
+                    except PlantillaInvalida as e:
+                        st.error(f"✗ No se envió nada: {str(e)}")
             
             st.divider()
             total_estudiantes = len(estudiantes_completos) + len(estudiantes_incompletos) + len(estudiantes_sin_entregas)
             
             if total_estudiantes > 0:
                 if total_estudiantes > 110:
-                    st.warning(f"⚠ {total_estudiantes} correos. Pausas automáticas.")
+                    st.warning(f"⚠ {total_estudiantes} correos. El ritmo lo controla el limitador de envío.")
                 
                 if st.button(f"🚀 Enviar Todos ({total_estudiantes})", type="primary", key="masivo_tab1"):
-                    st.balloons()
-                    
-                    total_exitosos = 0
-                    total_procesados = 0
-                    contador_lote = 0
+                    mensajes = []
                     
-                    for categoria, estudiantes_cat, tipo_plantilla in [
-                        ("Felicitaciones", estudiantes_completos, "felicitacion"),
-                        ("Recordatorios", estudiantes_incompletos, "seguimiento_atraso"),
-                        ("Alertas", estudiantes_sin_entregas, "seguimiento_sin_acceso")
-                    ]:
-                        
-                        if len(estudiantes_cat) > 0:
-                            st.write(f"**{categoria}...**")
+                    try:
+                        # Las tres plantillas se validan antes de encolar cualquier mensaje
+                        for categoria, estudiantes_cat, tipo_plantilla in [
+                            ("Felicitaciones", estudiantes_completos, "felicitacion"),
+                            ("Recordatorios", estudiantes_incompletos, "seguimiento_atraso"),
+                            ("Alertas", estudiantes_sin_entregas, "seguimiento_sin_acceso")
+                        ]:
                             
-                            for _, estudiante in estudiantes_cat.iterrows():
-                                nombre, apellidos = obtener_nombre_completo(estudiante, datos['institucion'])
-                                nombre_completo = f"{nombre} {apellidos}".strip()
-                                
-                                plantilla = obtener_plantilla(datos['institucion'], tipo_plantilla, datos['semana'])
-                                asunto = plantilla['asunto'].format(**variables_extra)
-                                
-                                if tipo_plantilla == "felicitacion":
-                                    actividades_completadas = obtener_actividades_completadas(
-                                        estudiante, 
-                                        config_institucion['columnas_actividades'],
-                                        config_institucion['nombres_actividades']
-                                    )
-                                    actividades_lista = "\n".join([f"{i+1}. {act}" for i, act in enumerate(actividades_completadas)])
-                                    mensaje = plantilla['mensaje'].format(
-                                        nombre=nombre,
-                                        actividades_completadas=actividades_lista,
-                                        **variables_extra
-                                    )
-                                elif tipo_plantilla == "seguimiento_atraso":
-                                    # Para semana 3, mostrar TODAS las actividades pendientes
-                                    num_actividades_a_revisar = len(config_institucion['columnas_actividades']) if datos['semana'] == 3 else datos['actividades_requeridas']
-                                    
-                                    actividades_faltantes = obtener_actividades_faltantes(
-                                        estudiante,
-                                        config_institucion['columnas_actividades'],
-                                        config_institucion['nombres_actividades'],
-                                        num_actividades_a_revisar
-                                    )
-                                    actividades_lista = "\n".join([f"{i+1}. {act}" for i, act in enumerate(actividades_faltantes)])
-                                    mensaje = plantilla['mensaje'].format(
-                                        nombre=nombre,
-                                        actividades_faltantes=actividades_lista,
-                                        **variables_extra
-                                    )
-                                else:
-                                    mensaje = plantilla['mensaje'].format(
-                                        nombre=nombre,
-                                        **variables_extra
-                                    )
-                                
-                                emails_validos = obtener_emails_validos(estudiante)
-                                if emails_validos:
-                                    exitosos, total, emails_enviados = enviar_a_todos_los_emails(
-                                        emails_validos, asunto, mensaje, nombre_completo, archivos_adjuntos
-                                    )
-                                    total_exitosos += exitosos
-                                
-                                total_procesados += 1
-                                contador_lote += 1
-                                
-                                if contador_lote % 50 == 0:
-                                    st.info(f"Pausa... ({contador_lote})")
-                                    time.sleep(10)
-                                else:
-                                    time.sleep(1)
-                    
-                    st.success(f"✓ Completado: {total_exitosos}/{total_procesados}")
+                            if len(estudiantes_cat) > 0:
+                                st.write(f"**{categoria}...**")
+                                mensajes.extend(mensajes_tab1(estudiantes_cat, tipo_plantilla, datos, envio_agrupado))
+                        
+                        st.balloons()
+                        encolar_campana("Tab 1 - Enviar Todos", mensajes, SERVIDOR_GMAIL, PUERTO_GMAIL_SSL, REMITENTE, CLAVE_APP, archivos_adjuntos)
+                    except PlantillaInvalida as e:
+                        st.error(f"✗ No se envió nada: {str(e)}")
         
         else:
             if st.button(f"🎓 Enviar Bienvenida ({len(estudiantes_bienvenida)})", type="primary", key="bienvenida_tab1"):
                 
-                total_exitosos = 0
-                total_procesados = 0
-                contador_lote = 0
-                
-                plantilla = obtener_plantilla(datos['institucion'], 'bienvenida')
-                
-                for _, estudiante in estudiantes_bienvenida.iterrows():
-                    nombre, apellidos = obtener_nombre_completo(estudiante, datos['institucion'])
-                    nombre_completo = f"{nombre} {apellidos}".strip()
-                    
-                    asunto = plantilla['asunto'].format(**variables_extra)
-                    mensaje = plantilla['mensaje'].format(
-                        nombre=nombre,
-                        **variables_extra
-                    )
-                    
-                    emails_validos = obtener_emails_validos(estudiante)
-                    if emails_validos:
-                        exitosos, total, emails_enviados = enviar_a_todos_los_emails(
-                            emails_validos, asunto, mensaje, nombre_completo, archivos_adjuntos
-                        )
-                        total_exitosos += exitosos
-                    
-                    total_procesados += 1
-                    contador_lote += 1
-                    
-                    if contador_lote % 50 == 0:
-                        st.info(f"Pausa... ({contador_lote})")
-                        time.sleep(10)
-                    else:
-                        time.sleep(1)
-                
-                st.success(f"✓ Enviados: {total_exitosos}/{total_procesados}")
+                try:
+                    mensajes = mensajes_tab1(estudiantes_bienvenida, 'bienvenida', datos, envio_agrupado)
+                    encolar_campana("Tab 1 - Bienvenida", mensajes, SERVIDOR_GMAIL, PUERTO_GMAIL_SSL, REMITENTE, CLAVE_APP, archivos_adjuntos)
+                except PlantillaInvalida as e:
+                    st.error(f"✗ No se envió nada: {str(e)}")
 
-    historial = cargar_historial_db(100)
-    if historial:
+    if cargar_historial_db(1):
         st.divider()
-        with st.expander(f"📋 Historial ({len(historial)})"):
-            df_historial = pd.DataFrame(historial)
+        with st.expander("📋 Historial"):
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                fechas_historial = st.date_input("Fechas (UTC)", value=(), key="historial_fechas")
+            with col2:
+                destinatario_historial = st.text_input("Destinatario (empieza con)", key="historial_destinatario")
+            with col3:
+                estado_historial = st.selectbox("Estado", ["Todos", "Enviados", "Con error"], key="historial_estado")
+            with col4:
+                asunto_historial = st.text_input("Asunto contiene", key="historial_asunto")
+            
+            filtros_historial = {
+                'desde': fechas_historial[0] if len(fechas_historial) > 0 else None,
+                'hasta': fechas_historial[-1] if len(fechas_historial) > 0 else None,
+                'destinatario': destinatario_historial.strip() or None,
+                'estado': {"Enviados": 'enviado', "Con error": 'error'}.get(estado_historial),
+                'asunto': asunto_historial.strip() or None
+            }
             
-            exitosos = len(df_historial[df_historial['estado'] == 'Enviado'])
-            fallidos = len(df_historial) - exitosos
+            # Pila de cursores (timestamp, id): uno por página visitada; se
+            # reinicia al cambiar los filtros
+            if st.session_state.get('historial_filtros') != filtros_historial:
+                st.session_state.historial_filtros = filtros_historial
+                st.session_state.historial_cursores = [None]
+            cursores = st.session_state.historial_cursores
             
+            resumen = resumen_historial_db(**filtros_historial)
             col1, col2, col3 = st.columns(3)
-            col1.metric("Total", len(df_historial))
-            col2.metric("✓", exitosos)
-            col3.metric("✗", fallidos)
+            col1.metric("Total", resumen['total'])
+            col2.metric("✓", resumen['enviados'])
+            col3.metric("✗", resumen['fallidos'])
             
-            if st.button("🗑️", key="limpiar_tab1"):
-                limpiar_historial_db()
-                st.rerun()
+            pagina = cargar_historial_db(100, despues_de=cursores[-1], **filtros_historial)
+            if pagina:
+                st.dataframe(
+                    pd.DataFrame(pagina)[['timestamp', 'destinatario', 'asunto', 'estado']],
+                    use_container_width=True,
+                    height=200
+                )
+            else:
+                st.info("Sin registros con esos filtros")
             
-            st.dataframe(
-                df_historial[['timestamp', 'destinatario', 'asunto', 'estado']],
-                use_container_width=True,
-                height=200
-            )
+            col1, col2, col3, col4 = st.columns([1, 1, 2, 1])
+            with col1:
+                if st.button("⬅️ Anterior", disabled=len(cursores) == 1, key="historial_anterior"):
+                    cursores.pop()
+                    st.rerun()
+            with col2:
+                if st.button("Siguiente ➡️", disabled=len(pagina) < 100, key="historial_siguiente"):
+                    cursores.append((pagina[-1]['timestamp'], pagina[-1]['id']))
+                    st.rerun()
+            col3.caption(f"Página {len(cursores)}")
+            with col4:
+                if st.button("🗑️", key="limpiar_tab1"):
+                    limpiar_historial_db()
+                    st.session_state.historial_cursores = [None]
+                    st.rerun()
 
 # =====================================================
 # TAB 2: SISTEMA DE PRÁCTICAS
@@ -1751,144 +1211,18 @@ Asesor Virtual - NovaUniversitas"""
 with tab2:
     st.header("📝 Sistema de Envío de Correos - Prácticas Profesionales")
     
-    @st.cache_data
+    # Únicas columnas que se leen de la hoja 'Calificaciones', todas como texto
+    COLUMNAS_TAB2 = ['Nombre', 'Apellido(s)', 'Correo Personal', 'Dirección Email']
+
     def load_excel_data(file):
         """Cargar datos del archivo Excel"""
         try:
-            df = pd.read_excel(file, sheet_name='Calificaciones')
+            df = obtener_cache_libros().hoja(file.getvalue(), 'Calificaciones', COLUMNAS_TAB2, COLUMNAS_TAB2)
             return df
         except Exception as e:
             st.error(f"Error al cargar el archivo: {str(e)}")
             return None
 
-    PLANTILLAS_PRACTICAS = {
-        "Bienvenida": {
-            "asunto": "Bienvenida y primer reto - Estancias Profesionales UVEG",
-            "contenido": """Apreciable {nombre_completo}:
-
-Mi nombre es {nombre_asesor}, y seré tu asesor durante el desarrollo de las Estancias Profesionales en la {universidad}. Te doy la más cordial bienvenida al curso y aprovecho para compartirte información importante.
-
-Primer Reto (Reto 1 - Carta de Autorización):  
-He programado como fecha de entrega el {fecha_cierre_actividad} a medio día.  
-Es importante que todos los datos solicitados estén correctos y completos, ya que la evaluación será binaria (100 o 0 puntos).  
-Si no acreditas el Reto 1, no podrás continuar con los siguientes retos.
-
-Periodo de prácticas profesionales:  
-- Inicio: {fecha_inicio_practicas}  
-- Término: {fecha_fin_practicas}
-
-Importante: Revisa con atención la rúbrica del Reto 1. Es fundamental que cumplas todos los criterios exactamente como se indican.
-
-También te pido que revises la sección de "Avisos" en tu aula virtual para mantenerte al tanto de cualquier novedad.
-
-Quedo a tu disposición para cualquier duda. Recuerda que no estás solo/a, estoy aquí para ayudarte durante todo el proceso.
-
-Te agradeceré que me confirmes la recepción de este correo.
-
-Atentamente,  
-{nombre_completo_asesor}  
-Asesor Virtual  
-{nombre_universidad}"""
-        },
-        
-        "Sesión Síncrona": {
-            "asunto": "Invitación - Sesión síncrona de las prácticas profesionales",
-            "contenido": """Buen día, {nombre}:
-
-El presente tiene el objetivo de invitarte a la: Sesión síncrona de las prácticas profesionales
-
-{info_google_meet}
-
-Te esperamos puntualmente.
-
-Saludos cordiales,
-{nombre_asesor}"""
-        },
-        
-        "Envío de Grabación": {
-            "asunto": "Grabación de sesión síncrona - Reto {numero_reto}",
-            "contenido": """Buen día, {nombre}:
-
-Envío la grabación de la sesión síncrona, correspondiente al reto {numero_reto}:
-
-Enlace: {enlace_grabacion}
-
-Agradeceré me contestes de recibido este mensaje.
-
-Quedo al pendiente.
-
-Saludos,
-{nombre_asesor}"""
-        },
-        
-        "Libre": {
-            "asunto": "",
-            "contenido": """Apreciable {nombre}:
-
-[Escribe aquí tu mensaje personalizado]
-
-Saludos cordiales,
-{nombre_asesor}"""
-        }
-    }
-
-    def enviar_correo_tab2(smtp_server, smtp_port, email_usuario, email_password, destinatario, asunto, contenido, archivos_adjuntos=None, reintentos=3):
-        """Función para enviar correo electrónico con reintentos automáticos"""
-        for intento in range(reintentos):
-            server = None
-            try:
-                msg = MIMEMultipart()
-                msg['From'] = email_usuario
-                msg['To'] = destinatario
-                msg['Subject'] = asunto
-                
-                msg.attach(MIMEText(contenido, 'plain', 'utf-8'))
-                
-                if archivos_adjuntos:
-                    for archivo in archivos_adjuntos:
-                        # Reiniciar posición del archivo para cada intento
-                        archivo.seek(0)
-                        part = MIMEBase('application', 'octet-stream')
-                        part.set_payload(archivo.read())
-                        encoders.encode_base64(part)
-                        part.add_header(
-                            'Content-Disposition',
-                            f'attachment; filename= {archivo.name}'
-                        )
-                        msg.attach(part)
-                
-                # Crear nueva conexión con timeout más largo
-                server = smtplib.SMTP(smtp_server, smtp_port, timeout=30)
-                server.starttls()
-                server.login(email_usuario, email_password)
-                
-                text = msg.as_string()
-                server.sendmail(email_usuario, destinatario, text)
-                server.quit()
-                
-                guardar_historial_db(asunto, destinatario, 'Enviado')
-                return True, "Correo enviado exitosamente"
-            
-            except Exception as e:
-                # Cerrar servidor si está abierto
-                if server:
-                    try:
-                        server.quit()
-                    except:
-                        pass
-                
-                if intento < reintentos - 1:
-                    # Esperar antes de reintentar (tiempo progresivo)
-                    tiempo_espera = 3 * (intento + 1)
-                    time.sleep(tiempo_espera)
-                    continue
-                else:
-                    error_msg = f"Error al enviar correo (después de {reintentos} intentos): {str(e)}"
-                    guardar_historial_db(asunto, destinatario, error_msg)
-                    return False, error_msg
-        
-        return False, "Error desconocido"
-
     with st.sidebar:
         st.header("⚙️ Configuración de Correo")
 
@@ -1907,8 +1241,8 @@ Saludos cordiales,
     col1, col2 = st.columns([1, 2])
 
     with col1:
-        st.subheader("📁 Cargar Archivo Excel")
-        uploaded_file = st.file_uploader("Selecciona el archivo Excel", type=['xlsx', 'xls'], key="upload_tab2")
+        st.subheader("📁 Cargar Archivo")
+        uploaded_file = st.file_uploader("Selecciona el archivo Excel, CSV o Parquet", type=TIPOS_ROSTER, key="upload_tab2")
         
         if uploaded_file is not None:
             df = load_excel_data(uploaded_file)
@@ -1921,6 +1255,15 @@ Saludos cordiales,
                 st.subheader("Seleccionar destinatarios:")
                 enviar_a = st.selectbox("Enviar correos a:", 
                                        ["Correo Personal", "Dirección Email", "Ambos"], key="enviar_a_tab2")
+                
+                envio_agrupado_tab2 = False
+                if enviar_a == "Ambos":
+                    envio_agrupado_tab2 = st.checkbox(
+                        "📨 Un solo mensaje para ambas direcciones",
+                        value=True,
+                        help="Una sola transacción SMTP por estudiante; el historial registra el resultado de cada dirección",
+                        key="envio_agrupado_tab2"
+                    )
 
     with col2:
         st.subheader("✉️ Composición del Correo")
@@ -1968,6 +1311,20 @@ Enlace de la videollamada: https://meet.google.com/ibb-zfcq-fps""",
             for archivo in archivos_adjuntos:
                 st.write(f"- {archivo.name} ({archivo.size} bytes)")
 
+    # Campos de la plantilla iguales para todos los destinatarios
+    variables_tab2 = {
+        'nombre_asesor': nombre_asesor,
+        'nombre_completo_asesor': nombre_completo_asesor,
+        'universidad': universidad,
+        'nombre_universidad': nombre_universidad,
+        'fecha_cierre_actividad': fecha_cierre_actividad if 'fecha_cierre_actividad' in locals() else "fecha_cierre_actividad",
+        'fecha_inicio_practicas': fecha_inicio_practicas if 'fecha_inicio_practicas' in locals() else "fecha_inicio_practicas",
+        'fecha_fin_practicas': fecha_fin_practicas if 'fecha_fin_practicas' in locals() else "fecha_fin_practicas",
+        'info_google_meet': info_google_meet if 'info_google_meet' in locals() else "info_google_meet",
+        'numero_reto': numero_reto if 'numero_reto' in locals() else "numero_reto",
+        'enlace_grabacion': enlace_grabacion if 'enlace_grabacion' in locals() else "enlace_grabacion"
+    }
+
     if uploaded_file is not None and df is not None:
         st.divider()
         st.header("👁️ Vista Previa del Correo")
@@ -1980,25 +1337,14 @@ Enlace de la videollamada: https://meet.google.com/ibb-zfcq-fps""",
         destinatario = df.iloc[indice_preview]
         nombre_completo = f"{destinatario['Nombre']} {destinatario['Apellido(s)']}"
         
-        contenido_personalizado = contenido.format(
-            nombre=destinatario['Nombre'],
-            nombre_completo=nombre_completo,
-            nombre_asesor=nombre_asesor,
-            nombre_completo_asesor=nombre_completo_asesor,
-            universidad=universidad,
-            nombre_universidad=nombre_universidad,
-            fecha_cierre_actividad=fecha_cierre_actividad if 'fecha_cierre_actividad' in locals() else "fecha_cierre_actividad",
-            fecha_inicio_practicas=fecha_inicio_practicas if 'fecha_inicio_practicas' in locals() else "fecha_inicio_practicas",
-            fecha_fin_practicas=fecha_fin_practicas if 'fecha_fin_practicas' in locals() else "fecha_fin_practicas",
-            info_google_meet=info_google_meet if 'info_google_meet' in locals() else "info_google_meet",
-            numero_reto=numero_reto if 'numero_reto' in locals() else "numero_reto",
-            enlace_grabacion=enlace_grabacion if 'enlace_grabacion' in locals() else "enlace_grabacion"
-        )
-        
         st.subheader(f"📧 Para: {nombre_completo}")
         st.write(f"**Asunto:** {asunto}")
         st.write("**Contenido:**")
-        st.text_area("", value=contenido_personalizado, height=200, disabled=True, key="preview_content_tab2")
+        try:
+            contenido_personalizado = redactar_practicas(df.iloc[[indice_preview]], contenido, variables_tab2)[0]
+            st.text_area("", value=contenido_personalizado, height=200, disabled=True, key="preview_content_tab2")
+        except PlantillaInvalida as e:
+            st.error(f"✗ {str(e)}")
 
     if uploaded_file is not None and df is not None:
         st.divider()
@@ -2010,38 +1356,24 @@ Enlace de la videollamada: https://meet.google.com/ibb-zfcq-fps""",
                 if not email_usuario or not email_password:
                     st.error("Por favor, configura tu email y contraseña en la barra lateral")
                 else:
+                    try:
+                        # Un solo render para todo el roster, validado antes del primer mensaje
+                        contenidos = redactar_practicas(df, contenido, variables_tab2)
+                    except PlantillaInvalida as e:
+                        st.error(f"✗ No se envió nada: {str(e)}")
+                        st.stop()
+                    
                     progress_bar = st.progress(0)
                     status_text = st.empty()
                     
-                    enviados = 0
-                    errores = 0
-                    contador_lote = 0
-                    
-                    # Información sobre pausas automáticas
-                    if len(df) > 50:
-                        st.info(f"⏸️ Se realizarán pausas automáticas cada 50 correos para evitar bloqueos. Total a enviar: {len(df)}")
+                    mensajes = []
                     
-                    for i, row in df.iterrows():
+                    for i, (indice, row) in enumerate(df.iterrows()):
                         progress = (i + 1) / len(df)
                         progress_bar.progress(progress)
-                        status_text.text(f"Enviando correo {i+1} de {len(df)} | ✅ Enviados: {enviados} | ❌ Errores: {errores}")
+                        status_text.text(f"Preparando correo {i+1} de {len(df)}")
                         
-                        nombre_completo = f"{row['Nombre']} {row['Apellido(s)']}"
-                        
-                        contenido_personalizado = contenido.format(
-                            nombre=row['Nombre'],
-                            nombre_completo=nombre_completo,
-                            nombre_asesor=nombre_asesor,
-                            nombre_completo_asesor=nombre_completo_asesor,
-                            universidad=universidad,
-                            nombre_universidad=nombre_universidad,
-                            fecha_cierre_actividad=fecha_cierre_actividad if 'fecha_cierre_actividad' in locals() else "fecha_cierre_actividad",
-                            fecha_inicio_practicas=fecha_inicio_practicas if 'fecha_inicio_practicas' in locals() else "fecha_inicio_practicas",
-                            fecha_fin_practicas=fecha_fin_practicas if 'fecha_fin_practicas' in locals() else "fecha_fin_practicas",
-                            info_google_meet=info_google_meet if 'info_google_meet' in locals() else "info_google_meet",
-                            numero_reto=numero_reto if 'numero_reto' in locals() else "numero_reto",
-                            enlace_grabacion=enlace_grabacion if 'enlace_grabacion' in locals() else "enlace_grabacion"
-                        )
+                        contenido_personalizado = contenidos[i]
                         
                         destinatarios = []
                         if enviar_a == "Correo Personal":
@@ -2051,43 +1383,15 @@ Enlace de la videollamada: https://meet.google.com/ibb-zfcq-fps""",
                         else:
                             destinatarios.extend([row['Correo Personal'], row['Dirección Email']])
                         
-                        for destinatario in destinatarios:
-                            if pd.notna(destinatario) and destinatario.strip():
-                                exito, mensaje = enviar_correo_tab2(
-                                    smtp_server, smtp_port, email_usuario, email_password,
-                                    destinatario, asunto, contenido_personalizado, archivos_adjuntos
-                                )
-                                
-                                if exito:
-                                    enviados += 1
-                                else:
-                                    errores += 1
-                                    st.error(f"Error enviando a {destinatario}: {mensaje}")
-                                
-                                # Pausa entre correos individuales
-                                time.sleep(2)
-                        
-                        contador_lote += 1
-                        
-                        # Pausa cada 50 correos para evitar bloqueos
-                        if contador_lote % 50 == 0 and contador_lote < len(df):
-                            st.warning(f"⏸️ Pausa preventiva después de {contador_lote} correos procesados...")
-                            time.sleep(15)  # Pausa de 15 segundos cada 50 correos
-                            st.info("▶️ Continuando envío...")
+                        for lote in lotes_destinatarios(destinatarios, envio_agrupado_tab2):
+                            mensajes.append((lote, asunto, contenido_personalizado, indice, plantilla_seleccionada))
                     
                     progress_bar.progress(1.0)
-                    status_text.text("¡Envío completado!")
-                    
-                    col_result1, col_result2 = st.columns(2)
-                    with col_result1:
-                        st.success(f"✅ Correos enviados exitosamente: {enviados}")
-                    with col_result2:
-                        if errores > 0:
-                            st.error(f"❌ Errores encontrados: {errores}")
-                        else:
-                            st.success("🎉 ¡Todos los correos se enviaron sin errores!")
+                    status_text.text("¡Correos preparados!")
                     
-                    st.balloons()
+                    if encolar_campana("Tab 2 - Prácticas", mensajes, smtp_server, smtp_port,
+                                       email_usuario, email_password, archivos_adjuntos):
+                        st.balloons()
 
 # =====================================================
 # TAB 3: SISTEMA BIENVENIDA NOVAUNIVERSITAS
@@ -2096,104 +1400,27 @@ Enlace de la videollamada: https://meet.google.com/ibb-zfcq-fps""",
 with tab3:
     st.header("🎓 Sistema de Bienvenida NovaUniversitas")
     
-    def generar_mensaje_personalizado(nombre, correo_institucional, contrasena):
-        """Genera el mensaje personalizado para cada estudiante"""
-        mensaje = f"""Apreciable {nombre},
-
-¡Te damos la más cordial bienvenida a **NovaUniversitas**! Nos complace que formes parte de nuestra comunidad académica en esta nueva etapa de aprendizaje.
-
-Para acceder a tu **cuenta de correo institucional**:
-
-**Correo institucional:** {correo_institucional}
-**Contraseña temporal:** {contrasena}
-
-**Si estás recursando, mantienes tu contraseña que has modificado.**
-
-Te recomendamos acceder cuanto antes y cambiar tu contraseña por una más segura.
-
-**IMPORTANTE**: Una vez dentro de tu correo, busca el mensaje que contiene el usuario y contraseña de la plataforma virtual:
-https://virtual.novauniversitas.edu.mx
-
-**Tutorial para inicio de sesiones:**
-https://youtu.be/75ib7aN0Tvw?feature=shared
-
-Desde **Coordinación Virtual**, estamos aquí para apoyarte en todo este proceso. Si tienes dudas o necesitas ayuda con el acceso, no dudes en contactarnos en mesadeayuda@virtual.novauniversitas.edu.mx
-
-Te dejo un enlace a los lineamientos que debes seguir con el uso del correo institucional.
-
-**Por favor, confirme de recibido.**
-
-¡Te deseamos mucho éxito en esta nueva etapa!
-
-Atentamente,
-**M.D. Juan Manuel Martínez Zaragoza**
-Coordinación Virtual
-**www.virtual.novauniversitas.edu.mx**"""
-        
-        return mensaje
-
     def enviar_correo_tab3(smtp_server, smtp_port, email_usuario, email_password, 
-                      destinatario, asunto, mensaje, archivos_adjuntos=None, reintentos=3):
-        """Envía un correo electrónico usando SMTP con archivos adjuntos opcionales y reintentos automáticos"""
-        for intento in range(reintentos):
-            server = None
-            try:
-                msg = MIMEMultipart()
-                msg['From'] = email_usuario
-                msg['To'] = destinatario
-                msg['Subject'] = asunto
-                
-                msg.attach(MIMEText(mensaje, 'plain', 'utf-8'))
-                
-                if archivos_adjuntos:
-                    for archivo in archivos_adjuntos:
-                        if archivo is not None:
-                            try:
-                                # Reiniciar posición del archivo para cada intento
-                                archivo.seek(0)
-                                part = MIMEBase('application', 'octet-stream')
-                                part.set_payload(archivo.getvalue())
-                                encoders.encode_base64(part)
-                                part.add_header(
-                                    'Content-Disposition',
-                                    f'attachment; filename= {archivo.name}'
-                                )
-                                msg.attach(part)
-                            except Exception as e:
-                                if intento == reintentos - 1:
-                                    return False, f"Error al adjuntar archivo {archivo.name}: {str(e)}"
-                
-                # Crear nueva conexión con timeout más largo
-                server = smtplib.SMTP(smtp_server, smtp_port, timeout=30)
-                server.starttls()
-                server.login(email_usuario, email_password)
-                
-                text = msg.as_string()
-                server.sendmail(email_usuario, destinatario, text)
-                server.quit()
-                
-                guardar_historial_db(asunto, destinatario, 'Enviado')
-                return True, "Correo enviado exitosamente"
+                      destinatario, asunto, mensaje, adjuntos=None):
+        """Envía un correo electrónico usando SMTP con archivos adjuntos opcionales"""
+        try:
+            # Adjuntos ya codificados en disco por preparar_adjuntos; el mensaje
+            # se transmite por bloques sin armarse completo en memoria
+            preparado = preparar_mensaje(
+                email_usuario, [destinatario], asunto, mensaje, adjuntos or [], obtener_cache_adjuntos()
+            )
+            obtener_pool_smtp().enviar(
+                smtp_server, smtp_port, email_usuario, email_password, [destinatario],
+                con_remitente(preparado, email_usuario)
+            )
             
-            except Exception as e:
-                # Cerrar servidor si está abierto
-                if server:
-                    try:
-                        server.quit()
-                    except:
-                        pass
-                
-                if intento < reintentos - 1:
-                    # Esperar antes de reintentar (tiempo progresivo)
-                    tiempo_espera = 3 * (intento + 1)
-                    time.sleep(tiempo_espera)
-                    continue
-                else:
-                    error_msg = f"Error al enviar correo (después de {reintentos} intentos): {str(e)}"
-                    guardar_historial_db(asunto, destinatario, error_msg)
-                    return False, error_msg
+            guardar_historial_db(asunto, destinatario, 'Enviado')
+            return True, "Correo enviado exitosamente"
         
-        return False, "Error desconocido"
+        except Exception as e:
+            error_msg = f"Error al enviar correo ({clasificar_error_smtp(e)}): {str(e)}"
+            guardar_historial_db(asunto, destinatario, error_msg)
+            return False, error_msg
 
     with st.sidebar:
         st.header("⚙️ Configuración de Correo")
@@ -2214,22 +1441,25 @@ Coordinación Virtual
         5. **Ejecuta** el envío masivo
         """)
 
+    # Únicas columnas que se leen del archivo, todas como texto
+    COLUMNAS_TAB3 = ['Nombre', 'Email_personal', 'Correo Institucional', 'Contraseña']
+
     col1, col2 = st.columns([1, 1])
 
     with col1:
-        st.subheader("📁 Cargar Archivo Excel")
+        st.subheader("📁 Cargar Archivo")
         
         uploaded_file_tab3 = st.file_uploader(
-            "Selecciona el archivo Excel con los datos de estudiantes",
-            type=['xlsx', 'xls'],
+            "Selecciona el archivo Excel, CSV o Parquet con los datos de estudiantes",
+            type=TIPOS_ROSTER,
             help="El archivo debe contener las columnas: NP, Grupo, Matrícula, Nombre, Email_personal, Correo Institucional, Contraseña, Cuatrimestre, Carrera",
             key="uploaded_file_tab3"
         )
         
         if uploaded_file_tab3 is not None:
             try:
-                excel_file = pd.ExcelFile(uploaded_file_tab3)
-                sheet_names = excel_file.sheet_names
+                contenido_tab3 = uploaded_file_tab3.getvalue()
+                sheet_names = obtener_cache_libros().nombres_hojas(contenido_tab3)
                 
                 selected_sheet = st.selectbox(
                     "Selecciona la hoja a procesar:",
@@ -2238,22 +1468,23 @@ Coordinación Virtual
                     key="selected_sheet_tab3"
                 )
                 
-                df_tab3 = pd.read_excel(uploaded_file_tab3, sheet_name=selected_sheet)
+                df_tab3 = obtener_cache_libros().hoja(contenido_tab3, selected_sheet, COLUMNAS_TAB3, COLUMNAS_TAB3)
                 
-                required_columns = ['Nombre', 'Email_personal', 'Correo Institucional', 'Contraseña']
+                required_columns = COLUMNAS_TAB3
                 missing_columns = [col for col in required_columns if col not in df_tab3.columns]
                 
                 if missing_columns:
                     st.error(f"❌ Faltan las siguientes columnas: {', '.join(missing_columns)}")
                 else:
                     df_tab3 = df_tab3.dropna(subset=['Nombre', 'Email_personal', 'Correo Institucional'])
+                    df_tab3['emails_validos'] = emails_validos_roster(df_tab3, ['Email_personal'])
                     
                     st.success(f"✅ Archivo cargado exitosamente: {len(df_tab3)} estudiantes encontrados")
                     
                     st.subheader("👀 Vista Previa de Datos")
                     st.dataframe(df_tab3[['Nombre', 'Email_personal', 'Correo Institucional', 'Contraseña']].head(10))
                     
-                    st.info(f"📊 **Estadísticas:**\n- Total de estudiantes: {len(df_tab3)}\n- Columnas disponibles: {len(df_tab3.columns)}")
+                    st.info(f"📊 **Estadísticas:**\n- Total de estudiantes: {len(df_tab3)}\n- Con Email_personal válido: {int(df_tab3['emails_validos'].str.len().gt(0).sum())}\n- Columnas disponibles: {len(obtener_cache_libros().encabezado(contenido_tab3, selected_sheet))}")
                     
             except Exception as e:
                 st.error(f"❌ Error al leer el archivo: {str(e)}")
@@ -2349,7 +1580,8 @@ Coordinación Virtual
                         with st.spinner("Enviando correo de prueba..."):
                             exito, resultado = enviar_correo_tab3(
                                 smtp_server_tab3, smtp_port_tab3, email_usuario_tab3, email_password_tab3,
-                                estudiante_data['Email_personal'], asunto_tab3, mensaje, archivos_adjuntos_tab3
+                                estudiante_data['Email_personal'], asunto_tab3, mensaje,
+                                preparar_adjuntos(archivos_adjuntos_tab3)
                             )
                         
                         if exito:
@@ -2366,86 +1598,106 @@ Coordinación Virtual
                 if archivos_adjuntos_tab3:
                     st.info(f"📎 Se adjuntarán {len(archivos_adjuntos_tab3)} archivo(s) a cada correo")
                 
-                delay_between_emails = st.slider(
-                    "Retraso entre correos (segundos):",
-                    min_value=1, max_value=10, value=2,
-                    help="Retraso para evitar ser marcado como spam",
-                    key="delay_tab3"
-                )
-                
                 if st.button("📤 Iniciar Envío Masivo", type="primary", key="enviar_masivo_tab3"):
                     if not all([smtp_server_tab3, smtp_port_tab3, email_usuario_tab3, email_password_tab3]):
                         st.error("❌ Por favor, completa toda la configuración SMTP")
                     else:
-                        enviados = 0
                         errores = 0
-                        contador_lote = 0
                         
                         progress_bar = st.progress(0)
                         status_text = st.empty()
                         
-                        log_container = st.empty()
                         logs = []
+                        mensajes = []
                         
-                        # Información sobre pausas automáticas
-                        if len(df_tab3) > 50:
-                            st.info(f"⏸️ Se realizarán pausas automáticas cada 50 correos para evitar bloqueos. Total a enviar: {len(df_tab3)}")
-                        
-                        for index, row in df_tab3.iterrows():
+                        for i, (_, row) in enumerate(df_tab3.iterrows()):
                             try:
                                 mensaje = generar_mensaje_personalizado(
                                     row['Nombre'],
                                     row['Correo Institucional'],
                                     row['Contraseña'] if 'Contraseña' in df_tab3.columns else "0125070109"
                                 )
-                                
-                                exito, resultado = enviar_correo_tab3(
-                                    smtp_server_tab3, smtp_port_tab3, email_usuario_tab3, email_password_tab3,
-                                    row['Email_personal'], asunto_tab3, mensaje, archivos_adjuntos_tab3
-                                )
-                                
-                                if exito:
-                                    enviados += 1
-                                    logs.append(f"✅ {row['Nombre']} - {resultado}")
-                                else:
-                                    errores += 1
-                                    logs.append(f"❌ {row['Nombre']} - {resultado}")
-                                
-                                progress = (index + 1) / len(df_tab3)
-                                progress_bar.progress(progress)
-                                status_text.text(f"Procesando: {index + 1}/{len(df_tab3)} | ✅ Enviados: {enviados} | ❌ Errores: {errores}")
-                                
-                                with log_container.container():
-                                    st.text_area("Registro de envíos:", "\n".join(logs[-10:]), height=200, key=f"log_area_tab3_{index}")
-                                
-                                contador_lote += 1
-                                
-                                # Pausa cada 50 correos para evitar bloqueos
-                                if contador_lote % 50 == 0 and contador_lote < len(df_tab3):
-                                    st.warning(f"⏸️ Pausa preventiva después de {contador_lote} correos procesados...")
-                                    time.sleep(15)  # Pausa de 15 segundos cada 50 correos
-                                    st.info("▶️ Continuando envío...")
-                                    time.sleep(delay_between_emails)
-                                else:
-                                    time.sleep(delay_between_emails)
-                                
+                                destinatarios = lotes_destinatarios(row['emails_validos'], False)
+                                if not destinatarios:
+                                    raise ValueError(f"Email_personal inválido: {row['Email_personal']}")
+                                mensajes.append((destinatarios[0], asunto_tab3, mensaje, i, 'bienvenida_nova'))
                             except Exception as e:
                                 errores += 1
                                 logs.append(f"❌ {row['Nombre']} - Error: {str(e)}")
+                            
+                            progress_bar.progress((i + 1) / len(df_tab3))
+                            status_text.text(f"Preparando: {i+1}/{len(df_tab3)} | ❌ Errores: {errores}")
                         
-                        st.success(f"🎉 **Envío completado!**\n- Enviados: {enviados}\n- Errores: {errores}")
-                        
-                        if enviados > 0:
+                        if encolar_campana("Tab 3 - Bienvenida Nova", mensajes, smtp_server_tab3, smtp_port_tab3,
+                                           email_usuario_tab3, email_password_tab3, archivos_adjuntos_tab3):
                             st.balloons()
                         
-                        log_text = "\n".join(logs)
-                        st.download_button(
-                            label="📥 Descargar Log Completo",
-                            data=log_text,
-                            file_name="log_envio_correos.txt",
-                            mime="text/plain",
-                            key="download_log_tab3"
-                        )
+                        if logs:
+                            st.error(f"❌ {errores} estudiantes no se encolaron")
+                            log_text = "\n".join(logs)
+                            st.download_button(
+                                label="📥 Descargar Log Completo",
+                                data=log_text,
+                                file_name="log_envio_correos.txt",
+                                mime="text/plain",
+                                key="download_log_tab3"
+                            )
+
+# =====================================================
+# AVANCE DE LOS ENVÍOS (FRAGMENTO)
+# =====================================================
+
+INTERVALO_AVANCE = 2
+
+# Sólo este fragmento se vuelve a ejecutar cada INTERVALO_AVANCE segundos; las
+# pestañas siguen disponibles. Sin envíos en curso sólo se cuentan los mensajes
+# pendientes o en pausa de la bandeja, así aparecen también las campañas de otra
+# sesión o de la consola
+@st.fragment(run_every=INTERVALO_AVANCE)
+def mostrar_envios_en_curso():
+    registro = obtener_registro_trabajos()
+    if not registro.activos() and not contar_pendientes(pausados=True):
+        return
+    # También las campañas de la bandeja que no lanzó este proceso
+    registro.sincronizar()
+    trabajos = registro.recientes()[:5]
+    if not trabajos:
+        return
+    st.subheader("📡 Envíos en curso")
+    for trabajo in trabajos:
+        avance = registro.avance(trabajo)
+        terminados = avance['enviados'] + avance['errores'] + avance['cancelados']
+        st.progress(
+            terminados / avance['total'] if avance['total'] else 0.0,
+            text=f"{trabajo.origen} | campaña {trabajo.campana} | {trabajo.estado}"
+        )
+        st.caption(f"✅ Enviados: {avance['enviados']} | ❌ Errores: {avance['errores']} | "
+                   f"⏳ Pendientes: {avance['pendientes']} | ⏹ Cancelados: {avance['cancelados']} | "
+                   f"Total: {avance['total']}")
+        if trabajo.error:
+            st.error(f"✗ {trabajo.error}")
+        
+        # Pausa, continuación y cancelación surten efecto entre un mensaje y el siguiente
+        if trabajo.activo():
+            col_pausa, col_cancelar, _ = st.columns([1, 1, 3])
+            with col_pausa:
+                # Con on_click la acción corre antes de redibujar el panel
+                if trabajo.estado == EN_PAUSA:
+                    st.button("▶ Continuar", key=f"continuar_{trabajo.campana}",
+                              on_click=registro.continuar, args=(trabajo,))
+                else:
+                    st.button("⏸ Pausar", key=f"pausar_{trabajo.campana}",
+                              on_click=registro.pausar, args=(trabajo,))
+            with col_cancelar:
+                with st.popover("⏹ Cancelar"):
+                    st.write("Los mensajes que aún no se envían se descartan; no se puede deshacer.")
+                    st.button("Confirmar cancelación", type="primary", key=f"cancelar_{trabajo.campana}",
+                              on_click=registro.cancelar, args=(trabajo,))
+        with st.expander("📜 Registro", expanded=trabajo.activo()):
+            st.code("\n".join(avance['lineas']) or "Sin actividad todavía", language=None)
+
+with panel_envios:
+    mostrar_envios_en_curso()
 
 st.divider()
 st.caption("Sistema de Correos v4.0 Dark | Base de datos persistente")
@@ -0,0 +1,188 @@
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+
+import outbox
+
+# =====================================================
+# TRABAJOS DE ENVÍO EN SEGUNDO PLANO
+# =====================================================
+
+PREPARANDO = "preparando"
+EN_BANDEJA = "en bandeja"
+EN_PAUSA = "en pausa"
+TERMINADO = "terminado"
+CANCELADO = "cancelado"
+FALLIDO = "error"
+
+# Ícono de cada estado de la bandeja en el registro (el resto: reprogramado)
+ICONOS = {outbox.ENVIADO: "✅", outbox.FALLIDO: "❌", outbox.CANCELADO: "⏹"}
+
+
+def _hora_local(marca):
+    """CURRENT_TIMESTAMP de SQLite (UTC) en la hora local, sin zona"""
+    hora = datetime.strptime(marca, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+    return hora.astimezone().replace(tzinfo=None)
+
+
+class TrabajoEnvio:
+    """Campaña lanzada desde la interfaz: un hilo la encola en la bandeja de
+    salida y el worker la envía; el avance se lee de la bandeja"""
+
+    def __init__(self, campana, origen, max_lineas=20):
+        self.campana = campana
+        self.origen = origen
+        self.creado = datetime.now()
+        self.estado = PREPARANDO
+        self.total = 0
+        self.error = None
+        self.lineas = deque(maxlen=max_lineas)
+        self.hilo = None
+
+    def anotar(self, texto):
+        self.lineas.append((datetime.now(), texto))
+
+    def activo(self):
+        return self.estado in (PREPARANDO, EN_BANDEJA, EN_PAUSA)
+
+    def en_marcha(self):
+        """Estado de un trabajo que no está pausado: todavía encolando o ya en la bandeja"""
+        return PREPARANDO if self.hilo is not None and self.hilo.is_alive() else EN_BANDEJA
+
+
+class RegistroTrabajos:
+    """Trabajos de envío del proceso, compartidos entre reruns y sesiones de
+    Streamlit. El script sólo lanza el trabajo y sigue; el avance lo muestra
+    un fragmento que se refresca solo"""
+
+    def __init__(self, max_trabajos=20, max_lineas=20):
+        self.max_trabajos = max_trabajos
+        self.max_lineas = max_lineas
+        self._trabajos = OrderedDict()
+        self._candado = threading.Lock()
+
+    def lanzar(self, origen, encolar, campana=None):
+        """Ejecutar `encolar(campana)` en un hilo; debe devolver cuántos
+        mensajes quedaron en la bandeja"""
+        trabajo = TrabajoEnvio(campana or outbox.nueva_campana(), origen, self.max_lineas)
+
+        def ejecutar():
+            try:
+                trabajo.total = encolar(trabajo.campana)
+                with self._candado:
+                    # Pudo pausarse o cancelarse mientras se encolaba
+                    if trabajo.estado == PREPARANDO:
+                        trabajo.estado = EN_BANDEJA
+                trabajo.anotar(f"{trabajo.total} mensajes en la bandeja de salida")
+            except Exception as e:
+                trabajo.estado = FALLIDO
+                trabajo.error = str(e)
+                trabajo.anotar(f"Error al preparar la campaña: {str(e)}")
+
+        trabajo.anotar("Preparando mensajes")
+        trabajo.hilo = threading.Thread(target=ejecutar, name=f"trabajo-{trabajo.campana}", daemon=True)
+        with self._candado:
+            self._trabajos[trabajo.campana] = trabajo
+            # Se olvidan los trabajos terminados más antiguos
+            for clave in [c for c, t in self._trabajos.items() if not t.activo()]:
+                if len(self._trabajos) <= self.max_trabajos:
+                    break
+                del self._trabajos[clave]
+        trabajo.hilo.start()
+        return trabajo
+
+    def pausar(self, trabajo):
+        """Pausar el envío; el mensaje que está en curso termina y los demás esperan"""
+        pausados = outbox.pausar_campana(trabajo.campana)
+        with self._candado:
+            if trabajo.activo():
+                trabajo.estado = EN_PAUSA
+        trabajo.anotar(f"⏸ Pausada ({pausados} mensajes en espera)")
+
+    def continuar(self, trabajo):
+        """Continuar una campaña pausada desde el siguiente mensaje, sin redactar
+        ni reenviar los ya enviados"""
+        continuados = outbox.continuar_campana(trabajo.campana)
+        with self._candado:
+            if trabajo.estado == EN_PAUSA:
+                trabajo.estado = trabajo.en_marcha()
+        trabajo.anotar(f"▶ Continuada ({continuados} mensajes de nuevo en la bandeja)")
+
+    def cancelar(self, trabajo):
+        """Cancelar el envío: los mensajes que faltan se descartan"""
+        cancelados = outbox.cancelar_campana(trabajo.campana)
+        with self._candado:
+            if trabajo.activo():
+                trabajo.estado = CANCELADO
+        trabajo.anotar(f"⏹ Cancelada ({cancelados} mensajes sin enviar)")
+
+    def sincronizar(self):
+        """Agregar las campañas de la bandeja sin terminar que no se lanzaron
+        desde este proceso (servidor reiniciado, otra instancia de la app o
+        encoladas por otro programa) para poder verlas y controlarlas"""
+        campanas = [
+            c for c in outbox.resumen_campanas()
+            if c['pendientes'] + c['enviando'] + c['pausados'] and c['campana'] not in self._trabajos
+        ]
+        if not campanas:
+            return
+        detenidas = outbox.campanas_detenidas([c['campana'] for c in campanas])
+        with self._candado:
+            for campana in campanas:
+                if campana['campana'] in self._trabajos or \
+                        detenidas.get(campana['campana']) == outbox.CAMPANA_CANCELADA:
+                    continue
+                trabajo = TrabajoEnvio(campana['campana'], campana['origen'], self.max_lineas)
+                trabajo.creado = _hora_local(campana['creada'])
+                trabajo.estado = EN_PAUSA if campana['campana'] in detenidas else EN_BANDEJA
+                trabajo.total = campana['total']
+                trabajo.anotar("Campaña retomada de la bandeja de salida")
+                self._trabajos[trabajo.campana] = trabajo
+
+    def recientes(self):
+        """Trabajos del más reciente al más antiguo"""
+        with self._candado:
+            return sorted(self._trabajos.values(), key=lambda t: t.creado, reverse=True)
+
+    def avance(self, trabajo, lineas=10):
+        """Conteos de la bandeja y últimas líneas de registro de un trabajo"""
+        detenida = outbox.campanas_detenidas([trabajo.campana]).get(trabajo.campana)
+        conteos = outbox.progreso_campana(trabajo.campana) if trabajo.estado != PREPARANDO else {}
+        pendientes = conteos.get(outbox.PENDIENTE, 0) + conteos.get(outbox.ENVIANDO, 0)
+        with self._candado:
+            # La campaña pudo pausarse, continuarse o cancelarse desde otra
+            # sesión o proceso: manda el estado guardado en la base de datos
+            if trabajo.activo():
+                if detenida == outbox.CAMPANA_CANCELADA:
+                    trabajo.estado = CANCELADO
+                elif detenida == outbox.CAMPANA_PAUSADA:
+                    trabajo.estado = EN_PAUSA
+                elif trabajo.estado == EN_PAUSA:
+                    trabajo.estado = trabajo.en_marcha()
+            # Varias sesiones pueden estar mostrando el mismo trabajo
+            if trabajo.estado == EN_BANDEJA and not pendientes and not conteos.get(outbox.PAUSADO):
+                trabajo.estado = TERMINADO
+                trabajo.anotar("Campaña terminada")
+            elif trabajo.estado == TERMINADO and pendientes:
+                # Campaña reanudada desde la bandeja de salida
+                trabajo.estado = EN_BANDEJA
+            registro = list(trabajo.lineas)
+        if conteos:
+            registro += [
+                (_hora_local(r['hora']),
+                 f"{ICONOS.get(r['estado'], '⏳')} {', '.join(r['destinatarios'])}: {r['resultado']}")
+                for r in outbox.ultimos_resultados(trabajo.campana, lineas)
+            ]
+        registro.sort(key=lambda linea: linea[0], reverse=True)
+        return {
+            'enviados': conteos.get(outbox.ENVIADO, 0),
+            'errores': conteos.get(outbox.FALLIDO, 0),
+            'pendientes': pendientes + conteos.get(outbox.PAUSADO, 0),
+            'cancelados': conteos.get(outbox.CANCELADO, 0),
+            'total': sum(conteos.values()) or trabajo.total,
+            'lineas': [f"{hora:%H:%M:%S} {texto}" for hora, texto in registro[:lineas]]
+        }
+
+    def activos(self):
+        with self._candado:
+            return any(t.activo() for t in self._trabajos.values())
@@ -0,0 +1,407 @@
+import argparse
+import io
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime
+from functools import partial
+from email.generator import BytesGenerator
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.policy import compat32
+
+import base_datos
+import outbox
+from adjuntos import CacheAdjuntos, parte_base64
+from base_datos import cargar_cuentas_db, escritor_historial, guardar_historial_db
+from envio_concurrente import enviar_masivo
+from envio_smtp import MensajeEnBloques, PoolSMTP
+from limitador import LimitadorEnvios
+from multicuenta import RepartidorCuentas
+from reintentos import (DESCONOCIDO, PERMANENTE, TRANSITORIO, ErrorDeCuenta, clasificar_destinatarios,
+                        espera_reintento)
+
+# =====================================================
+# WORKER DE ENVÍOS: DRENA LA BANDEJA DE SALIDA
+# =====================================================
+
+# Misma política con la que smtplib.send_message serializa (CRLF)
+POLITICA_SMTP = compat32.clone(linesep='\r\n')
+
+
+def construir_mensaje(remitente, destinatarios, asunto, cuerpo, partes=()):
+    """Mensaje de texto plano con los adjuntos ya codificados"""
+    msg = MIMEMultipart()
+    msg['From'] = remitente
+    msg['To'] = ", ".join(destinatarios)
+    msg['Subject'] = asunto
+    msg.attach(MIMEText(cuerpo, 'plain', 'utf-8'))
+    for part in partes:
+        msg.attach(part)
+    return msg
+
+
+def serializar_mensaje(msg):
+    """Bytes del mensaje tal como los transmite send_message"""
+    salida = io.BytesIO()
+    BytesGenerator(salida, mangle_from_=False, policy=POLITICA_SMTP).flatten(msg, linesep='\r\n')
+    return salida.getvalue()
+
+
+def preparar_mensaje(remitente, destinatarios, asunto, cuerpo, adjuntos, cache_adjuntos):
+    """Mensaje serializado sin la cabecera From: cabeceras y texto en bytes, y
+    cada adjunto como referencia a su base64 en disco, que se lee por bloques
+    al transmitir. `adjuntos` es una lista de (hash, nombre, cargar), con
+    `cargar()` devolviendo el contenido original por bloques"""
+    referencias = []
+    partes = []
+    for hash_contenido, nombre, cargar in adjuntos:
+        cache_adjuntos.guardar(hash_contenido, cargar)
+        marcador = f"<<adjunto-{uuid.uuid4().hex}>>"
+        referencias.append((marcador.encode('ascii'), partial(cache_adjuntos.bloques, hash_contenido, cargar)))
+        partes.append(parte_base64(nombre, marcador))
+    msg = construir_mensaje(remitente, destinatarios, asunto, cuerpo, partes)
+    del msg['From']
+    resto = serializar_mensaje(msg)
+    segmentos = []
+    for marcador, bloques in referencias:
+        antes, resto = resto.split(marcador, 1)
+        segmentos += [antes, bloques]
+    segmentos.append(resto)
+    return MensajeEnBloques(segmentos)
+
+
+def con_remitente(preparado, remitente):
+    """Mensaje preparado sin From con la cabecera de la cuenta que lo envía"""
+    return preparado.con_prefijo(POLITICA_SMTP.fold_binary('From', remitente))
+
+
+class TrabajadorEnvios:
+    """Envía los mensajes de la bandeja con el pool SMTP y el limitador.
+
+    Corre como proceso aparte (`python worker_envios.py`) o en un hilo dentro
+    del servidor de Streamlit; varios workers pueden compartir la base de datos
+    porque cada mensaje se reserva antes de enviarse. Mientras unos mensajes
+    esperan al servidor SMTP, `preparadores` hilos arman y serializan los
+    siguientes del lote."""
+
+    def __init__(self, pool=None, limitador=None, cache_adjuntos=None, concurrencia=4,
+                 lote=50, max_intentos=4, espera_vacia=2.0, preparadores=2):
+        self.limitador = limitador or LimitadorEnvios()
+        self.pool = pool or PoolSMTP(max_por_cuenta=10, limitador=self.limitador)
+        self.cache_adjuntos = cache_adjuntos or CacheAdjuntos()
+        self.concurrencia = concurrencia
+        self.preparadores = preparadores
+        self.lote = lote
+        self.max_intentos = max_intentos
+        self.espera_vacia = espera_vacia
+        self.renovacion = outbox.ANTIGUEDAD_HUERFANO / 4
+        self.nombre = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.enviados = 0
+        self.fallidos = 0
+        self.ultimo_error = None
+        self._repartidores = {}
+        self._candado = threading.Lock()
+        self._detener = threading.Event()
+        self._hilo = None
+
+    def repartidor(self, nombres, cuota):
+        """Repartidor de una selección de cuentas guardadas; las cuotas se
+        reinician cada día"""
+        clave = (tuple(nombres), cuota, datetime.now().date())
+        with self._candado:
+            if clave not in self._repartidores:
+                guardadas = cargar_cuentas_db()
+                cuentas = {nombre: guardadas[nombre] for nombre in nombres if nombre in guardadas}
+                self._repartidores[clave] = RepartidorCuentas(cuentas, cuota, limitador=self.limitador)
+            return self._repartidores[clave]
+
+    def password_fila(self, fila):
+        """Contraseña del remitente: la que recibió encolar en este proceso o la
+        de la cuenta guardada con ese correo"""
+        password = outbox.credencial(fila['campana'], fila['usuario'])
+        if password is None:
+            password = next((cuenta['password'] for cuenta in cargar_cuentas_db().values()
+                             if cuenta['email'] == fila['usuario']), None)
+        if password is None:
+            raise ErrorDeCuenta(
+                f"Sin contraseña para {fila['usuario']} en este proceso: selecciona o guarda "
+                "esa cuenta en la aplicación y usa Reanudar"
+            )
+        return password
+
+    def campana_detenida(self, campana):
+        """Estado de la campaña si está pausada o cancelada, None si sigue activa;
+        se consulta antes de cada mensaje (una búsqueda por clave primaria)"""
+        return outbox.campanas_detenidas([campana]).get(campana)
+
+    def adjuntos_fila(self, fila):
+        """Adjuntos de la fila como (hash, nombre, cargar) desde la bandeja"""
+        return [
+            (hash_contenido, nombre, partial(outbox.bloques_adjunto, hash_contenido))
+            for hash_contenido, nombre in fila['adjuntos']
+        ]
+
+    def preparar_fila(self, fila):
+        """Mensaje de la fila listo para transmitirse por bloques, sin la cabecera
+        From (en modo multicuenta la cuenta se decide al enviar). None si alguna
+        dirección no es ASCII: ese mensaje lo arma send_message para negociar SMTPUTF8"""
+        if not all(d.isascii() for d in [fila['usuario'], *fila['destinatarios']]):
+            return None
+        return preparar_mensaje(fila['usuario'], fila['destinatarios'], fila['asunto'], fila['cuerpo'],
+                                self.adjuntos_fila(fila), self.cache_adjuntos)
+
+    def enviar_fila(self, fila, preparado=None):
+        """Enviar un mensaje de la bandeja; devuelve {destinatario: (clase, detalle)}.
+        `preparado` es el resultado de preparar_fila si ya se calculó"""
+        destinatarios = fila['destinatarios']
+        try:
+            if preparado is None:
+                preparado = self.preparar_fila(fila)
+            if preparado is None:
+                partes = [self.cache_adjuntos.parte_guardada(*adjunto) for adjunto in self.adjuntos_fila(fila)]
+                msg = construir_mensaje(fila['usuario'], destinatarios, fila['asunto'], fila['cuerpo'], partes)
+
+                def mensaje_de(remitente):
+                    msg.replace_header('From', remitente)
+                    return msg
+            else:
+                def mensaje_de(remitente):
+                    return con_remitente(preparado, remitente)
+
+            if fila['cuentas']:
+                def enviar_con_cuenta(cuenta):
+                    return self.pool.enviar(
+                        fila['servidor'], fila['puerto'], cuenta.email, cuenta.password, destinatarios,
+                        mensaje_de(cuenta.email), seguridad=fila['seguridad']
+                    )
+                rechazados = self.repartidor(fila['cuentas'], fila['cuota']).enviar(enviar_con_cuenta)
+            else:
+                rechazados = self.pool.enviar(
+                    fila['servidor'], fila['puerto'], fila['usuario'], self.password_fila(fila), destinatarios,
+                    mensaje_de(fila['usuario']), seguridad=fila['seguridad']
+                )
+            return clasificar_destinatarios(destinatarios, rechazados)
+        except Exception as e:
+            return clasificar_destinatarios(destinatarios, error=e)
+
+    def confirmar(self, fila, estados):
+        """Registrar después de la transacción el resultado de cada clave: las
+        entregadas no se vuelven a enviar; las no entregadas (con error o por
+        reintentar) se pueden volver a reservar"""
+        entregadas = []
+        no_entregadas = []
+        for destinatario, (clase, _) in estados.items():
+            clave = fila['claves'].get(destinatario)
+            if clave:
+                (entregadas if clase is None else no_entregadas).append(clave)
+        outbox.confirmar_entregas(entregadas)
+        outbox.confirmar_entregas(no_entregadas, outbox.NO_ENTREGADO)
+
+    def registrar(self, fila, estados):
+        """Guardar en historial el resultado de cada destinatario y actualizar la
+        bandeja; los errores temporales se reprograman con backoff"""
+        intento = fila['intentos'] + 1
+        pendientes = []
+        errores = []
+        detalle_pendiente = None
+        for destinatario, (clase, detalle) in estados.items():
+            if clase is None:
+                guardar_historial_db(fila['asunto'], destinatario, 'Enviado')
+                self.enviados += 1
+            elif clase == TRANSITORIO and intento < self.max_intentos:
+                pendientes.append(destinatario)
+                detalle_pendiente = detalle
+            else:
+                error_msg = f"Error ({clase}): {detalle}"
+                guardar_historial_db(fila['asunto'], destinatario, error_msg)
+                errores.append(f"{destinatario}: {error_msg}")
+                self.fallidos += 1
+
+        if pendientes:
+            outbox.reprogramar(
+                fila['id'], pendientes, time.time() + espera_reintento(intento),
+                f"Error temporal, se reintentará: {detalle_pendiente}"
+            )
+        elif errores:
+            outbox.finalizar(fila['id'], outbox.FALLIDO, "; ".join(errores))
+        else:
+            outbox.finalizar(fila['id'], outbox.ENVIADO, "Enviado correctamente")
+
+    def renovar_reservas(self, terminado):
+        """Renovar la reserva del lote hasta que `terminado` se active"""
+        while not terminado.wait(self.renovacion):
+            try:
+                outbox.renovar(self.nombre)
+            except Exception as e:
+                self.ultimo_error = f"{datetime.now():%H:%M:%S} {str(e)}"
+
+    def procesar_lote(self):
+        """Reservar y enviar un lote de la bandeja; devuelve cuántos mensajes tomó"""
+        tomadas = outbox.tomar(self.nombre, max(self.lote, self.concurrencia))
+        if not tomadas:
+            return 0
+
+        # Un lote frenado por el limitador puede tardar más que ANTIGUEDAD_HUERFANO:
+        # mientras se envía, la reserva se renueva para que otro worker no lo libere
+        terminado = threading.Event()
+        threading.Thread(target=self.renovar_reservas, args=(terminado,),
+                         name="worker-envios-reservas", daemon=True).start()
+        try:
+            self.enviar_lote(tomadas)
+        finally:
+            terminado.set()
+        return len(tomadas)
+
+    def enviar_lote(self, tomadas):
+        """Enviar los mensajes tomados de la bandeja"""
+        # Campañas pausadas o canceladas después de encolar: sus mensajes vuelven
+        # a la bandeja sin enviarse
+        detenidas = outbox.campanas_detenidas([fila['campana'] for fila in tomadas])
+        filas = []
+        for fila in tomadas:
+            if fila['campana'] in detenidas:
+                outbox.devolver(fila['id'])
+            else:
+                filas.append(fila)
+
+        def enviar(fila, preparado):
+            # La pausa o cancelación surte efecto entre un mensaje y el siguiente
+            detenida = self.campana_detenida(fila['campana'])
+            if detenida:
+                return True, detenida
+
+            # Justo antes de la transacción: se registra cada clave y se omiten
+            # las ya entregadas (campaña reanudada). Un mensaje con claves que
+            # quedaron en curso sin confirmarse (worker caído entre el envío y la
+            # confirmación) no se reenvía solo: queda con error para decidir con
+            # «Reanudar». Así sólo los mensajes en vuelo pueden quedar en duda
+            entregadas, desconocidas = outbox.reservar_entregas([
+                (fila['claves'][d], fila['campana'], d)
+                for d in fila['destinatarios'] if d in fila['claves']
+            ])
+            if entregadas:
+                fila['destinatarios'] = [
+                    d for d in fila['destinatarios'] if fila['claves'].get(d) not in entregadas
+                ]
+                if not fila['destinatarios']:
+                    return True, None
+                # El mensaje preparado llevaba también las direcciones ya entregadas
+                preparado = None
+            if desconocidas:
+                estados = {
+                    d: (DESCONOCIDO, "un intento anterior se interrumpió sin confirmar la entrega; "
+                                     "usa Reanudar para reenviarlo")
+                    for d in fila['destinatarios']
+                }
+            else:
+                estados = self.enviar_fila(fila, preparado)
+            # Se confirma en el hilo de envío, sin esperar a que se registre
+            self.confirmar(fila, estados)
+            return True, estados
+
+        def al_completar(indice, exito, resultado):
+            fila = filas[indice]
+            if exito and resultado is None:
+                outbox.finalizar(fila['id'], outbox.ENVIADO, "Ya entregado anteriormente")
+                return
+            if exito and isinstance(resultado, str):
+                # Campaña detenida: el mensaje vuelve sin haberse reservado
+                outbox.devolver(fila['id'])
+                return
+            if not exito:
+                # Fallo inesperado fuera del envío SMTP
+                resultado = {d: (PERMANENTE, resultado) for d in fila['destinatarios']}
+                self.confirmar(fila, resultado)
+            self.registrar(fila, resultado)
+
+        # Armar y serializar los mensajes no ocupa a los hilos de envío: se
+        # preparan por adelantado en una cola acotada
+        enviar_masivo([(fila,) for fila in filas], enviar,
+                      concurrencia=self.concurrencia, al_completar=al_completar,
+                      preparar=self.preparar_fila, preparadores=self.preparadores)
+
+    def ejecutar(self, una_vez=False, informar=None):
+        """Drenar la bandeja hasta que se pida detener; con `una_vez` termina
+        cuando no quedan mensajes pendientes ni reintentos programados"""
+        outbox.liberar_huerfanos()
+        ocupado = False
+        while not self._detener.is_set():
+            try:
+                procesados = self.procesar_lote()
+            except Exception as e:
+                self.ultimo_error = f"{datetime.now():%H:%M:%S} {str(e)}"
+                if informar:
+                    informar(f"Error: {str(e)}")
+                procesados = 0
+            if procesados:
+                ocupado = True
+                if informar:
+                    informar(f"{procesados} mensajes procesados | ✅ {self.enviados} | ❌ {self.fallidos}")
+                continue
+
+            if ocupado:
+                # La bandeja quedó sin trabajo inmediato: historial completo,
+                # limpieza de adjuntos y de los mensajes ya vencidos
+                escritor_historial.vaciar()
+                outbox.purgar_terminados()
+                outbox.purgar_adjuntos()
+                ocupado = False
+            if una_vez and not outbox.contar_pendientes():
+                break
+            outbox.liberar_huerfanos()
+            self._detener.wait(self.espera_vacia)
+        escritor_historial.vaciar()
+
+    def iniciar(self):
+        """Arrancar el worker en un hilo en segundo plano si no está corriendo"""
+        if self.activo():
+            return
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self.ejecutar, name="worker-envios", daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        """Pedir al worker que termine después del lote en curso"""
+        self._detener.set()
+
+    def activo(self):
+        return self._hilo is not None and self._hilo.is_alive()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Envía los mensajes de la bandeja de salida (outbox) de sistema_correos.db"
+    )
+    parser.add_argument('--db', help="Ruta de la base de datos (por defecto SISTEMA_CORREOS_DB o sistema_correos.db)")
+    parser.add_argument('--concurrencia', type=int, default=4, help="Envíos SMTP simultáneos")
+    parser.add_argument('--por-minuto', type=int, default=240, help="Correos por minuto (total)")
+    parser.add_argument('--rafaga', type=int, default=20, help="Ráfaga máxima")
+    parser.add_argument('--por-minuto-cuenta', type=int, default=60, help="Correos por minuto por cuenta")
+    parser.add_argument('--una-vez', action='store_true', help="Terminar cuando la bandeja quede vacía")
+    args = parser.parse_args()
+
+    if args.db:
+        base_datos.DB_FILE = args.db
+    base_datos.init_database()
+
+    limitador = LimitadorEnvios(args.por_minuto, args.rafaga, args.por_minuto_cuenta)
+    trabajador = TrabajadorEnvios(limitador=limitador, concurrencia=args.concurrencia)
+
+    def informar(texto):
+        print(f"[{datetime.now():%Y-%m-%d %H:%M:%S}] {texto}", flush=True)
+
+    informar(f"Worker {trabajador.nombre} procesando {base_datos.DB_FILE}")
+    try:
+        trabajador.ejecutar(una_vez=args.una_vez, informar=informar)
+    except KeyboardInterrupt:
+        informar("Detenido por el usuario")
+    finally:
+        trabajador.pool.cerrar_todo()
+    informar(f"Enviados: {trabajador.enviados} | Errores: {trabajador.fallidos}")
+
+
+if __name__ == '__main__':
+    main()